@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark of the time needed to import the CLay modules, and of the third-party packages they import.
+
+Each import runs in a fresh interpreter. Usage::
+
+    python benchmarks/import_time.py [-n REPEAT] [MODULE ...]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = ("clay", "clay.serializer", "clay.messenger", "clay.factory")
+
+#: The third-party packages of the backends, that the imports should not pull in
+BACKENDS = ("avro", "pyavroc", "hl7apy", "simplejson", "ujson", "orjson", "msgpack", "pika", "paho", "kafka",
+            "lz4", "zstandard")
+
+_SCRIPT = """
+import json, sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+backends = sorted(set(name.split(".")[0] for name, module in sys.modules.items() if module is not None) & set(%r))
+sys.stdout.write(json.dumps([elapsed, backends]))
+"""
+
+
+def measure(module, repeat):
+    """
+    Import the :attr:`module` :attr:`repeat` times, each one in a new interpreter
+
+    :return: a tuple with the sorted import times in seconds and the backends imported
+    """
+    times = []
+    backends = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", _SCRIPT % (module, BACKENDS)])
+        elapsed, backends = json.loads(output)
+        times.append(elapsed)
+    return sorted(times), backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="the number of imports of each module")
+    parser.add_argument("modules", nargs="*", default=MODULES, help="the modules to import")
+    args = parser.parse_args()
+
+    print("%-20s %10s %10s  %s" % ("module", "min (ms)", "median (ms)", "backends imported"))
+    for module in args.modules:
+        times, backends = measure(module, args.repeat)
+        print("%-20s %10.2f %10.2f  %s" % (module, times[0] * 1000, times[len(times) // 2] * 1000,
+                                          ", ".join(backends) or "-"))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:tabstop=4:expandtab
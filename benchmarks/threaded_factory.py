@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Stress benchmark of :class:`MessageFactory <clay.factory.MessageFactory>` used by many threads at once.
+
+Every thread creates the factory of the same catalog, then creates, serializes and retrieves messages of all its
+types. The catalog is fresh for each run, so the threads race to create the factory and to compile the codecs of the
+message types. At the end the benchmark checks that a single factory was created and that each schema was compiled
+once. Usage::
+
+    python benchmarks/threaded_factory.py [-t THREADS] [-n MESSAGES] [-s SCHEMAS]
+"""
+
+import argparse
+import threading
+import time
+import uuid
+
+from clay.factory import MessageFactory
+from clay.serializer.avro_serializer import AvroSerializer, AvroCache
+
+
+def make_catalog(schemas):
+    """
+    Return a catalog with :attr:`schemas` record schemas, with a unique name so that its factory is not cached yet
+    """
+    name = "STRESS_%s" % uuid.uuid4().hex
+    catalog = {"name": name, "version": 1}
+    for i in range(schemas):
+        catalog[i] = {
+            "namespace": name,
+            "name": "TYPE_%d" % i,
+            "type": "record",
+            "fields": [
+                {"name": "id", "type": "int"},
+                {"name": "name", "type": "string"},
+                {"name": "values", "type": {"type": "array", "items": "double"}},
+                # a field of a different type for each schema, so that their fingerprints differ
+                {"name": "field_%d" % i, "type": "long"}
+            ]
+        }
+    return catalog
+
+
+def worker(catalog, messages, factories, errors):
+    try:
+        factory = MessageFactory(AvroSerializer, catalog)
+        factories.append(factory)
+        types = [catalog[i]["name"] for i in sorted(k for k in catalog if isinstance(k, int))]
+        for n in range(messages):
+            message_type = types[n % len(types)]
+            content = {"id": n, "name": "message %d" % n, "values": [0.5, 1.5],
+                       "field_%d" % (n % len(types)): n}
+            message = factory.create(message_type, content)
+            retrieved = factory.retrieve(message.serialize())
+            if retrieved.id != n:
+                raise AssertionError("Message %d retrieved as %d" % (n, retrieved.id))
+    except Exception as e:
+        errors.append(e)
+
+
+def run(threads, messages, schemas):
+    """
+    Run the benchmark
+
+    :return: a tuple with the elapsed seconds, the number of factories created and the number of compilations
+    """
+    catalog = make_catalog(schemas)
+    misses = AvroCache().stats()["misses"]
+    factories = []
+    errors = []
+    workers = [threading.Thread(target=worker, args=(catalog, messages, factories, errors)) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise errors[0]
+    return elapsed, len(set(id(f) for f in factories)), AvroCache().stats()["misses"] - misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-t", "--threads", type=int, default=16, help="the number of threads")
+    parser.add_argument("-n", "--messages", type=int, default=2000, help="the number of messages of each thread")
+    parser.add_argument("-s", "--schemas", type=int, default=8, help="the number of message types")
+    args = parser.parse_args()
+
+    elapsed, factories, compilations = run(args.threads, args.messages, args.schemas)
+    total = args.threads * args.messages
+    print("%d threads, %d messages in %.2f s: %.0f messages/s" % (args.threads, total, elapsed, total / elapsed))
+    print("factories created: %d (expected 1)" % factories)
+    print("compilations: %d (expected at most %d)" % (compilations, 2 * args.schemas))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:tabstop=4:expandtab
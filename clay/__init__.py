@@ -20,7 +20,9 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import sys
-import imp
+import threading
+import types
+import importlib
 
 from clay.exceptions import SchemaException, MissingDependency
 
@@ -31,46 +33,151 @@ __url__ = "https://github.com/crs4/clay"
 MESSAGE_FACTORIES = {}
 CATALOGS = {}
 NAMED_CATALOGS = {}
+CATALOG_VERSIONS = {}
 
-class CustomLoader(object):
+# Serializes the updates of the registries above. They are read without locking, so every update publishes complete
+# objects with a single assignment. It is reentrant since the creation of a factory registers its catalog
+_REGISTRY_LOCK = threading.RLock()
 
-    DEPENDENCIES = {}
+# The locks of the factories being created, by key: a factory is built holding only its own lock, so that a slow build
+# (e.g. an eager compilation) doesn't hold up the factories of other catalogs
+_FACTORY_LOCKS = {}
 
-    def find_module(self, name, path=None):
-        if name in self.DEPENDENCIES:
-            self.path = path
-            return self
-        return None
+# The catalog versions are unsigned 32-bit integers in the version 2 envelopes
+_MAX_CATALOG_VERSION = (1 << 32) - 1
 
-    def load_module(self, name):
-        if name in sys.modules:
-            return sys.modules[name]
 
+class LazyModule(types.ModuleType):
+    """
+    Module whose backends (e.g., the serializers and the messengers that need third-party packages) are imported on the
+    first access of their attributes, so that importing the module doesn't import their dependencies. Use
+    :func:`lazy_module` to make a module lazy.
+
+    Each attribute has a list of candidate backends, that are tried in order: the attribute is taken from the first
+    one whose module can be imported, unless a backend has been chosen with :meth:`select_backend`. If none of them
+    can be imported, accessing the attribute raises :class:`MissingDependency <clay.exceptions.MissingDependency>`.
+    The attributes are then stored in the globals of the module, so the next accesses don't go through the lazy lookup
+    """
+
+    def __getattr__(self, name):
         try:
-            module_info = imp.find_module(name.split(".")[-1], self.path)
-            module = imp.load_module(name, *module_info)
-        except ImportError:
-            raise MissingDependency(self.DEPENDENCIES[name])
-        else:
-            sys.modules[name] = module
+            candidates = self._lazy_backends[name]
+        except KeyError:
+            raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+        error = None
+        for backend, module_name in candidates:
+            try:
+                module = importlib.import_module(module_name, self.__name__)
+            except MissingDependency as e:
+                error = e
+            else:
+                value = getattr(module, name)
+                setattr(self, name, value)
+                return value
+        raise error
+
+    def backends(self, name):
+        """
+        Return the names of the candidate backends of the attribute :attr:`name`
+        """
+        return [backend for backend, module_name in self._lazy_backends[name]]
+
+    def select_backend(self, name, backend):
+        """
+        Use the :attr:`backend` for the attribute :attr:`name` (e.g., `select_backend("AvroSerializer", "avro")` to
+        use the pure Python Avro library even if pyavroc is installed). The backend is imported immediately.
+        Objects already obtained from the previous backend, like the factories of its serializers, are not affected
+
+        :raise: :class:`MissingDependency <clay.exceptions.MissingDependency>` if the backend can't be imported
+        """
+        previous = self._lazy_backends[name]
+        candidates = [c for c in previous if c[0] == backend]
+        if not candidates:
+            raise ValueError("Unknown backend of %s: %s" % (name, backend))
+        value = self.__dict__.pop(name, None)
+        self._lazy_backends[name] = candidates
+        try:
+            getattr(self, name)
+        except MissingDependency:
+            self._lazy_backends[name] = previous
+            if value is not None:
+                setattr(self, name, value)
+            raise
+
+
+def lazy_module(name, backends):
+    """
+    Make the module :attr:`name` a :class:`LazyModule` with the :attr:`backends`
 
-        return module
+    :type backends: `dict`
+    :param backends: the candidate backends of each attribute, as a sequence of pairs with the name of the backend
+        and the name of its module, relative to the module
+    :return: the lazy module
+    """
+    module = sys.modules[name]
+    module._lazy_backends = dict(backends)
+    module.__class__ = LazyModule
+    return module
 
 
 class MessageFactoryMetaclass(type):
-    def __call__(cls, serializer, catalog):
+    def __call__(cls, serializer, catalog, **options):
+        key = (serializer, catalog['name'], catalog.get('version'), tuple(sorted(options.items())))
         try:
-            _factory = MESSAGE_FACTORIES[(serializer, catalog['name'])]
+            return MESSAGE_FACTORIES[key]
         except KeyError:
-            _factory = type.__call__(cls, serializer, catalog)
-            MESSAGE_FACTORIES[(serializer, catalog['name'])] = _factory
-        return _factory
+            pass
+        with _REGISTRY_LOCK:
+            lock = _FACTORY_LOCKS.setdefault(key, threading.Lock())
+        with lock:
+            # another thread may have created the factory while this one was waiting for the lock
+            try:
+                return MESSAGE_FACTORIES[key]
+            except KeyError:
+                _factory = type.__call__(cls, serializer, catalog, **options)
+                with _REGISTRY_LOCK:
+                    MESSAGE_FACTORIES[key] = _factory
+                    del _FACTORY_LOCKS[key]
+                return _factory
 
 
 def add_catalog(catalog):
-    CATALOGS[catalog["name"]] = catalog
-    NAMED_CATALOGS[catalog["name"]] = dict((v["name"], (k, v)) for (k, v) in catalog.viewitems()
-                                           if isinstance(k, int))
+    named_catalog = dict((v["name"], (k, v)) for (k, v) in catalog.items() if isinstance(k, int))
+    with _REGISTRY_LOCK:
+        # the named catalog is published first, since schema_from_name looks it up once it finds the catalog
+        NAMED_CATALOGS[catalog["name"]] = named_catalog
+        CATALOGS[catalog["name"]] = catalog
+        add_catalog_version(catalog)
+
+
+def add_catalog_version(catalog):
+    """
+    Register a version of a catalog, so that messages written with it can be read with other versions of the
+    catalog.
+
+    :param catalog: the catalog. It must have the `name` and `version` keys. The version must be a non-negative `int`
+        below 2 ** 32, since it is written in the envelope of the messages (see :func:`check_catalog_version`)
+    """
+    with _REGISTRY_LOCK:
+        versions = dict(CATALOG_VERSIONS.get(catalog["name"], {}))
+        versions[catalog.get("version")] = catalog
+        CATALOG_VERSIONS[catalog["name"]] = versions
+
+
+def check_catalog_version(version):
+    """
+    Check that the catalog :attr:`version` can be written in the envelope of the messages. `None`, for catalogs
+    without version, is accepted and nothing is written
+
+    :return: the version
+    :raise: :class:`SchemaException <clay.exceptions.SchemaException>` if the version is not a non-negative `int`
+        below 2 ** 32
+    """
+    if version is None:
+        return None
+    if not isinstance(version, int) or isinstance(version, bool) or not 0 <= version <= _MAX_CATALOG_VERSION:
+        raise SchemaException("Invalid catalog version: %r. It must be a non-negative int below 2 ** 32" % (version,))
+    return version
 
 
 def schema_from_name(schema_name, schema_catalog):
@@ -81,14 +188,53 @@ def schema_from_name(schema_name, schema_catalog):
     :param schema_name: The name of the schema to search
     :return: a tuple wit the ID of the schema and the schema itself
     """
-    named_catalog = dict((s["name"], (i, s)) for (i, s) in schema_catalog.viewitems()
-                         if isinstance(i, int))
+    if CATALOGS.get(schema_catalog.get("name")) is schema_catalog:
+        named_catalog = NAMED_CATALOGS[schema_catalog["name"]]
+    else:
+        named_catalog = dict((s["name"], (i, s)) for (i, s) in schema_catalog.items()
+                             if isinstance(i, int))
     try:
         return named_catalog[schema_name]
     except KeyError:
         raise SchemaException("Schema '%s' does not exist" % schema_name)
 
 
+def schema_from_version(schema_id, schema_catalog, version):
+    """
+    It searches the schema with the id :attr:`schema_id` in the version :attr:`version` of the
+    :attr:`schema_catalog`. The version must have been registered with :func:`add_catalog_version`, unless it is the
+    one of :attr:`schema_catalog`
+
+    :param schema_id: The ID of the schema to search
+    :param schema_catalog: The catalog of the schema
+    :param version: The version of the catalog. If `None` the :attr:`schema_catalog` itself is used
+    :return: the schema
+    """
+    try:
+        if version is None or version == schema_catalog.get("version"):
+            return schema_catalog[schema_id]
+        return CATALOG_VERSIONS[schema_catalog["name"]][version][schema_id]
+    except KeyError:
+        raise SchemaException("Schema id '%d' does not exist in version '%s' of '%s' catalog" %
+                              (schema_id, version, schema_catalog.get("name")))
+
+
+def resolve_schema(schema_id, schema_catalog, version):
+    """
+    Return the schemas to use to read a message written with the schema :attr:`schema_id` of the version
+    :attr:`version` of the :attr:`schema_catalog`. The reader's schema is the one of :attr:`schema_catalog` with the
+    same name of the writer's one
+
+    :return: a tuple with the writer's schema, the id of the reader's schema and the reader's schema
+    """
+    if version is None or version == schema_catalog.get("version"):
+        schema = schema_from_version(schema_id, schema_catalog, version)
+        return schema, schema_id, schema
+    writer_schema = schema_from_version(schema_id, schema_catalog, version)
+    reader_id, reader_schema = schema_from_name(writer_schema["name"], schema_catalog)
+    return writer_schema, reader_id, reader_schema
+
+
 def schema_from_id(schema_id, schema_domain):
     """
     It searches the schema with the id :attr:`schema_id` in the catalog
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Archives of CLay messages.
+
+An archive is a directory with an Avro Object Container File for each message type, named after it (e.g.,
+`TEST.avro`). The files can be read by any Avro implementation, and store the CLay catalog in the `clay.catalog`
+metadata, so that the archive can be read without knowing it in advance.
+
+The files are split in blocks delimited by sync markers, so that they can be read in parallel: the
+:class:`ArchiveReader` splits a file in byte ranges and each process decodes the blocks that start in its range.
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import zlib
+from io import BytesIO
+
+from . import schema_from_name
+from .exceptions import SchemaException
+from .serializer.codegen import get_codec
+from .serializer.envelope import MAX_VARINT_SIZE, encode_long, decode_long
+
+MAGIC = b"Obj\x01"
+SYNC_SIZE = 16
+CODECS = ("null", "deflate")
+
+_EXTENSION = ".avro"
+_READ_SIZE = 64 * 1024
+
+
+def _encode_metadata(metadata):
+    out = [encode_long(len(metadata))]
+    for key, value in sorted(metadata.items()):
+        key = key.encode("utf-8")
+        out.extend((encode_long(len(key)), key, encode_long(len(value)), value))
+    out.append(encode_long(0))
+    return b"".join(out)
+
+
+class _Incomplete(Exception):
+    # The data read so far end before the header
+    pass
+
+
+def _read_length(data, pos):
+    # Decodes a length of the header, that can't be negative
+    try:
+        length, pos = decode_long(data, pos)
+    except IndexError:
+        raise _Incomplete()
+    if length < 0:
+        raise SchemaException("Corrupted Avro object container file header")
+    return length, pos
+
+
+def _parse_header(data):
+    # Returns the metadata, the sync marker and the size of the header. Raises _Incomplete if data is incomplete
+    if data[:len(MAGIC)] != MAGIC:
+        raise SchemaException("Not an Avro object container file")
+    pos = len(MAGIC)
+    metadata = {}
+    try:
+        count, pos = decode_long(data, pos)
+    except IndexError:
+        raise _Incomplete()
+    while count:
+        if count < 0:
+            count = -count
+            size, pos = _read_length(data, pos)
+        for _ in range(count):
+            length, pos = _read_length(data, pos)
+            if pos + length > len(data):
+                raise _Incomplete()
+            try:
+                key = data[pos:pos + length].decode("utf-8")
+            except UnicodeDecodeError:
+                raise SchemaException("Corrupted Avro object container file header")
+            pos += length
+            length, pos = _read_length(data, pos)
+            if pos + length > len(data):
+                raise _Incomplete()
+            metadata[key] = data[pos:pos + length]
+            pos += length
+        try:
+            count, pos = decode_long(data, pos)
+        except IndexError:
+            raise _Incomplete()
+    if pos + SYNC_SIZE > len(data):
+        raise _Incomplete()
+    return metadata, data[pos:pos + SYNC_SIZE], pos + SYNC_SIZE
+
+
+def _read_header(f):
+    f.seek(0)
+    data = f.read(_READ_SIZE)
+    while True:
+        try:
+            return _parse_header(data)
+        except _Incomplete:
+            chunk = f.read(len(data))
+            if not chunk:
+                raise SchemaException("Truncated Avro object container file")
+            data += chunk
+
+
+def _find_sync(f, sync, pos):
+    # Returns the position of the first sync marker at or after pos, or None
+    f.seek(pos)
+    tail = b""
+    while True:
+        chunk = f.read(_READ_SIZE)
+        if not chunk:
+            return None
+        data = tail + chunk
+        i = data.find(sync)
+        if i >= 0:
+            return pos - len(tail) + i
+        tail = data[-(SYNC_SIZE - 1):]
+        pos += len(chunk)
+
+
+def _decode_catalog(value):
+    catalog = json.loads(value)
+    return dict((int(k) if k.isdigit() else k, v) for k, v in catalog.items())
+
+
+class _ContainerWriter(object):
+    """
+    Writer of an Avro Object Container File for a schema
+    """
+
+    def __init__(self, f, schema, metadata, codec, block_size):
+        self.f = f
+        self.codec = get_codec(schema)
+        self.compression = codec
+        self.block_size = block_size
+        self.sync = os.urandom(SYNC_SIZE)
+        self.buffer = BytesIO()
+        self.count = 0
+        metadata = dict(metadata)
+        metadata["avro.schema"] = json.dumps(schema).encode("utf-8")
+        metadata["avro.codec"] = codec.encode("ascii")
+        f.write(MAGIC + _encode_metadata(metadata) + self.sync)
+
+    def write(self, datum):
+        if not self.codec.validate(datum):
+            raise SchemaException(datum)
+        self.codec.encode(datum, self.buffer.write)
+        self.count += 1
+        if self.buffer.tell() >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        data = self.buffer.getvalue()
+        if self.compression == "deflate":
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+        self.f.write(encode_long(self.count) + encode_long(len(data)) + data + self.sync)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+class ArchiveWriter(object):
+    """
+    Writes messages in an archive. The messages of each type are written in the file of their type, which is created
+    the first time a message of that type is written. Existing files are overwritten.
+
+    The writer can be used as a context manager, that closes it on exit.
+
+    :type path: `str`
+    :param path: the directory of the archive. It is created if it doesn't exist
+
+    :type catalog: `dict`
+    :param catalog: the catalog of the messages
+
+    :type block_size: `int`
+    :param block_size: the size in bytes of the uncompressed data after which a block is written
+
+    :type codec: `str`
+    :param codec: the compression codec of the blocks: `null` or `deflate`
+    """
+
+    def __init__(self, path, catalog, block_size=64 * 1024, codec="deflate"):
+        if codec not in CODECS:
+            raise ValueError("Unsupported codec: %s" % codec)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.catalog = catalog
+        self.block_size = block_size
+        self.codec = codec
+        self._metadata = {"clay.catalog": json.dumps(catalog).encode("utf-8")}
+        self._writers = {}
+
+    def write(self, message):
+        """
+        Write a :class:`Message <clay.message.Message>` in the archive
+        """
+        self.write_datum(message.message_type, message.content)
+
+    def write_datum(self, message_type, datum):
+        """
+        Write the content of a message in the archive
+
+        :type message_type: `str`
+        :param message_type: the type of the message
+        :type datum: `dict`
+        :param datum: the content of the message
+        """
+        try:
+            writer = self._writers[message_type]
+        except KeyError:
+            schema = schema_from_name(message_type, self.catalog)[1]
+            f = open(os.path.join(self.path, message_type + _EXTENSION), "wb")
+            writer = self._writers[message_type] = _ContainerWriter(f, schema, self._metadata, self.codec,
+                                                                    self.block_size)
+        writer.write(datum)
+
+    def flush(self):
+        """
+        Write the pending blocks
+        """
+        for writer in self._writers.values():
+            writer.flush()
+            writer.f.flush()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_split(args):
+    # Decodes the blocks of the file that start in the byte range [start, end)
+    filename, start, end = args
+    data = []
+    with open(filename, "rb") as f:
+        metadata, sync, header_end = _read_header(f)
+        schema = json.loads(metadata["avro.schema"])
+        codec = get_codec(schema)
+        compression = metadata.get("avro.codec", b"null").decode("ascii")
+        if compression not in CODECS:
+            raise SchemaException("Unsupported codec: %s" % compression)
+
+        if start <= header_end:
+            pos = header_end
+        else:
+            pos = _find_sync(f, sync, start - SYNC_SIZE)
+            if pos is None:
+                return data
+            pos += SYNC_SIZE
+        while pos < end:
+            f.seek(pos)
+            head = f.read(2 * MAX_VARINT_SIZE)
+            if not head:
+                break
+            try:
+                count, i = decode_long(head)
+                size, i = decode_long(head, i)
+            except IndexError:
+                raise SchemaException("Truncated block at offset %d of %s" % (pos, filename))
+            if count < 0 or size < 0:
+                raise SchemaException("Corrupted block at offset %d of %s" % (pos, filename))
+            f.seek(pos + i)
+            block = f.read(size + SYNC_SIZE)
+            if len(block) != size + SYNC_SIZE or block[size:] != sync:
+                raise SchemaException("Corrupted block at offset %d of %s" % (pos, filename))
+            block = block[:size]
+            if compression == "deflate":
+                try:
+                    block = zlib.decompress(block, -zlib.MAX_WBITS)
+                except zlib.error:
+                    raise SchemaException("Corrupted block at offset %d of %s" % (pos, filename))
+            p = 0
+            for _ in range(count):
+                datum, p = codec.decode(block, p)
+                data.append(datum)
+            pos += i + size + SYNC_SIZE
+    return data
+
+
+class ArchiveReader(object):
+    """
+    Reads the messages of an archive written by :class:`ArchiveWriter` (or by any Avro writer with one file per
+    message type)
+
+    :type path: `str`
+    :param path: the directory of the archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def message_types(self):
+        """
+        The types of the messages in the archive
+        """
+        return sorted(name[:-len(_EXTENSION)] for name in os.listdir(self.path) if name.endswith(_EXTENSION))
+
+    def filename(self, message_type):
+        return os.path.join(self.path, message_type + _EXTENSION)
+
+    def catalog(self, message_type):
+        """
+        Return the catalog stored in the file of the :attr:`message_type`, or `None` if the file was not written
+        by CLay
+        """
+        with open(self.filename(message_type), "rb") as f:
+            metadata = _read_header(f)[0]
+        if "clay.catalog" not in metadata:
+            return None
+        return _decode_catalog(metadata["clay.catalog"])
+
+    def read(self, message_type, processes=1, split_size=None):
+        """
+        Return an iterator over the contents of the messages of the :attr:`message_type`, in the order they were
+        written
+
+        :type processes: `int`
+        :param processes: the number of processes that decode the file. If `None`, the number of CPUs is used.
+            With 1 the file is decoded in the calling process
+        :type split_size: `int`
+        :param split_size: the size in bytes of the ranges of the file decoded by each task. By default the file is
+            split in four ranges per process
+        """
+        filename = self.filename(message_type)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        size = os.path.getsize(filename)
+        if split_size is None:
+            split_size = max(size // (4 * processes), 1)
+        splits = [(filename, start, min(start + split_size, size)) for start in range(0, size, split_size)]
+        if processes == 1:
+            return itertools.chain.from_iterable(map(_read_split, splits))
+        return self._read_parallel(splits, processes)
+
+    @staticmethod
+    def _read_parallel(splits, processes):
+        pool = multiprocessing.Pool(processes)
+        try:
+            for data in pool.imap(_read_split, splits):
+                for datum in data:
+                    yield datum
+        finally:
+            pool.terminate()
+
+# vim:tabstop=4:expandtab
@@ -30,6 +30,12 @@ class SchemaException(Exception):
     pass
 
 
+class InvalidEnvelope(SchemaException):
+    """
+    Raised when a message is not a valid CLay envelope: it is truncated, corrupted or not a CLay message at all
+    """
+
+
 class MissingDependency(Exception):
     def __init__(self, requirement_name):
         self.requirement_name = requirement_name
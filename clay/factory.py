@@ -19,11 +19,15 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import time
+
 import clay
-from .message import Message
+from .message import Message, precompile_model
+from .serializer import ValidationPolicy
+from .serializer.precompiled import load_catalog, save_catalog
 
 
-class MessageFactory(object):
+class MessageFactory(object, metaclass=clay.MessageFactoryMetaclass):
     """
     Create a factory for the messages of the types included in the given catalog and that should be serialized with
     the given serializer class.
@@ -33,13 +37,80 @@ class MessageFactory(object):
 
     :type catalog: `dict`
     :param catalog: the catalog with the schemas to use for the message creation and serialization/deserialization
-    """
-    __metaclass__ = clay.MessageFactoryMetaclass
 
-    def __init__(self, serializer, catalog):
+    :type validation: :class:`ValidationPolicy <clay.serializer.ValidationPolicy>` or `str`
+    :param validation: the validation policy of the messages created by the factory (`full`, `sampled` or `trusted`).
+        If not specified, the one of the serializer is used
+
+    :type compilation: `str`
+    :param compilation: when the objects needed by the messages of each type are compiled: `lazy`, when the first
+        message of the type is created or retrieved, or `eager`, when the factory is created (see :meth:`warmup`). In
+        the latter case, the compilation times are in :attr:`compile_report`
+
+    :type cache_dir: `str`
+    :param cache_dir: if specified, the directory of the on-disk cache of the compiled catalogs (see
+        :mod:`clay.serializer.precompiled`). The compiled catalog is loaded from it if present, otherwise it is saved
+        there after its compilation. The compilation is always `eager`
+
+    :param options: further options of the serializer of the messages (see :meth:`Serializer.configure
+        <clay.serializer.Serializer.configure>`). For example, :class:`AvroSerializer
+        <clay.serializer.AvroSerializer>` accepts `versioned=True` to write the version of the catalog in the messages
+    """
+    LAZY = "lazy"
+    EAGER = "eager"
+
+    def __init__(self, serializer, catalog, validation=None, compilation=LAZY, cache_dir=None, **options):
+        if compilation not in (self.LAZY, self.EAGER):
+            raise ValueError("Unknown compilation policy: %s" % compilation)
+        loaded = cache_dir is not None and load_catalog(cache_dir, catalog)
+        if cache_dir is not None:
+            compilation = self.EAGER
         self.serializer = serializer
         self.catalog = catalog
+        self.validation = None if validation is None else ValidationPolicy.get(validation)
+        if self.validation is not None:
+            # the policy is shared by all the messages, so that the sampling is done across them
+            options["validation"] = self.validation
+        self.options = options
+        self.serializer.prepare(self.catalog)
         clay.add_catalog(self.catalog)
+        #: The report of the compilation returned by :meth:`warmup`, if the compilation is `eager`
+        self.compile_report = self.warmup() if compilation == self.EAGER else None
+        if cache_dir is not None and not loaded:
+            save_catalog(cache_dir, catalog)
+
+    def add_catalog_version(self, catalog):
+        """
+        Register another version of the catalog of the factory, so that the messages written with it can be retrieved.
+        Their content is converted to the schemas of the factory catalog following the Avro schema resolution rules
+
+        :type catalog: `dict`
+        :param catalog: the catalog. It must have the same name of the factory catalog and a different `version`
+        """
+        if catalog["name"] != self.catalog["name"]:
+            raise ValueError("The catalog '%s' is not a version of '%s'" % (catalog["name"], self.catalog["name"]))
+        clay.add_catalog_version(catalog)
+
+    def warmup(self):
+        """
+        Compile the objects needed by the messages of every type of the catalog: the writers and the readers of the
+        serializer (see :meth:`Serializer.precompile <clay.serializer.Serializer.precompile>`) and the structures of
+        the messages. Call it before the first messages, so that they don't pay for the compilation
+
+        :rtype: `dict`
+        :return: the time in seconds spent to compile the objects of each message type. Objects already compiled,
+            for example by another factory, take no time
+        :raise: :class:`SchemaException <clay.exceptions.SchemaException>` if a schema is not supported
+        """
+        report = {}
+        for schema_id, schema in self.catalog.items():
+            if not isinstance(schema_id, int):
+                continue
+            start = time.time()
+            self.serializer.precompile(schema)
+            precompile_model(schema["fields"])
+            report[schema["name"]] = time.time() - start
+        return report
 
     def create(self, message_type, content=None):
         """
@@ -64,28 +135,40 @@ class MessageFactory(object):
 
         >>> m = mf.create("DEPOSIT", {'timestamp': str(time.time()), 'client_id': 'John Doe', 'atm_id': 'ROME_101', 'amount': 100})
         """
-        msg = Message(message_type, self.catalog, self.serializer)
+        msg = Message(message_type, self.catalog, self.serializer, **self.options)
         msg.set_content(content)
         return msg
 
-    def retrieve(self, message):
+    def retrieve(self, message, fields=None):
         """
         Retrieve the content from the serialized message and return a populated instance of the
         :class:`Message <clay.message.Message>` class.
 
         :param message: the serialized message to deserialize and retrieve
+        :param fields: if specified, only these fields are decoded and populated. The other fields of the message
+            have their default value
         :return: a populated instance of the :class:`Message <clay.message.Message>` class
 
         >>> mf = MessageFactory(AvroSerializer, TEST_CATALOG)
-        >>> m = mf.retrieve('\\x00\\x10\\x8e\\xd1\\x87\\x01\\x06aaa')
+        >>> m = mf.retrieve(b'\\x00\\x10\\x8e\\xd1\\x87\\x01\\x06aaa')
         >>> m.id
         1111111
         >>> m.name
         "aaa"
+        >>> m = mf.retrieve(b'\\x00\\x10\\x8e\\xd1\\x87\\x01\\x06aaa', fields=["name"])
+        >>> m.id is None
+        True
         """
-        payload, payload_id, payload_schema = self.serializer.deserialize(message, self.catalog)
-        message = Message(payload_schema['name'], self.catalog, self.serializer)
-        message.set_content(payload)
+        if fields is None:
+            payload, payload_id, payload_schema = self.serializer.deserialize(message, self.catalog)
+        else:
+            payload, payload_id, payload_schema = self.serializer.deserialize(message, self.catalog, fields=fields)
+        trusted = self.serializer.trusts_payload(message)
+        message = Message(payload_schema['name'], self.catalog, self.serializer, **self.options)
+        if trusted:
+            message.adopt_content(payload)
+        else:
+            message.set_content(payload)
 
         return message
 
@@ -19,7 +19,8 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from collections import MutableMapping, Iterable
+import copy
+from collections.abc import MutableMapping, Iterable
 
 from . import schema_from_name
 from .exceptions import SchemaException, InvalidMessage, InvalidContent
@@ -51,10 +52,80 @@ def _is_record(t):
     return t["type"] == "record"
 
 
+def _field_type(field):
+    # Returns the type of the field other than "null"
+    if isinstance(field["type"], list):
+        # We allow only two kind of types
+        # FIXME: we are taking that the list contains only two types
+        if "null" not in field["type"]:
+            raise SchemaException("The schema structure is not valid: found more than one \
+                                  field type")
+        return [t for t in field["type"] if t != "null"][0]  # the field type other than "null"
+    return field["type"]
+
+
+# id of the fields schema -> (fields schema, names of the fields, types of the complex fields, defaults)
+_FIELDS_INFO = {}
+
+
+def _fields_info(schema):
+    # Returns the names of the fields of a record schema, the types of the fields that are arrays or records, and
+    # the default values of the fields
+    try:
+        return _FIELDS_INFO[id(schema)][1:]
+    except KeyError:
+        pass
+    complex_fields = {}
+    defaults = {}
+    for field in schema:
+        field_type = _field_type(field)
+        if _is_primitive(field_type):
+            defaults[field["name"]] = field.get("default")
+        elif isinstance(field_type, MutableMapping):
+            complex_fields[field["name"]] = field_type
+            defaults[field["name"]] = field.get("default")
+    info = (tuple(field["name"] for field in schema), complex_fields, defaults)
+    # the schema is kept in the entry, so that its id is not reused. With setdefault, threads that computed the
+    # info concurrently all get the first one stored
+    return _FIELDS_INFO.setdefault(id(schema), (schema,) + info)[1:]
+
+
+def precompile_model(schema):
+    """
+    Compute in advance the structures that the messages of a record schema and of its nested records need, so that the
+    first message of the schema doesn't pay for them
+
+    :param schema: the list of the fields of the record schema
+    :raise: :class:`SchemaException <clay.exceptions.SchemaException>` if the schema is not supported by the messages
+    """
+    for field_type in _fields_info(schema)[1].values():
+        while isinstance(field_type, MutableMapping) and field_type["type"] == "array":
+            field_type = field_type["items"]
+        if isinstance(field_type, MutableMapping) and field_type["type"] == "record":
+            precompile_model(field_type["fields"])
+
+
+def _wrap(field_type, content):
+    # Returns the _Array or the _Record of the field_type with content as its storage
+    if field_type["type"] == "array":
+        wrapper = _Array(field_type["items"])
+    else:
+        wrapper = _Record(field_type["fields"])
+    wrapper._adopt(content)
+    return wrapper
+
+
 class _Record(object):
+    """
+    A record of a message. Its storage is sparse: only the fields that have been assigned are stored, the others have
+    their default value, and the nested records and arrays are created on their first access
+    """
+
+    __slots__ = ("_schema", "fields", "_complex", "_defaults", "_content")
+
     def __init__(self, schema, init=False):
         self._schema = schema
-        self.fields = tuple(field["name"] for field in self.schema)
+        self.fields, self._complex, self._defaults = _fields_info(schema)
         if init:
             self._init_fields()
         else:
@@ -72,7 +143,7 @@ class _Record(object):
         else:
             if self._is_none():
                 self._init_fields()
-            for k, v in content.iteritems():
+            for k, v in content.items():
                 try:
                     setattr(self, k, v)
                 except ValueError:  # complex datatype
@@ -82,26 +153,18 @@ class _Record(object):
     def _init_fields(self):
         # Method to reinitialize the fields. It is used on the first initialization and when the _Record was set to None
         self._content = {}
-        for field in self.schema:
-            # self._fields_name.append(field["name"])
-            if isinstance(field["type"], list):
-                # We allow only two kind of types
-                # FIXME: we are taking that the list contains only two types
-                if "null" not in field["type"]:
-                    raise SchemaException("The schema structure is not valid: found more than one \
-                                          field type")
-                else:
-                    field_type = [t for t in field["type"] if t != "null"][0]  # the field type other than "null"
-            else:
-                field_type = field["type"]
 
-            if _is_primitive(field_type):
-                setattr(self, field["name"], field.get("default"))
-            elif isinstance(field_type, MutableMapping):
-                if field_type["type"] == "array":
-                    setattr(self, field["name"], _Array(field_type["items"]))
-                else:
-                    setattr(self, field["name"], _Record(field_type["fields"]))
+    def _adopt(self, content):
+        # Uses the content as the storage of the record, without copying it. The nested records and arrays are wrapped
+        # when they are accessed
+        self._content = content
+
+    def _default(self, name):
+        value = self._defaults.get(name)
+        # the defaults of the records and arrays are copied, since they can be modified
+        if value is not None and name in self._complex:
+            value = copy.deepcopy(value)
+        return value
 
     def _is_none(self):
         return self._content is None
@@ -110,12 +173,17 @@ class _Record(object):
         if self._is_none():
             return None
         d = {}
+        content = self._content
         for attr in self.fields:
-            value = getattr(self, attr)
             try:
-                d[attr] = value.content
-            except AttributeError:
-                d[attr] = value
+                value = content[attr]
+            except KeyError:
+                value = self._default(attr)
+            else:
+                # the fields that were never accessed still hold their plain content
+                if isinstance(value, (_Record, _Array)):
+                    value = value.content
+            d[attr] = value
         return d
 
     def __getattr__(self, item):
@@ -126,23 +194,25 @@ class _Record(object):
             raise AttributeError("Cannot access to fields in a None record")
 
         try:
-            return self._content[item]
+            value = self._content[item]
         except KeyError:
-            raise AttributeError
+            if item not in self._defaults:
+                raise AttributeError
+            value = self._default(item)
+            if item not in self._complex:
+                return value
+        if item in self._complex and not isinstance(value, (_Record, _Array)):
+            value = self._content[item] = _wrap(self._complex[item], value)
+        return value
 
     def __setattr__(self, key, value):
-        if key in ("fields", "_schema", "_content"):
+        if key in ("fields", "_schema", "_content", "_complex", "_defaults"):
             super(_Record, self).__setattr__(key, value)
         elif key in self.fields:
+            if key in self._complex:
+                raise ValueError("Cannot assign field of complex type")
             if self._is_none():
                 self._init_fields()
-            try:
-                to_be_set = getattr(self, key)
-            except AttributeError:
-                pass
-            else:
-                if isinstance(to_be_set, _Array) or isinstance(to_be_set, _Record):
-                    raise ValueError("Cannot assign field of complex type")
             # super(_Record, self).__setattr__(key, value)
             self._content[key] = value
         else:
@@ -152,13 +222,18 @@ class _Record(object):
         return repr(self._as_obj())
 
     def __eq__(self, other):
-        return self._content == other
+        if isinstance(other, (_Record, _Array)):
+            other = other.content
+        return self._as_obj() == other
 
 
 class _Array(object):
+    __slots__ = ("_content", "_primitive", "fields_schema")
+
     def __init__(self, fields_schema):
         self._content = None
-        if _is_primitive(fields_schema):
+        self._primitive = _is_primitive(fields_schema)
+        if self._primitive:
             self.fields_schema = fields_schema
         elif _is_array(fields_schema):
             self.fields_schema = fields_schema
@@ -194,30 +269,50 @@ class _Array(object):
             for item in content:
                 self.add(item)
 
+    def _adopt(self, content):
+        # Uses the content as the storage of the array, without copying it. The items are wrapped when they are
+        # accessed
+        self._content = content
+
     def _as_obj(self):
-        if self._is_none() or _is_primitive(self.fields_schema):
+        if self._is_none() or self._primitive:
             return self._content
         else:
             d = []
             for item in self._content:
-                d.append(item.content)
+                # the items that were never accessed still hold their plain content
+                d.append(item.content if isinstance(item, (_Record, _Array)) else item)
             return d
 
     def _is_none(self):
         return self._content is None
 
+    def _item(self, index):
+        item = self._content[index]
+        if self._primitive or isinstance(item, (_Record, _Array)):
+            return item
+        if _is_array(self.fields_schema):
+            wrapper = _Array(self.fields_schema["items"])
+        else:
+            wrapper = _Record(self.fields_schema)
+        wrapper._adopt(item)
+        self._content[index] = wrapper
+        return wrapper
+
     def __setitem__(self, index, item):
         self._content[index] = item
 
     def __getitem__(self, index):
-        return self._content[index]
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self._content)))]
+        return self._item(index)
 
     def __delitem__(self, index):
         del self._content[index]
 
     def __iter__(self):
-        for item in self._content:
-            yield item
+        for i in range(len(self._content)):
+            yield self._item(i)
 
     def __len__(self):
         return len(self._content)
@@ -292,8 +387,11 @@ class Message(object):
     :param catalog: The catalog containing the structure of the message
     :type serializer: `class`
     :param serializer: the :class:`Serializer <clay.serializer.Serializer>` class to use to serialize the message
+
+    :param options: the options of the serializer (see :meth:`Serializer.configure
+        <clay.serializer.Serializer.configure>`)
     """
-    def __init__(self, message_type, catalog, serializer=DummySerializer):
+    def __init__(self, message_type, catalog, serializer=DummySerializer, **options):
         try:
             self.schema = schema_from_name(message_type, catalog)[1]
         except SchemaException:
@@ -301,6 +399,8 @@ class Message(object):
         self._message_type = message_type
         self._domain = self.schema["namespace"]
         self._serializer = serializer(message_type, catalog)
+        if options:
+            self._serializer.configure(**options)
         self._struct = _Record(self.schema["fields"], init=True)
 
     domain = property(lambda self: self._domain, doc="The domain of the message in the catalog")
@@ -312,7 +412,7 @@ class Message(object):
         """
         Serializes the message using the :class:`Serializer <clay.serializer.Serializer>`
 
-        :rtype: `str`
+        :rtype: `bytes`
         :return: The serialized message
         """
         return self._serializer.serialize(self._struct.content)
@@ -330,6 +430,23 @@ class Message(object):
         if content is not None:
             self._struct.set_content(content)
 
+    def adopt_content(self, content):
+        """
+        Use the dictionary in input as the content of the message, without copying it. Unlike :meth:`set_content`,
+        the fields are not assigned one by one, and the nested records and arrays are wrapped only when they are
+        accessed. The dictionary is owned by the message afterwards.
+
+        It is meant for the data decoded by the serializers, which are known to follow the structure of the schema:
+        the keys that are not fields of the schema are not rejected, but ignored. The missing fields get their
+        default value
+
+        :type content: `dict`
+        :param content: the `dict` object with the values of the :class:`Message`'s fields
+        """
+        if not isinstance(content, MutableMapping):
+            raise InvalidContent()
+        self._struct._adopt(content)
+
     def __setattr__(self, name, value):
         if name in ("schema", "_message_type", "_domain", "_serializer", "_struct"):
             super(Message, self).__setattr__(name, value)
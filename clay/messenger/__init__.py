@@ -1,7 +1,5 @@
-import sys
 import logging
-from .. import CustomLoader
-from ..exceptions import MissingDependency
+from .. import lazy_module
 
 
 class Messenger(object):
@@ -19,32 +17,14 @@ class Dummy(Messenger):
     def send(self, serializer):
         print("Dummy using messenger", serializer.serialize())
 
-# Imports the other Messengers
-try:
-    from .amqp_messenger import AMQPMessenger, AMQPReceiver
-except MissingDependency as md:
-    pass
-
-try:
-    from .mqtt_messenger import MQTTMessenger, MQTTReceiver
-except MissingDependency:
-    pass
-
-try:
-    from .kafka_messenger import KafkaMessenger, KafkaError
-except MissingDependency:
-    pass
-
-class _MessengerLoader(CustomLoader):
-
-    DEPENDENCIES = {
-        "clay.messenger.AMQPMessenger": "pika",
-        "clay.messenger.AMQPReceiver": "pika",
-        "clay.messenger.MQTTMessenger": "paho",
-        "clay.messenger.MQTTReceiver": "paho",
-        "clay.messenger.KafkaMessenger": "kafka",
-    }
-
-sys.meta_path.append(_MessengerLoader())
+# The messengers are imported on their first use, with their dependencies
+lazy_module(__name__, {
+    "AMQPMessenger": (("pika", ".amqp_messenger"),),
+    "AMQPReceiver": (("pika", ".amqp_messenger"),),
+    "MQTTMessenger": (("paho", ".mqtt_messenger"),),
+    "MQTTReceiver": (("paho", ".mqtt_messenger"),),
+    "KafkaMessenger": (("kafka", ".kafka_messenger"),),
+    "KafkaError": (("kafka", ".kafka_messenger"),),
+})
 
 # vim:tabstop=4:expandtab
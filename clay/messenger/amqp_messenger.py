@@ -1,6 +1,6 @@
-import Queue
 import logging
 import ssl
+from queue import Queue
 
 from ..exceptions import MissingDependency
 
@@ -36,7 +36,7 @@ class AMQPMessenger(Messenger):
         self.host = host
         self.port = port
 
-        self._message_queue = Queue.Queue()
+        self._message_queue = Queue()
 
         self._app_name = None
         self._queues = {}
@@ -56,13 +56,13 @@ class AMQPMessenger(Messenger):
         """
         Set the key/cert files for TLS/SSL connection.
 
-        :type ca_certs: `basestring`
+        :type ca_certs: `str`
         :param ca_certs: a string path to the Certificate Authority certificate files
 
-        :type certfile: `basestring`
+        :type certfile: `str`
         :param certfile: a string path to the PEM encoded client certificate
 
-        :type keyfile: `basestring`
+        :type keyfile: `str`
         :param keyfile: a string path to the PEM encoded client private key
 
         If :meth:`set_tls()` is invoked without arguments, the SSL parameters are cleared and TLS/SSL for the
@@ -203,8 +203,8 @@ class AMQPMessenger(Messenger):
         except (AMQPConnectionError, ChannelClosed):
             if queue['response'] is False:
                 self._message_queue.put(message)
-                print "No connection, queuing"
-                print "There are {0} messages in the queue".format(self._message_queue.qsize())
+                print("No connection, queuing")
+                print("There are {0} messages in the queue".format(self._message_queue.qsize()))
             else:
                 raise MessengerError("ERROR_CONREFUSED")
 
@@ -266,13 +266,13 @@ class AMQPReceiver(object):
         """
         Set the key/cert files for TLS/SSL connection.
 
-        :type ca_certs: `basestring`
+        :type ca_certs: `str`
         :param ca_certs: a string path to the Certificate Authority certificate files
 
-        :type certfile: `basestring`
+        :type certfile: `str`
         :param certfile: a string path to the PEM encoded client certificate
 
-        :type keyfile: `basestring`
+        :type keyfile: `str`
         :param keyfile: a string path to the PEM encoded client private key
 
         If :meth:`set_tls()` is invoked without arguments, the SSL parameters are cleared and TLS/SSL for the
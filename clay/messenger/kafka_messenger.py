@@ -1,4 +1,4 @@
-import Queue
+from queue import Queue
 
 from ..exceptions import MissingDependency
 try:
@@ -33,7 +33,7 @@ class KafkaMessenger(Messenger):
         self.port = port
         self._url = "{:s}:{:d}".format(self.host, self.port)
 
-        self._spooling_queue = Queue.Queue()
+        self._spooling_queue = Queue()
 
         self._queues = {}
 
@@ -82,9 +82,9 @@ class KafkaMessenger(Messenger):
                 message.serialize())
         except Exception as ex:
             self._spooling_queue.put(message)
-            print "No connection, queuing"
-            print "There are {0} messages in the queue".format(self._spooling_queue.qsize())
-            print ex
+            print("No connection, queuing")
+            print("There are {0} messages in the queue".format(self._spooling_queue.qsize()))
+            print(ex)
 
         return result
 
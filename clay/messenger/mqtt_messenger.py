@@ -1,6 +1,7 @@
-import Queue
+import base64
 import socket
 import ssl
+from queue import Queue
 
 from ..exceptions import MissingDependency
 
@@ -35,7 +36,7 @@ class MQTTMessenger(Messenger):
 
         self._initialized = False
 
-        self._spooling_queue = Queue.Queue()
+        self._spooling_queue = Queue()
 
         self._app_name = None
         self._queues = {}
@@ -54,13 +55,13 @@ class MQTTMessenger(Messenger):
         """
         Set the key/cert files for TLS/SSL connection.
 
-        :type ca_certs: `basestring`
+        :type ca_certs: `str`
         :param ca_certs: a string path to the Certificate Authority certificate files
 
-        :type certfile: `basestring`
+        :type certfile: `str`
         :param certfile: a string path to the PEM encoded client certificate
 
-        :type keyfile: `basestring`
+        :type keyfile: `str`
         :param keyfile: a string path to the PEM encoded client private key
 
         If :meth:`set_tls()` is invoked without arguments, the SSL parameters are cleared and TLS/SSL for the
@@ -106,7 +107,7 @@ class MQTTMessenger(Messenger):
             routing_key = "{}/{}/{}".format(self._app_name, message.domain, message.message_type)
             MQTTPublisher.single(
                 topic=routing_key,
-                payload=message.serialize().encode('base64'),
+                payload=base64.encodebytes(message.serialize()),
                 qos=1,
                 hostname=self.host,
                 port=self.port,
@@ -115,9 +116,9 @@ class MQTTMessenger(Messenger):
             )
         except Exception as ex:
             self._spooling_queue.put(message)
-            print "No connection, queuing"
-            print "There are {0} messages in the queue".format(self._spooling_queue.qsize())
-            print ex
+            print("No connection, queuing")
+            print("There are {0} messages in the queue".format(self._spooling_queue.qsize()))
+            print(ex)
 
         return result
 
@@ -174,13 +175,13 @@ class MQTTReceiver(object):
         """
         Set the key/cert files for TLS/SSL connection.
 
-        :type ca_certs: `basestring`
+        :type ca_certs: `str`
         :param ca_certs: a string path to the Certificate Authority certificate files
 
-        :type certfile: `basestring`
+        :type certfile: `str`
         :param certfile: a string path to the PEM encoded client certificate
 
-        :type keyfile: `basestring`
+        :type keyfile: `str`
         :param keyfile: a string path to the PEM encoded client private key
 
         If :meth:`set_tls()` is invoked without arguments, the SSL parameters are cleared and TLS/SSL for the
@@ -207,7 +208,7 @@ class MQTTReceiver(object):
     def _handler_wrapper(self, client, userdata, message):
         if self.handler is None:
             raise MessengerErrorNoHandler()
-        self.handler(message.payload.decode('base64'), message.topic)
+        self.handler(base64.decodebytes(message.payload), message.topic)
 
     def run(self):
         if self._credentials is not None:
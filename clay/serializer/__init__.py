@@ -19,11 +19,72 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import sys
-from collections import defaultdict
+import time
+import itertools
+import threading
 
-from .. import CustomLoader
-from ..exceptions import MissingDependency
+from .envelope import encode_frame, decode_frame
+from .fingerprint import fingerprint
+from .. import lazy_module
+
+
+class ValidationPolicy(object):
+    """
+    Policy that establishes which data are validated against their schema before being serialized.
+    The levels are:
+
+     * `full`: every datum is validated
+     * `sampled`: one datum every :attr:`sample_rate` is validated
+     * `trusted`: the data are not validated. Invalid data are reported only if the encoder fails on them
+
+    When the validation runs and the datum is not valid, the serializer raises a
+    :class:`SchemaException <clay.exceptions.SchemaException>`.
+
+    :type level: `str`
+    :param level: the validation level
+
+    :type sample_rate: `int`
+    :param sample_rate: for the `sampled` level, the number of data every which one is validated
+    """
+
+    FULL = "full"
+    SAMPLED = "sampled"
+    TRUSTED = "trusted"
+
+    def __init__(self, level=FULL, sample_rate=100):
+        if level not in (self.FULL, self.SAMPLED, self.TRUSTED):
+            raise ValueError("Unknown validation level: %s" % level)
+        if sample_rate < 1:
+            raise ValueError("The sample rate must be a positive integer")
+        self.level = level
+        self.sample_rate = sample_rate
+        self._counter = itertools.count()
+
+    @classmethod
+    def get(cls, policy):
+        """
+        Return the :attr:`policy` as a :class:`ValidationPolicy`
+
+        :param policy: a :class:`ValidationPolicy` or the name of a level
+        """
+        if isinstance(policy, cls):
+            return policy
+        return cls(policy)
+
+    def should_validate(self):
+        """
+        Return whether the next datum has to be validated
+        """
+        if self.level == self.FULL:
+            return True
+        if self.level == self.TRUSTED:
+            return False
+        return next(self._counter) % self.sample_rate == 0
+
+    def __repr__(self):
+        if self.level == self.SAMPLED:
+            return "ValidationPolicy(%r, %r)" % (self.level, self.sample_rate)
+        return "ValidationPolicy(%r)" % self.level
 
 
 class Serializer(object):
@@ -38,9 +99,66 @@ class Serializer(object):
     :type schema_catalog:
     :param schema_catalog: The catalog containing the schema of the message to serialize
     """
+
+    #: The :class:`ValidationPolicy` of the serializer. It can be overridden by subclasses or per instance (for
+    #: example by the :class:`MessageFactory <clay.factory.MessageFactory>`). Serializers that don't validate the data
+    #: ignore it
+    validation = ValidationPolicy()
+
+    #: Whether the payloads returned by :meth:`deserialize` always follow the structure of their schema, as the ones
+    #: decoded from a binary encoding driven by the schema. The :class:`MessageFactory <clay.factory.MessageFactory>`
+    #: adopts them as the content of the messages (see :meth:`Message.adopt_content
+    #: <clay.message.Message.adopt_content>`), instead of assigning their fields one by one. Serializers that trust
+    #: the payloads of some messages only override :meth:`trusts_payload`
+    trusted_payloads = False
+
     def __init__(self, message_type, schema_catalog):
         pass
 
+    def configure(self, validation=None, **options):
+        """
+        Set the options of the serializer. Subclasses that support further options extend this method, and ignore the
+        ones that don't apply to them
+
+        :type validation: :class:`ValidationPolicy` or `str`
+        :param validation: if specified, it overrides the validation policy of the serializer
+        """
+        if validation is not None:
+            self.validation = ValidationPolicy.get(validation)
+
+    @classmethod
+    def prepare(cls, catalog):
+        """
+        Called by the :class:`MessageFactory <clay.factory.MessageFactory>` when it is created, with the catalog of its
+        messages. Subclasses can override it to compile their objects for the schemas in advance, and to reject the
+        catalogs they don't support by raising a :class:`SchemaException <clay.exceptions.SchemaException>`
+
+        :param catalog: the catalog of the factory
+        """
+        pass
+
+    @classmethod
+    def trusts_payload(cls, message):
+        """
+        Return whether the payload deserialized from the :attr:`message` follows the structure of its schema, so that
+        it can be adopted as the content of the message. By default, :attr:`trusted_payloads`
+
+        :param message: the serialized message
+        """
+        return cls.trusted_payloads
+
+    @classmethod
+    def precompile(cls, schema):
+        """
+        Compile in advance the objects that the serializer needs for the messages of the :attr:`schema` (e.g., its
+        writer and its reader), so that the first message of the schema doesn't pay for them. It is called by
+        :meth:`MessageFactory.warmup <clay.factory.MessageFactory.warmup>`. Subclasses that compile objects lazily
+        override it
+
+        :param schema: a schema of the catalog
+        """
+        pass
+
     def serialize(self, datum):
         """
         Method where the serialization is performed. Sublclasses should implement this method
@@ -52,17 +170,50 @@ class Serializer(object):
         pass
 
     @staticmethod
-    def deserialize(message, catalog):
+    def deserialize(message, catalog, fields=None):
         """
         Static or class method that receives a serialized message and the catalog containing the schema of the
         message and create a :class:`Message <clay.message.Message>` object from it
 
         :param message: The serialized message
         :param catalog: The catalog containing the message schema
+        :param fields: if specified, only these fields of the message are decoded and returned. Serializers that
+            support it skip the others without decoding them
         :return: :class:`Message <clay.message.Message>`
         """
         pass
 
+    def serialize_many(self, datums, framed=False):
+        """
+        Serialize several data of the message type of the serializer. Subclasses can override this method to share
+        the per-call work among the data
+
+        :param datums: the data to serialize
+        :type framed: `bool`
+        :param framed: if `True`, the messages are returned concatenated in a single frame, each one preceded by
+            its length (see :func:`encode_frame <clay.serializer.envelope.encode_frame>`)
+        :return: the `list` of the serialized messages or the frame
+        """
+        messages = [self.serialize(datum) for datum in datums]
+        return encode_frame(messages) if framed else messages
+
+    @classmethod
+    def deserialize_many(cls, messages, catalog, fields=None):
+        """
+        Deserialize several messages. Subclasses can override this method to share the per-call work among the
+        messages
+
+        :param messages: an iterable of serialized messages or a frame returned by :meth:`serialize_many`
+        :param catalog: The catalog containing the messages schemas
+        :param fields: if specified, only these fields of the messages are decoded
+        :return: a `list` with the results of :meth:`deserialize` for each message
+        """
+        if isinstance(messages, (bytes, bytearray)):
+            messages = decode_frame(messages)
+        if fields is None:
+            return [cls.deserialize(message, catalog) for message in messages]
+        return [cls.deserialize(message, catalog, fields=fields) for message in messages]
+
 
 class DummySerializer(Serializer):
     def __init__(self, message_type):
@@ -73,45 +224,128 @@ class DummySerializer(Serializer):
 
 
 class Cache(object):
+    """
+    Base class of the caches of the objects compiled from the schemas (e.g., writers and readers). Every subclass is
+    a singleton and implements :meth:`compile`.
 
-    _inst = None
+    The objects are keyed by their type and by the fingerprint of the schema (see
+    :func:`fingerprint <clay.serializer.fingerprint.fingerprint>`), so schemas with the same name but a different
+    structure don't share them. Reads don't take any lock; the compilation of a missing object happens under a lock,
+    so that every object is compiled once. If :attr:`maxsize` is set, the least recently used objects are evicted
+    when the cache grows beyond it.
+    """
+
+    #: The maximum number of objects in the cache. `None` means unbounded
+    maxsize = None
+
+    _lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
-        if cls._inst is None:
-            cls._inst = object.__new__(cls, *args, **kwargs)
-        return cls._inst
-
-    def __init__(self):
-        if "_cache" not in vars(self):
-            self._cache = defaultdict(dict)
-
-
-# Imports the other Serializers
-try:
-    from .pyavroc_serializer import AvroSerializer
-except MissingDependency:
-    try:
-        from .avro_serializer import AvroSerializer
-    except MissingDependency:
-        pass
+        inst = cls.__dict__.get("_inst")
+        if inst is None:
+            with Cache._lock:
+                inst = cls.__dict__.get("_inst")
+                if inst is None:
+                    inst = object.__new__(cls)
+                    inst._compile_lock = threading.Lock()
+                    inst._reset()
+                    cls._inst = inst
+        return inst
 
-try:
-    from .hl7_serializer import AbstractHL7Serializer
-except MissingDependency:
-    pass
+    def _reset(self):
+        self._cache = {}
+        self._clock = itertools.count()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._compile_time = 0.0
 
-try:
-    from .json_serializer import JSONSerializer
-except MissingDependency:
-    pass
+    def compile(self, obj_type, schema):
+        """
+        Create the object of type :attr:`obj_type` for the :attr:`schema`. Subclasses must implement it
+        """
+        raise NotImplementedError
 
+    def key(self, schema):
+        """
+        Return the key of the objects of the :attr:`schema`. By default, it is the fingerprint of the schema
+        """
+        return fingerprint(schema)
 
-class _SerializerLoader(CustomLoader):
+    def get(self, obj_type, schema):
+        """
+        Return the object of type :attr:`obj_type` for the :attr:`schema`, compiling it if it is not cached
+        """
+        key = (obj_type, self.key(schema))
+        try:
+            entry = self._cache[key]
+        except KeyError:
+            return self._get_missing(key, obj_type, schema)
+        # the hits and the recency are updated without locking: concurrent readers can only make them approximate
+        self._hits += 1
+        entry[1] = next(self._clock)
+        return entry[0]
+
+    def cached(self, obj_type, schema):
+        """
+        Return the object of type :attr:`obj_type` for the :attr:`schema` if it is cached, otherwise `None`. The
+        object is not compiled and the statistics are not updated
+        """
+        entry = self._cache.get((obj_type, self.key(schema)))
+        return None if entry is None else entry[0]
+
+    def _get_missing(self, key, obj_type, schema):
+        with self._compile_lock:
+            try:
+                entry = self._cache[key]
+            except KeyError:
+                pass
+            else:
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+            start = time.time()
+            obj = self.compile(obj_type, schema)
+            self._compile_time += time.time() - start
+            if self.maxsize is not None:
+                while self._cache and len(self._cache) >= self.maxsize:
+                    lru = min(self._cache, key=lambda k: self._cache[k][1])
+                    del self._cache[lru]
+                    self._evictions += 1
+            self._cache[key] = [obj, next(self._clock)]
+            return obj
+
+    def clear(self):
+        """
+        Remove all the objects from the cache and reset the statistics
+        """
+        with self._compile_lock:
+            self._reset()
+
+    def stats(self):
+        """
+        Return the statistics of the cache
+
+        :rtype: `dict`
+        :return: a `dict` with the number of `hits`, `misses` and `evictions`, the total `compile_time` in seconds, and
+            the current `size` and `maxsize` of the cache
+        """
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "compile_time": self._compile_time,
+            "size": len(self._cache),
+            "maxsize": self.maxsize
+        }
 
-    DEPENDENCIES = {
-        "clay.serializer.AvroSerializer": "avro",
-        "clay.serializer.AbstractHL7Serializer": "hl7apy",
-        "clay.serializer.JSONSerializer": "simplejson",
-    }
 
-sys.meta_path.append(_SerializerLoader())
\ No newline at end of file
+# The serializers are imported on their first use, with their dependencies
+lazy_module(__name__, {
+    "AvroSerializer": (("pyavroc", ".pyavroc_serializer"), ("avro", ".avro_serializer")),
+    "AbstractHL7Serializer": (("hl7", ".hl7_serializer"),),
+    "JSONSerializer": (("json", ".json_serializer"),),
+    "StructSerializer": (("struct", ".struct_serializer"),),
+    "MsgPackSerializer": (("msgpack", ".msgpack_serializer"),),
+    "MultiplexSerializer": (("multiplex", ".multiplex_serializer"),),
+})
@@ -19,7 +19,7 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from cStringIO import StringIO
+from io import BytesIO
 
 from ..exceptions import MissingDependency
 
@@ -29,93 +29,192 @@ try:
 except ImportError:
     raise MissingDependency("avro")
 
-from avro.io import DatumWriter, DatumReader, BinaryEncoder, BinaryDecoder, AvroTypeException
-
 # Package Imports
-from . import Serializer, Cache
-from .. import schema_from_name
+from . import Serializer
+from .codegen import CodecCache, add_schema_check, get_codec, get_resolver, get_projection
+from .compression import Compression
+# ENVELOPE_SCHEMA is re-exported since it was defined here before the envelope had its own module
+from .envelope import ENVELOPE_SCHEMA
+from .envelope import MAX_VARINT_SIZE, HEADER_V2, encode_long, envelope_prefix, encode_envelope, \
+    encode_envelope_v2, envelope_header_v2, parse_envelope, envelope_payload, encode_frame, decode_frame
+from .. import schema_from_name, resolve_schema, check_catalog_version
 from ..exceptions import SchemaException
 
-ENVELOPE_SCHEMA = {
-    "namespace": "CLAY",
-    "name": "ENVELOPE",
-    "type": "record",
-    "fields": [
-        {"name": "id", "type": "int"},
-        {"name": "payload", "type": "bytes"}
-    ]
-}
-
-
-class AvroCache(Cache):
-
-    SER = 0
-    DESER = 1
-
-    def get(self, obj_type, schema):
-        assert obj_type in (self.SER, self.DESER)
-        cache = self._cache[obj_type]
-        ser_name = schema["name"]
-        try:
-            obj = cache[ser_name]
-        except KeyError:
-            if obj_type == self.SER:
-                schema_obj = avro.schema.make_avsc_object(schema)
-                obj = DatumWriter(schema_obj)
-            else:
-                schema_obj = avro.schema.make_avsc_object(schema)
-                obj = DatumReader(schema_obj)
-            cache[ser_name] = obj
-        return obj
-
-
-class CustomEncoder(BinaryEncoder):
-    # This encoder fix problems with utf8 characters
-    def write_utf8(self, datum):
-        try:
-            self.write_bytes(datum.encode("utf-8"))
-        except UnicodeDecodeError:
-            self.write_bytes(unicode(datum, "utf-8").encode("utf-8"))
+
+# the schemas are parsed by avro only to check they are valid: the codecs are generated from them
+add_schema_check(avro.schema.make_avsc_object)
+
+#: The cache of the codecs of the serializer. The same codec encodes and decodes, and it is kept once in the cache of
+#: the generated codecs
+AvroCache = CodecCache
 
 
 class AvroSerializer(Serializer):
     """
-    Class to serialize and deserialize messages using Avro
+    Class to serialize and deserialize messages using Avro. The payloads are encoded by codecs generated for each
+    schema (see :mod:`clay.serializer.codegen`), that produce the same bytes as the reference Avro implementation.
+    The data are validated according to the :attr:`validation` policy.
+
+    Messages written with a different version of the catalog are decoded by resolving the writer's schema against the
+    reader's one, as specified by Avro. The writer's version has to be registered with
+    :func:`add_catalog_version <clay.add_catalog_version>`.
+
+    The payloads can be compressed according to a :class:`Compression <clay.serializer.compression.Compression>`
+    policy. Compressed payloads are decompressed transparently.
+
+    The messages are written in version 1 envelopes unless configured otherwise, and are read from envelopes of both
+    versions (see :mod:`clay.serializer.envelope`)
     """
 
+    trusted_payloads = True
+
     def __init__(self, message_type, schema_catalog):
+        super(AvroSerializer, self).__init__(message_type, schema_catalog)
         schema_id, schema = schema_from_name(message_type, schema_catalog)
+        self.message_type = message_type
         self.payload_schema_id = schema_id
-
-        self._payload_writer = AvroCache().get(AvroCache.SER, schema)
-        self._envelope_writer = AvroCache().get(AvroCache.SER, ENVELOPE_SCHEMA)
+        self.catalog_version = schema_catalog.get("version")
+
+        self._payload_codec = get_codec(schema)
+        self._buffer = BytesIO()
+        self.configure()
+
+    @classmethod
+    def precompile(cls, schema):
+        get_codec(schema)
+
+    def configure(self, validation=None, versioned=False, compression=None, envelope=1, checksum=True, **options):
+        """
+        :type versioned: `bool`
+        :param versioned: if `True`, the version of the catalog is written in the envelope, so that readers with a
+            different version of the catalog can decode the messages. The version must be a non-negative `int`
+            below 2 ** 32
+
+        :type compression: :class:`Compression <clay.serializer.compression.Compression>` or `str`
+        :param compression: the compression policy of the payloads, or the name of the codec that compresses the
+            payloads above the default threshold. If `None` the payloads are not compressed
+
+        :type envelope: `int`
+        :param envelope: the version of the envelope of the messages: 1 or 2
+
+        :type checksum: `bool`
+        :param checksum: for version 2 envelopes, whether to write the CRC32 of the payload in the envelope
+        """
+        if envelope not in (1, 2):
+            raise ValueError("Unsupported envelope version: %s" % envelope)
+        super(AvroSerializer, self).configure(validation, **options)
+        self._writer_catalog_version = check_catalog_version(self.catalog_version) if versioned else None
+        self._compression = Compression.get(compression)
+        self._envelope_format = envelope
+        self._checksum = checksum
+        self._envelope_id = envelope_prefix(self.payload_schema_id, self._writer_catalog_version)
+        # The payload is written after enough room for the envelope header, which is filled in afterwards, so that
+        # the whole message is built in this buffer and copied out only once
+        if envelope == 2:
+            self._header_size = HEADER_V2.size
+        else:
+            self._header_size = len(self._envelope_id) + MAX_VARINT_SIZE
+
+    def _envelope(self, payload, compression=None):
+        if self._envelope_format == 2:
+            return encode_envelope_v2(self.payload_schema_id, payload, self._writer_catalog_version, compression,
+                                      self._checksum)
+        return encode_envelope(self.payload_schema_id, payload, self._writer_catalog_version, compression)
 
     def serialize(self, datum):
-        payload_encoder = CustomEncoder(StringIO())
-        envelope_encoder = BinaryEncoder(StringIO())
-
-        try:
-            self._payload_writer.write(datum, payload_encoder)
-            envelope_message = {
-                "id": self.payload_schema_id,
-                "payload": payload_encoder.writer.getvalue()
-            }
-            self._envelope_writer.write(envelope_message, envelope_encoder)
-        except AvroTypeException:
+        if self.validation.should_validate() and not self._payload_codec.validate(datum):
             raise SchemaException(datum)
 
-        return envelope_encoder.writer.getvalue()
+        buf = self._buffer
+        buf.seek(0)
+        buf.truncate()
+        buf.write(b"\x00" * self._header_size)
+        self._payload_codec.encode(datum, buf.write)
+
+        size = buf.tell() - self._header_size
+        if self._compression is not None and size >= self._compression.threshold:
+            codec_id, payload = self._compression.compress(self.message_type, buf.getvalue()[self._header_size:])
+            if codec_id is not None:
+                return self._envelope(payload, codec_id)
+
+        if self._envelope_format == 2:
+            # the view must be released before the buffer is written again
+            with buf.getbuffer() as view:
+                header = envelope_header_v2(self.payload_schema_id, view[self._header_size:],
+                                            self._writer_catalog_version, checksum=self._checksum)
+        else:
+            header = self._envelope_id + encode_long(size)
+        start = self._header_size - len(header)
+        buf.seek(start)
+        buf.write(header)
+        buf.seek(start)
+        return buf.read()
+
+    def serialize_many(self, datums, framed=False):
+        if self._compression is not None or self._envelope_format == 2:
+            # the cost of the compression or of the checksum outweighs the per-call setup
+            return super(AvroSerializer, self).serialize_many(datums, framed)
+        should_validate = self.validation.should_validate
+        validate = self._payload_codec.validate
+        encode = self._payload_codec.encode
+        envelope_id = self._envelope_id
+        header_size = self._header_size
+        padding = b"\x00" * header_size
+        buf = self._buffer
+        write = buf.write
+
+        messages = []
+        for datum in datums:
+            if should_validate() and not validate(datum):
+                raise SchemaException(datum)
+            buf.seek(0)
+            buf.truncate()
+            write(padding)
+            encode(datum, write)
+            header = envelope_id + encode_long(buf.tell() - header_size)
+            start = header_size - len(header)
+            buf.seek(start)
+            write(header)
+            buf.seek(start)
+            messages.append(buf.read())
+        return encode_frame(messages) if framed else messages
 
     @staticmethod
-    def deserialize(message, catalog):
-        envelope_reader = AvroCache().get(AvroCache.DESER, ENVELOPE_SCHEMA)
-        envelope_decoder = BinaryDecoder(StringIO(message))
-        envelope = envelope_reader.read(envelope_decoder)
-
-        payload_id = envelope["id"]
-        payload_schema = catalog[payload_id]
-        payload_reader = AvroCache().get(AvroCache.DESER, payload_schema)
-        payload_decoder = BinaryDecoder(StringIO(envelope["payload"]))
-        payload = payload_reader.read(payload_decoder)
-
-        return payload, payload_id, payload_schema
\ No newline at end of file
+    def _payload_codec_of(header, catalog, fields):
+        writer_schema, payload_id, payload_schema = resolve_schema(header.schema_id, catalog, header.catalog_version)
+        if fields is not None:
+            payload_codec = get_projection(writer_schema, payload_schema, fields)
+        elif writer_schema is payload_schema:
+            payload_codec = get_codec(payload_schema)
+        else:
+            payload_codec = get_resolver(writer_schema, payload_schema)
+        return payload_id, payload_schema, payload_codec
+
+    @classmethod
+    def deserialize(cls, message, catalog, fields=None):
+        header = parse_envelope(message)
+        payload_id, payload_schema, payload_codec = cls._payload_codec_of(header, catalog, fields)
+        # if not compressed, the payload is decoded in place, without copying it out of the message
+        buf, start, end = envelope_payload(message, header)
+        payload = payload_codec.decode(buf, start, end)[0]
+
+        return payload, payload_id, payload_schema
+
+    @classmethod
+    def deserialize_many(cls, messages, catalog, fields=None):
+        if isinstance(messages, (bytes, bytearray)):
+            messages = decode_frame(messages)
+        # the codecs are looked up once per schema and catalog version
+        codecs = {}
+        results = []
+        for message in messages:
+            header = parse_envelope(message)
+            key = (header.schema_id, header.catalog_version)
+            try:
+                payload_id, payload_schema, payload_codec = codecs[key]
+            except KeyError:
+                payload_id, payload_schema, payload_codec = codecs[key] = \
+                    cls._payload_codec_of(header, catalog, fields)
+            buf, start, end = envelope_payload(message, header)
+            results.append((payload_codec.decode(buf, start, end)[0], payload_id, payload_schema))
+        return results
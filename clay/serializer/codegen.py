@@ -0,0 +1,788 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compiler of catalog schemas into specialized Avro binary codecs.
+
+Instead of walking the schema for every datum, as the :mod:`avro.io` generic DatumWriter/DatumReader do, the schema is
+walked once to generate the Python source of straight-line encode, decode and validate functions. The generated
+functions produce the same bytes as the reference implementation.
+"""
+
+import copy
+import struct
+
+from . import Cache
+from .envelope import encode_long, decode_long
+from .fingerprint import PRIMITIVE_TYPES, NAMED_TYPES, fullname, fingerprint, reader_key
+from ..exceptions import SchemaException
+
+#: The version of the generated code. It must be changed whenever the generated code changes, so that the codecs
+#: compiled by the previous versions and saved on disk (see :mod:`clay.serializer.precompiled`) are not used anymore
+CODEGEN_VERSION = 4
+
+_INT_RANGE = (-(1 << 31), (1 << 31) - 1)
+_LONG_RANGE = (-(1 << 63), (1 << 63) - 1)
+
+# The types the data of a type can be read as, besides the type itself
+_PROMOTIONS = {
+    "int": ("long", "float", "double"),
+    "long": ("float", "double"),
+    "float": ("double",),
+    "string": ("bytes",),
+    "bytes": ("string",),
+}
+
+
+def _skip_long(buf, pos):
+    while buf[pos] & 0x80:
+        pos += 1
+    return pos + 1
+
+# The names available to the generated code
+_GLOBALS = {
+    "_L": encode_long,
+    "_RL": decode_long,
+    "_SL": _skip_long,
+    "_DC": copy.deepcopy,
+    "_PF": struct.Struct("<f").pack,
+    "_PD": struct.Struct("<d").pack,
+    "_UF": struct.Struct("<f").unpack_from,
+    "_UD": struct.Struct("<d").unpack_from,
+    "_INTS": int,
+    "_NUMS": (int, float),
+    "_SE": SchemaException,
+}
+
+
+def _normalize(schema, namespace, names):
+    # Returns the schema as a tree where the primitive types are strings, the unions are dict with type "union" and
+    # the references to named types are replaced by the node of the named type
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_TYPES:
+            return schema
+        try:
+            return names[fullname(schema, namespace)]
+        except KeyError:
+            try:
+                return names[schema]
+            except KeyError:
+                raise SchemaException("Unknown type: %s" % schema)
+    if isinstance(schema, list):
+        return {"type": "union", "schemas": [_normalize(s, namespace, names) for s in schema]}
+
+    schema_type = schema["type"]
+    if schema_type in PRIMITIVE_TYPES:
+        return schema_type
+    if not isinstance(schema_type, str):
+        return _normalize(schema_type, namespace, names)
+
+    if schema_type in NAMED_TYPES:
+        name = fullname(schema["name"], schema.get("namespace", namespace))
+        if "." in name:
+            namespace = name.rsplit(".", 1)[0]
+        node = {"type": schema_type, "name": name}
+        names[name] = node
+        if schema_type == "record":
+            node["fields"] = [dict(f, type=_normalize(f["type"], namespace, names)) for f in schema["fields"]]
+        elif schema_type == "enum":
+            node["symbols"] = tuple(schema["symbols"])
+        else:
+            node["size"] = schema["size"]
+        return node
+    if schema_type == "array":
+        return {"type": "array", "items": _normalize(schema["items"], namespace, names)}
+    if schema_type == "map":
+        return {"type": "map", "values": _normalize(schema["values"], namespace, names)}
+    raise SchemaException("Unknown type: %s" % schema_type)
+
+
+def _type(node):
+    return node if isinstance(node, str) else node["type"]
+
+
+def _collect_names(schema, namespace, names):
+    # Collects the definitions of the named types of the schema, with the namespace they are defined in
+    if isinstance(schema, str):
+        return
+    if isinstance(schema, list):
+        for s in schema:
+            _collect_names(s, namespace, names)
+        return
+    schema_type = schema["type"]
+    if not isinstance(schema_type, str):
+        return _collect_names(schema_type, namespace, names)
+    if schema_type in NAMED_TYPES:
+        name = fullname(schema["name"], schema.get("namespace", namespace))
+        names[name] = (schema, namespace)
+        if schema_type == "record":
+            inner_namespace = name.rsplit(".", 1)[0] if "." in name else namespace
+            for field in schema["fields"]:
+                _collect_names(field["type"], inner_namespace, names)
+    elif schema_type == "array":
+        _collect_names(schema["items"], namespace, names)
+    elif schema_type == "map":
+        _collect_names(schema["values"], namespace, names)
+
+
+def _expand_names(schema, namespace, names, defined):
+    # Returns the schema with full names only, where the first reference to each named type is replaced by its
+    # definition, so that the schema stays valid when the fields defining the named types are dropped
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_TYPES:
+            return schema
+        name = fullname(schema, namespace)
+        if name not in names:
+            name = schema
+        if name in defined:
+            return name
+        definition, definition_namespace = names[name]
+        return _expand_names(definition, definition_namespace, names, defined)
+    if isinstance(schema, list):
+        return [_expand_names(s, namespace, names, defined) for s in schema]
+
+    schema_type = schema["type"]
+    if not isinstance(schema_type, str):
+        return _expand_names(schema_type, namespace, names, defined)
+    if schema_type in NAMED_TYPES:
+        name = fullname(schema["name"], schema.get("namespace", namespace))
+        defined.add(name)
+        expanded = dict((k, v) for k, v in schema.items() if k != "namespace")
+        expanded["name"] = name
+        if schema_type == "record":
+            inner_namespace = name.rsplit(".", 1)[0] if "." in name else namespace
+            expanded["fields"] = [dict(f, type=_expand_names(f["type"], inner_namespace, names, defined))
+                                  for f in schema["fields"]]
+        return expanded
+    if schema_type == "array":
+        return dict(schema, items=_expand_names(schema["items"], namespace, names, defined))
+    if schema_type == "map":
+        return dict(schema, values=_expand_names(schema["values"], namespace, names, defined))
+    return schema
+
+
+_PROJECTIONS = {}
+_MAX_PROJECTIONS = 4096
+
+
+def project(schema, fields):
+    """
+    Return the record :attr:`schema` reduced to the :attr:`fields`. Used as reader's schema, it decodes only those
+    fields and skips the others. The projections are memoized, so the same schema object is returned for the same
+    schema (including the defaults of its fields, see :func:`reader_key <clay.serializer.fingerprint.reader_key>`)
+    and fields
+
+    :type schema: `dict`
+    :param schema: a record schema
+    :param fields: the names of the fields to keep
+    :rtype: `dict`
+    """
+    fields = frozenset(fields)
+    key = (reader_key(schema), fields)
+    try:
+        return _PROJECTIONS[key]
+    except KeyError:
+        pass
+    unknown = fields.difference(f["name"] for f in schema["fields"])
+    if unknown:
+        raise SchemaException("Unknown fields of %s: %s" % (schema["name"], ", ".join(sorted(unknown))))
+    names = {}
+    _collect_names(schema, None, names)
+    namespace = schema.get("namespace")
+    root_name = fullname(schema["name"], namespace)
+    if "." in root_name:
+        namespace = root_name.rsplit(".", 1)[0]
+    defined = set([root_name])
+    projection = dict(schema, fields=[dict(f, type=_expand_names(f["type"], namespace, names, defined))
+                                      for f in schema["fields"] if f["name"] in fields])
+    if len(_PROJECTIONS) >= _MAX_PROJECTIONS:
+        _PROJECTIONS.clear()
+    # threads that projected the same fields concurrently all get the first projection stored
+    return _PROJECTIONS.setdefault(key, projection)
+
+
+class _Compiler(object):
+    """
+    Generates the source of the codec functions of a schema
+    """
+
+    def __init__(self, schema, reader_schema=None):
+        self.root = _normalize(schema, None, {})
+        self.reader_root = self.root if reader_schema is None else _normalize(reader_schema, None, {})
+        self.blocks = []
+        self.constants = []
+        self.constant_names = {}
+        self.functions = {}
+        self.counter = 0
+
+    def var(self, prefix="v"):
+        self.counter += 1
+        return "%s%d" % (prefix, self.counter)
+
+    def function(self, kind, *nodes):
+        # Returns the name of the function of the given kind for the nodes, generating it the first time
+        key = (kind,) + tuple(id(node) for node in nodes)
+        try:
+            return self.functions[key]
+        except KeyError:
+            name = self.functions[key] = self.var(kind)
+            lines = []
+            getattr(self, "_%s_function" % kind)(name, lines, *nodes)
+            self.blocks.append("\n".join(lines))
+            return name
+
+    def constant(self, value):
+        source = repr(value)
+        try:
+            return self.constant_names[source]
+        except KeyError:
+            name = self.constant_names[source] = self.var("_C")
+            self.constants.append("%s = %s" % (name, source))
+            return name
+
+    def source(self):
+        lines = ["def encode(d, w):"]
+        self._encode_field(self.root, "d", lines, 1, True)
+        self.blocks.append("\n".join(lines + [
+            "def decode(b, p):",
+            "    %s" % "\n    ".join(self.decode_lines(self.root, self.reader_root, "d", 0)),
+            "    return d, p",
+            "def validate(d):",
+            "    return %s" % self.check(self.root, "d", True),
+        ]))
+        return "\n".join(self.constants + self.blocks) + "\n"
+
+    # Validation
+
+    def check(self, node, v, exact):
+        # Returns an expression that is true when the value in v is an instance of the node. If not exact, records,
+        # arrays and maps are only checked for their Python type
+        t = _type(node)
+        if t == "null":
+            return "%s is None" % v
+        if t == "boolean":
+            return "isinstance(%s, bool)" % v
+        if t == "int":
+            return "isinstance(%s, _INTS) and %d <= %s <= %d" % (v, _INT_RANGE[0], v, _INT_RANGE[1])
+        if t == "long":
+            return "isinstance(%s, _INTS) and %d <= %s <= %d" % (v, _LONG_RANGE[0], v, _LONG_RANGE[1])
+        if t in ("float", "double"):
+            return "isinstance(%s, _NUMS)" % v
+        if t == "string":
+            return "isinstance(%s, (str, bytes))" % v
+        if t == "bytes":
+            return "isinstance(%s, bytes)" % v
+        if t == "fixed":
+            return "isinstance(%s, bytes) and len(%s) == %d" % (v, v, node["size"])
+        if t == "enum":
+            return "%s in %s" % (v, self.constant(node["symbols"]))
+        if not exact and t in ("record", "map"):
+            return "isinstance(%s, dict)" % v
+        if not exact and t == "array":
+            return "isinstance(%s, list)" % v
+        return "%s(%s)" % (self.function("validate", node), v)
+
+    def _validate_function(self, name, lines, node):
+        t = node["type"]
+        lines.append("def %s(d):" % name)
+        if t == "record":
+            lines.append("    if not isinstance(d, dict):")
+            lines.append("        return False")
+            lines.append("    g = d.get")
+            for field in node["fields"]:
+                v = self.var()
+                lines.append("    %s = g(%r)" % (v, field["name"]))
+                lines.append("    if not (%s):" % self.check(field["type"], v, True))
+                lines.append("        return False")
+            lines.append("    return True")
+        elif t == "array":
+            lines.append("    if not isinstance(d, list):")
+            lines.append("        return False")
+            lines.append("    for x in d:")
+            lines.append("        if not (%s):" % self.check(node["items"], "x", True))
+            lines.append("            return False")
+            lines.append("    return True")
+        elif t == "map":
+            lines.append("    if not isinstance(d, dict):")
+            lines.append("        return False")
+            lines.append("    for k, x in d.items():")
+            lines.append("        if not isinstance(k, (str, bytes)) or not (%s):" %
+                         self.check(node["values"], "x", True))
+            lines.append("            return False")
+            lines.append("    return True")
+        else:
+            lines.append("    return %s" % " or ".join("(%s)" % self.check(s, "d", True) for s in node["schemas"]))
+
+    # Encoding
+
+    def encode_statement(self, node, v):
+        t = _type(node)
+        if t in ("record", "array", "map", "union"):
+            return "%s(%s, w)" % (self.function("encode", node), v)
+        return "; ".join(self.encode_lines(node, v)) or "pass"
+
+    def encode_lines(self, node, v):
+        t = _type(node)
+        if t == "null":
+            return []
+        if t == "boolean":
+            return ['w(b"\\x01" if %s else b"\\x00")' % v]
+        if t in ("int", "long"):
+            return ["w(_L(%s))" % v]
+        if t == "float":
+            return ["w(_PF(%s))" % v]
+        if t == "double":
+            return ["w(_PD(%s))" % v]
+        if t == "string":
+            return ["w(_L(len(%s)))" % v, "w(%s)" % v]
+        if t == "bytes":
+            return ["w(_L(len(%s)))" % v, "w(%s)" % v]
+        if t == "fixed":
+            return ["w(%s)" % v]
+        if t == "enum":
+            encoded = dict((s, encode_long(i)) for i, s in enumerate(node["symbols"]))
+            return ["w(%s[%s])" % (self.constant(encoded), v)]
+        return [self.encode_statement(node, v)]
+
+    def _encode_field(self, node, v, lines, indent, block=False):
+        # When the lines are the only ones of a block, a pass is needed for the types that are not written at all
+        pad = "    " * indent
+        if _type(node) == "string":
+            lines.append("%sif isinstance(%s, str):" % (pad, v))
+            lines.append("%s    %s = %s.encode('utf-8')" % (pad, v, v))
+        for line in self.encode_lines(node, v) or (["pass"] if block else []):
+            lines.append(pad + line)
+
+    def _encode_function(self, name, lines, node):
+        t = node["type"]
+        lines.append("def %s(d, w):" % name)
+        if t == "record":
+            lines.append("    g = d.get")
+            for field in node["fields"]:
+                v = self.var()
+                lines.append("    %s = g(%r)" % (v, field["name"]))
+                self._encode_field(field["type"], v, lines, 1)
+        elif t in ("array", "map"):
+            lines.append("    if d:")
+            lines.append("        w(_L(len(d)))")
+            if t == "array":
+                lines.append("        for x in d:")
+                self._encode_field(node["items"], "x", lines, 3, True)
+            else:
+                lines.append("        for k, x in d.items():")
+                self._encode_field("string", "k", lines, 3)
+                self._encode_field(node["values"], "x", lines, 3)
+            lines.append('    w(b"\\x00")')
+        else:
+            # The reference implementation writes the last branch the datum is valid for. Branches with the same
+            # Python type are told apart by full validation
+            schemas = node["schemas"]
+            kinds = [{"record": "dict", "map": "dict", "array": "list"}.get(_type(s)) for s in schemas]
+            keyword = "if"
+            for i in reversed(range(len(schemas))):
+                exact = kinds[i] is not None and kinds.count(kinds[i]) > 1
+                lines.append("    %s %s:" % (keyword, self.check(schemas[i], "d", exact)))
+                lines.append("        w(%r)" % encode_long(i))
+                self._encode_field(schemas[i], "d", lines, 2)
+                keyword = "elif"
+            lines.append("    else:")
+            lines.append("        raise _SE(d)")
+
+    # Decoding
+
+    def match(self, writer, reader):
+        # Returns whether data written with the writer's schema can be read with the reader's one
+        wt, rt = _type(writer), _type(reader)
+        if wt == "union" or rt == "union":
+            return True
+        if wt == rt:
+            if wt in ("record", "enum"):
+                return writer["name"].rsplit(".", 1)[-1] == reader["name"].rsplit(".", 1)[-1]
+            if wt == "fixed":
+                return writer["name"].rsplit(".", 1)[-1] == reader["name"].rsplit(".", 1)[-1] and \
+                    writer["size"] == reader["size"]
+            if wt == "array":
+                return self.match(writer["items"], reader["items"])
+            if wt == "map":
+                return self.match(writer["values"], reader["values"])
+            return True
+        return rt in _PROMOTIONS.get(wt, ())
+
+    def reader_branch(self, writer, reader):
+        # Returns the branch of the reader's union that reads the data of the writer's schema, if any
+        for branch in reader["schemas"]:
+            if _type(branch) != "union" and self.match(writer, branch):
+                return branch
+
+    def decode_lines(self, writer, reader, target, indent):
+        # Returns the lines that decode the data of the writer's schema as data of the reader's schema into target
+        pad = "    " * indent
+        wt, rt = _type(writer), _type(reader)
+        if wt != "union" and rt == "union":
+            branch = self.reader_branch(writer, reader)
+            if branch is None:
+                raise SchemaException("Cannot read %s data with the reader's schema" % wt)
+            return self.decode_lines(writer, branch, target, indent)
+        if not self.match(writer, reader):
+            raise SchemaException("Cannot read %s data as %s" % (wt, rt))
+
+        if wt == "null":
+            return ["%s%s = None" % (pad, target)]
+        if wt == "boolean":
+            return ["%s%s = b[p] == 1" % (pad, target), "%sp += 1" % pad]
+        if wt in ("int", "long"):
+            lines = ["%s%s, p = _RL(b, p)" % (pad, target)]
+            if rt in ("float", "double"):
+                lines.append("%s%s = float(%s)" % (pad, target, target))
+            return lines
+        if wt == "float":
+            return ["%s%s = _UF(b, p)[0]" % (pad, target), "%sp += 4" % pad]
+        if wt == "double":
+            return ["%s%s = _UD(b, p)[0]" % (pad, target), "%sp += 8" % pad]
+        if wt in ("string", "bytes"):
+            n = self.var("n")
+            # the buffer may be a memoryview, so the bytes are copied only into the decoded value
+            value = ('str(b[p:p + %s], "utf-8")' if rt == "string" else "bytes(b[p:p + %s])") % n
+            return _length_lines(n, pad) + ["%s%s = %s" % (pad, target, value), "%sp += %s" % (pad, n)]
+        if wt == "fixed":
+            return ["%s%s = bytes(b[p:p + %d])" % (pad, target, writer["size"]), "%sp += %d" % (pad, writer["size"])]
+        if wt == "enum":
+            i = self.var("i")
+            lines = ["%s%s, p = _RL(b, p)" % (pad, i)]
+            if writer is reader:
+                lines.append("%s%s = %s[%s]" % (pad, target, self.constant(writer["symbols"]), i))
+            else:
+                # the writer's symbols unknown to the reader are mapped to None
+                symbols = tuple(s if s in reader["symbols"] else None for s in writer["symbols"])
+                lines.append("%s%s = %s[%s]" % (pad, target, self.constant(symbols), i))
+                lines.append("%sif %s is None:" % (pad, target))
+                lines.append('%s    raise _SE("Enum symbol unknown to the reader")' % pad)
+            return lines
+        return ["%s%s, p = %s(b, p)" % (pad, target, self.function("decode", writer, reader))]
+
+    def _decode_function(self, name, lines, writer, reader):
+        t = _type(writer)
+        lines.append("def %s(b, p):" % name)
+        if t == "record":
+            reader_fields = dict((f["name"], f) for f in reader["fields"])
+            values = {}
+            for field in writer["fields"]:
+                reader_field = reader_fields.get(field["name"])
+                if reader_field is None:
+                    lines.extend(self.skip_lines(field["type"], 1))
+                else:
+                    v = values[field["name"]] = self.var()
+                    lines.extend(self.decode_lines(field["type"], reader_field["type"], v, 1))
+            for field in reader["fields"]:
+                if field["name"] not in values:
+                    if "default" not in field:
+                        raise SchemaException("No default value for field %s" % field["name"])
+                    values[field["name"]] = self.default(field["type"], field["default"])
+            lines.append("    return {%s}, p" % ", ".join("%r: %s" % (f["name"], values[f["name"]])
+                                                         for f in reader["fields"]))
+        elif t in ("array", "map"):
+            lines.append("    d = %s" % ("[]" if t == "array" else "{}"))
+            lines.append("    n, p = _RL(b, p)")
+            lines.append("    while n:")
+            lines.append("        if n < 0:")
+            lines.append("            n = -n")
+            lines.append("            s, p = _RL(b, p)")
+            lines.append("        for _ in range(n):")
+            if t == "array":
+                lines.extend(self.decode_lines(writer["items"], reader["items"], "x", 3))
+                lines.append("            d.append(x)")
+            else:
+                lines.extend(self.decode_lines("string", "string", "k", 3))
+                lines.extend(self.decode_lines(writer["values"], reader["values"], "x", 3))
+                lines.append("            d[k] = x")
+            lines.append("        n, p = _RL(b, p)")
+            lines.append("    return d, p")
+        else:
+            lines.append("    i, p = _RL(b, p)")
+            for i, s in enumerate(writer["schemas"]):
+                lines.append("    %s i == %d:" % ("if" if i == 0 else "elif", i))
+                if writer is reader:
+                    lines.extend(self.decode_lines(s, s, "d", 2))
+                    continue
+                branch = self.reader_branch(s, reader) if _type(reader) == "union" else reader
+                if branch is not None and self.match(s, branch):
+                    lines.extend(self.decode_lines(s, branch, "d", 2))
+                else:
+                    lines.append('        raise _SE("Cannot read %s data with the reader\'s schema")' % _type(s))
+            lines.append("    else:")
+            lines.append('        raise _SE("Invalid union branch %d" % i)')
+            lines.append("    return d, p")
+
+    def default(self, node, value):
+        # Returns the expression of the default value of a field of the reader's schema missing in the writer's one
+        value = _default_value(node, value)
+        if isinstance(value, (list, dict)):
+            return "_DC(%s)" % self.constant(value)
+        return repr(value)
+
+    def skip_lines(self, node, indent):
+        # Returns the lines that move the position after the data of the node, without decoding them
+        pad = "    " * indent
+        t = _type(node)
+        if t == "null":
+            return []
+        if t == "boolean":
+            return ["%sp += 1" % pad]
+        if t in ("int", "long", "enum"):
+            return ["%sp = _SL(b, p)" % pad]
+        if t == "float":
+            return ["%sp += 4" % pad]
+        if t == "double":
+            return ["%sp += 8" % pad]
+        if t in ("string", "bytes"):
+            n = self.var("n")
+            return _length_lines(n, pad) + ["%sp += %s" % (pad, n)]
+        if t == "fixed":
+            return ["%sp += %d" % (pad, node["size"])]
+        return ["%sp = %s(b, p)" % (pad, self.function("skip", node))]
+
+    def _skip_function(self, name, lines, node):
+        t = node["type"]
+        lines.append("def %s(b, p):" % name)
+        if t == "record":
+            for field in node["fields"]:
+                lines.extend(self.skip_lines(field["type"], 1))
+        elif t in ("array", "map"):
+            lines.append("    n, p = _RL(b, p)")
+            lines.append("    while n:")
+            lines.append("        if n < 0:")
+            # blocks with a negative count are preceded by their size, so they are skipped at once
+            lines.append("            s, p = _RL(b, p)")
+            lines.append("            if s < 0:")
+            lines.append('                raise _SE("Negative block size")')
+            lines.append("            p += s")
+            lines.append("        else:")
+            lines.append("            for _ in range(n):")
+            body = (self.skip_lines("string", 4) if t == "map" else []) + \
+                self.skip_lines(node["items"] if t == "array" else node["values"], 4)
+            lines.extend(body or ["                pass"])
+            lines.append("        n, p = _RL(b, p)")
+        else:
+            lines.append("    i, p = _RL(b, p)")
+            for i, s in enumerate(node["schemas"]):
+                lines.append("    %s i == %d:" % ("if" if i == 0 else "elif", i))
+                lines.extend(self.skip_lines(s, 2) or ["        pass"])
+            lines.append("    else:")
+            lines.append('        raise _SE("Invalid union branch %d" % i)')
+        lines.append("    return p")
+
+
+def _length_lines(n, pad):
+    # Returns the lines that read the length of a string or bytes into n. A negative length would move the position
+    # backwards, and possibly loop forever on a corrupted message
+    return ["%s%s, p = _RL(b, p)" % (pad, n), "%sif %s < 0:" % (pad, n), '%s    raise _SE("Negative length")' % pad]
+
+
+def _default_value(node, value):
+    # Converts the JSON default value of a field to the Python value of its type
+    t = _type(node)
+    if t == "union":
+        return _default_value(node["schemas"][0], value)
+    if t == "null":
+        return None
+    if t == "boolean":
+        return bool(value)
+    if t in ("int", "long"):
+        return int(value)
+    if t in ("float", "double"):
+        return float(value)
+    if t == "array":
+        return [_default_value(node["items"], v) for v in value]
+    if t == "map":
+        return dict((k, _default_value(node["values"], v)) for k, v in value.items())
+    if t == "record":
+        return dict((f["name"], _default_value(f["type"], value.get(f["name"], f.get("default"))))
+                    for f in node["fields"])
+    if t in ("bytes", "fixed"):
+        # as specified by Avro, the JSON defaults of bytes are strings of the code points 0-255
+        return value.encode("latin-1")
+    return value
+
+
+# fingerprint -> (source, code object) of the codecs compiled by other processes
+_PRECOMPILED = {}
+
+
+def add_precompiled(codecs):
+    """
+    Make available the codecs compiled by another process, so that they are not generated and compiled again
+
+    :type codecs: `dict`
+    :param codecs: the source and the code object of the codecs by fingerprint of their schema
+    """
+    _PRECOMPILED.update(codecs)
+
+
+def is_precompiled(schema):
+    """
+    Return whether the codec of the :attr:`schema` was compiled by another process
+    """
+    return fingerprint(schema) in _PRECOMPILED
+
+
+# The functions that check the schemas before their codecs are compiled
+_SCHEMA_CHECKS = []
+
+
+def add_schema_check(check):
+    """
+    Add a function that is called with every schema before its codec is compiled, and that raises an exception if
+    the schema is not valid (e.g., the schema parser of a reference Avro implementation). The schemas of the
+    precompiled codecs are not checked again, since the processes that compiled them did it
+    """
+    if check not in _SCHEMA_CHECKS:
+        _SCHEMA_CHECKS.append(check)
+
+
+class AvroCodec(object):
+    """
+    Specialized Avro binary codec of a schema. The encoding and decoding functions are generated from the schema and
+    compiled once, and the codecs are cached per schema fingerprint: use :func:`get_codec` to obtain them.
+
+    If the :attr:`reader_schema` is given, the codec decodes the data written with the :attr:`schema` into data of the
+    reader's schema, following the Avro schema resolution rules: use :func:`get_resolver` to obtain such codecs.
+
+    :type schema: `dict`
+    :param schema: the schema of the data handled by the codec
+
+    :type reader_schema: `dict`
+    :param reader_schema: the schema of the decoded data, if different from :attr:`schema`
+    """
+
+    def __init__(self, schema, reader_schema=None):
+        self.schema = schema
+        self.reader_schema = schema if reader_schema is None else reader_schema
+        self.fingerprint = fingerprint(schema)
+        precompiled = _PRECOMPILED.get(self.fingerprint) if reader_schema is None else None
+        if precompiled is not None:
+            self.source, self.code = precompiled
+        else:
+            #: The generated Python source
+            self.source = _Compiler(schema, reader_schema).source()
+            #: The compiled code of the source
+            self.code = compile(self.source, "<codec %s>" % schema.get("name", self.fingerprint), "exec")
+        namespace = dict(_GLOBALS)
+        exec(self.code, namespace)
+        self._encode = namespace["encode"]
+        self._decode = namespace["decode"]
+        #: Return whether the datum is valid for the schema
+        self.validate = namespace["validate"]
+
+    def encode(self, datum, write):
+        """
+        Encode the :attr:`datum` passing the encoded chunks to :attr:`write`. The datum is not validated
+
+        :param datum: the datum to encode
+        :param write: a callable receiving the encoded `bytes` chunks (e.g., the write method of a buffer)
+        """
+        try:
+            self._encode(datum, write)
+        except (AttributeError, TypeError, ValueError, KeyError, struct.error):
+            raise SchemaException(datum)
+
+    def decode(self, buf, pos=0, end=None):
+        """
+        Decode a datum starting at the position :attr:`pos` of :attr:`buf`
+
+        :param buf: the encoded data, as `bytes` or any other buffer (e.g., a `bytearray` or a `memoryview`), which is
+            read in place without copying it
+        :param end: if given, the position where the datum must end, e.g. the end of the payload declared by the
+            envelope. Data shorter or longer than that are invalid
+        :return: a tuple with the decoded datum and the position of the first byte after it
+        """
+        if not isinstance(buf, bytes):
+            buf = memoryview(buf)
+        try:
+            datum, datum_end = self._decode(buf, pos)
+        except (IndexError, TypeError, ValueError, struct.error):
+            raise SchemaException("Invalid data for schema %s" % self.schema.get("name"))
+        if datum_end > len(buf) or (end is not None and datum_end != end):
+            raise SchemaException("Invalid data for schema %s" % self.schema.get("name"))
+        return datum, datum_end
+
+
+class CodecCache(Cache):
+    """
+    Cache of the :class:`AvroCodec` objects. It is the only cache of the codecs, shared by all their users (the
+    Avro serializers included), so its :attr:`maxsize` bounds the memory they take
+    """
+
+    CODEC = 0
+
+    def compile(self, obj_type, schema):
+        if not is_precompiled(schema):
+            for check in _SCHEMA_CHECKS:
+                check(schema)
+        return AvroCodec(schema)
+
+
+class ResolverCache(Cache):
+    """
+    Cache of the resolving :class:`AvroCodec` objects, keyed by the fingerprint of the writer's schema and by the
+    :func:`reader_key <clay.serializer.fingerprint.reader_key>` of the reader's one, since the codecs depend on the
+    defaults of the reader's fields
+    """
+
+    RESOLVER = 0
+
+    #: The projections of the requested fields make the pairs of schemas unbounded, so the cache is bounded by default
+    maxsize = 4096
+
+    def key(self, schemas):
+        writer_schema, reader_schema = schemas
+        return fingerprint(writer_schema), reader_key(reader_schema)
+
+    def compile(self, obj_type, schemas):
+        return AvroCodec(*schemas)
+
+
+def get_codec(schema):
+    """
+    Return the :class:`AvroCodec` of the :attr:`schema`, compiling it the first time a schema with its fingerprint is
+    requested
+    """
+    return CodecCache().get(CodecCache.CODEC, schema)
+
+
+def get_resolver(writer_schema, reader_schema):
+    """
+    Return the :class:`AvroCodec` that decodes data written with the :attr:`writer_schema` as data of the
+    :attr:`reader_schema`, compiling it the first time the pair of schemas is requested
+    """
+    if reader_key(writer_schema) == reader_key(reader_schema):
+        return get_codec(reader_schema)
+    return ResolverCache().get(ResolverCache.RESOLVER, (writer_schema, reader_schema))
+
+
+def get_projection(writer_schema, reader_schema, fields):
+    """
+    Return the :class:`AvroCodec` that decodes only the :attr:`fields` of the data written with the
+    :attr:`writer_schema` as data of the :attr:`reader_schema`. The bytes of the other fields are skipped without
+    decoding them
+    """
+    return get_resolver(writer_schema, project(reader_schema, fields))
+
+# vim:tabstop=4:expandtab
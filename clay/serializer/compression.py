@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compression of the payloads in the CLay envelope.
+
+The codecs are identified in the envelope by their id. `zlib` and `bz2` are always available, `lzma` unless Python was
+built without it, `lz4` and `zstd` if the `lz4` and `zstandard` packages are installed.
+"""
+
+import bz2
+import threading
+import zlib
+from collections import namedtuple
+
+from ..exceptions import InvalidEnvelope, MissingDependency
+
+#: A compression codec. `compress` receives the data and the compression level (or `None` for the default one),
+#: `decompress` the data and the maximum size of the decompressed data
+Codec = namedtuple("Codec", ("id", "name", "compress", "decompress"))
+
+#: The default maximum size of a decompressed payload, so that a small payload crafted to decompress to a huge one
+#: is rejected before filling the memory
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+#: The known codecs by name
+CODECS = {}
+#: The known codecs by id
+CODEC_IDS = {}
+
+# The ids of the codecs are written in the envelopes and must never change
+_IDS = {"zlib": 1, "bz2": 2, "lzma": 3, "lz4": 4, "zstd": 5}
+
+
+def _register_codec(name, compress, decompress):
+    codec = Codec(_IDS[name], name, compress, decompress)
+    CODECS[name] = CODEC_IDS[codec.id] = codec
+
+
+def _too_large(max_size):
+    return InvalidEnvelope("Decompressed payload larger than %d bytes" % max_size)
+
+
+def _bounded(decompressor_class):
+    # Returns a decompress function that uses the streaming decompressor objects of the class, which stop after the
+    # given output size
+    def decompress(data, max_size):
+        decompressor = decompressor_class()
+        result = decompressor.decompress(data, max_size + 1)
+        if len(result) > max_size:
+            raise _too_large(max_size)
+        if not decompressor.eof:
+            raise ValueError("Truncated compressed data")
+        return result
+    return decompress
+
+
+_register_codec("zlib", lambda data, level: zlib.compress(data, 6 if level is None else level),
+                _bounded(zlib.decompressobj))
+_register_codec("bz2", lambda data, level: bz2.compress(data, 9 if level is None else level),
+                _bounded(bz2.BZ2Decompressor))
+
+try:
+    import lzma
+except ImportError:
+    # Python builds without liblzma
+    pass
+else:
+    _register_codec("lzma", lambda data, level: lzma.compress(data, preset=level), _bounded(lzma.LZMADecompressor))
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    _register_codec("lz4", lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+                    _bounded(lz4.frame.LZ4FrameDecompressor))
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    def _zstd_decompress(data, max_size):
+        # the size in the frame header is checked first, since it sets the size of the output buffer. Without it, the
+        # output is bounded by max_output_size
+        if zstandard.frame_content_size(data) > max_size:
+            raise _too_large(max_size)
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+
+    _register_codec("zstd", lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level)
+                    .compress(data), _zstd_decompress)
+
+
+def decompress(codec_id, data, max_size=None):
+    """
+    Decompress the :attr:`data` compressed with the codec with id :attr:`codec_id`
+
+    :type max_size: `int`
+    :param max_size: the maximum size of the decompressed data. If `None`, :data:`MAX_DECOMPRESSED_SIZE`
+    :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if the data are invalid or decompress to more
+        than :attr:`max_size` bytes
+    """
+    if max_size is None:
+        max_size = MAX_DECOMPRESSED_SIZE
+    try:
+        codec = CODEC_IDS[codec_id]
+    except KeyError:
+        raise InvalidEnvelope("Unsupported compression codec: %d" % codec_id)
+    try:
+        return codec.decompress(data, max_size)
+    except InvalidEnvelope:
+        raise
+    except Exception:
+        raise InvalidEnvelope("Invalid %s compressed payload" % codec.name)
+
+
+class Compression(object):
+    """
+    Policy that establishes which payloads are compressed and how. Only the payloads of at least :attr:`threshold`
+    bytes are compressed, and only if the compression makes them smaller.
+
+    If :attr:`adaptive` is `True`, for each message type the first :attr:`samples` payloads are compressed with all
+    the available codecs (or with the :attr:`codec` ones, if it is a list), and then the codec that achieved the best
+    compression ratio is used for the following payloads.
+
+    :type codec: `str` or `list`
+    :param codec: the name of the codec, or the names of the candidate codecs of the adaptive choice. If `None`,
+        `zlib` is used, or all the available codecs are candidates if :attr:`adaptive` is `True`
+
+    :type threshold: `int`
+    :param threshold: the minimum size of the compressed payloads
+
+    :type level: `int`
+    :param level: the compression level. If `None` the default of each codec is used
+
+    :type adaptive: `bool`
+    :param adaptive: whether to choose the codec for each message type from the observed compression ratios
+
+    :type samples: `int`
+    :param samples: the number of payloads compressed with all the candidates before choosing the codec
+    """
+
+    def __init__(self, codec=None, threshold=1024, level=None, adaptive=False, samples=16):
+        if codec is None:
+            names = sorted(CODECS, key=lambda n: CODECS[n].id) if adaptive else ["zlib"]
+        else:
+            names = [codec] if isinstance(codec, str) else list(codec)
+        for name in names:
+            if name not in CODECS:
+                if name in _IDS:
+                    raise MissingDependency(name)
+                raise ValueError("Unknown compression codec: %s" % name)
+        self.codecs = [CODECS[name] for name in names]
+        self.threshold = threshold
+        self.level = level
+        self.adaptive = adaptive and len(self.codecs) > 1
+        self.samples = samples
+        # message type -> [number of samples, compressed sizes of each candidate]
+        self._observed = {}
+        self._chosen = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, compression):
+        """
+        Return the :attr:`compression` as a :class:`Compression`
+
+        :param compression: a :class:`Compression`, the name of a codec, or `None`
+        """
+        if compression is None or isinstance(compression, cls):
+            return compression
+        return cls(compression)
+
+    def codec_of(self, message_type):
+        """
+        Return the name of the codec used for the payloads of the :attr:`message_type`, or `None` if the adaptive
+        choice hasn't been made yet
+        """
+        if not self.adaptive:
+            return self.codecs[0].name
+        codec = self._chosen.get(message_type)
+        return None if codec is None else codec.name
+
+    def compress(self, message_type, payload):
+        """
+        Compress the :attr:`payload` of a message of the :attr:`message_type`
+
+        :return: a tuple with the id of the codec and the compressed payload, or with `None` and the :attr:`payload`
+            itself if it isn't compressed
+        """
+        if len(payload) < self.threshold:
+            return None, payload
+        if not self.adaptive:
+            codec = self.codecs[0]
+            data = codec.compress(payload, self.level)
+        else:
+            codec = self._chosen.get(message_type)
+            if codec is not None:
+                data = codec.compress(payload, self.level)
+            else:
+                codec, data = self._sample(message_type, payload)
+        if len(data) >= len(payload):
+            return None, payload
+        return codec.id, data
+
+    def _sample(self, message_type, payload):
+        compressed = [codec.compress(payload, self.level) for codec in self.codecs]
+        with self._lock:
+            observed = self._observed.setdefault(message_type, [0, [0] * len(self.codecs)])
+            observed[0] += 1
+            for i, data in enumerate(compressed):
+                observed[1][i] += len(data)
+            if observed[0] >= self.samples and message_type not in self._chosen:
+                sizes = observed[1]
+                self._chosen[message_type] = self.codecs[sizes.index(min(sizes))]
+        best = min(range(len(compressed)), key=lambda i: len(compressed[i]))
+        return self.codecs[best], compressed[best]
+
+    def __repr__(self):
+        return "Compression(%r, %r)" % ([c.name for c in self.codecs], self.threshold)
+
+# vim:tabstop=4:expandtab
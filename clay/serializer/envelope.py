@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Encoding and decoding of the CLay envelope.
+
+The envelope is the Avro record described by :data:`ENVELOPE_SCHEMA`: the id of the payload schema in the catalog
+(an Avro `int`) followed by the payload (Avro `bytes`). Since the structure is fixed, it is written and parsed by hand
+instead of going through a generic Avro datum writer/reader.
+
+The envelope can carry optional fields, signaled by a set of feature flags. In that case it starts with the
+negated flags, encoded as an Avro `int`, followed by the fields of the features in the order of their flags and then
+by the schema id and the payload. Since the schema ids are never negative, envelopes without optional fields are
+unchanged.
+
+The version 2 of the envelope has instead a fixed-size binary header (:data:`HEADER_V2`), so that the schema of a
+message can be found, and a foreign or truncated message rejected, in constant time:
+
+ * the magic :data:`MAGIC` (2 bytes) and the envelope version (1 byte)
+ * the feature flags (1 byte) and the id of the compression codec (1 byte, 0 if not compressed), followed by a padding
+   byte
+ * the schema id, the catalog version (0 if not given), the payload length and the CRC32 of the payload (0 if not
+   computed), as unsigned 32-bit big-endian integers
+
+The first byte of the magic read as the start of a version 1 envelope gives unsupported feature flags, so the two
+versions can't be confused.
+"""
+
+import struct
+import zlib
+from collections import namedtuple
+
+from .compression import decompress
+from ..exceptions import InvalidEnvelope
+
+ENVELOPE_SCHEMA = {
+    "namespace": "CLAY",
+    "name": "ENVELOPE",
+    "type": "record",
+    "fields": [
+        {"name": "id", "type": "int"},
+        {"name": "payload", "type": "bytes"}
+    ]
+}
+
+#: The maximum number of bytes of a zig-zag encoded Avro long
+MAX_VARINT_SIZE = 10
+
+#: Feature flag: the envelope carries the version of the catalog of the writer (an Avro `int`)
+CATALOG_VERSION = 1
+#: Feature flag: the payload is compressed. The envelope carries the id of the compression codec (an Avro `int`, see
+#: :mod:`clay.serializer.compression`)
+COMPRESSION = 2
+#: Feature flag of the version 2: the header carries the CRC32 of the payload
+CHECKSUM = 4
+
+_FEATURES = CATALOG_VERSION | COMPRESSION
+_FEATURES_V2 = CATALOG_VERSION | COMPRESSION | CHECKSUM
+
+#: The magic number of the version 2 envelopes
+MAGIC = b"CL"
+#: The header of the version 2 envelopes
+HEADER_V2 = struct.Struct("!2sBBBxIIII")
+
+_BYTES = tuple(bytes((i,)) for i in range(256))
+
+#: The parsed header of an envelope. `start` and `end` are the positions of the payload in the message,
+#: `catalog_version` is `None` if the writer didn't specify it, `compression` is the id of the codec of the payload,
+#: or `None` if it isn't compressed, and `version` is the version of the envelope
+EnvelopeHeader = namedtuple("EnvelopeHeader", ("schema_id", "start", "end", "catalog_version", "compression",
+                                               "version"))
+
+
+def encode_long(n):
+    """
+    Encode an integer as an Avro long (zig-zag, variable-length)
+
+    :param n: the integer to encode
+    :return: the encoded `bytes`
+    """
+    n = (n << 1) ^ (n >> 63)
+    if n < 0x80:
+        return _BYTES[n]
+    out = bytearray()
+    while n & ~0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def decode_long(buf, pos=0):
+    """
+    Decode an Avro long starting at position :attr:`pos` of :attr:`buf`
+
+    :return: a tuple with the decoded integer and the position of the first byte after it
+    """
+    b = buf[pos]
+    pos += 1
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def envelope_prefix(schema_id, catalog_version=None, compression=None):
+    """
+    Return the part of the envelope that precedes the payload length, which is the same for all the payloads of a
+    schema
+
+    :param schema_id: the id of the payload schema in the catalog
+    :param catalog_version: if not `None`, the version of the catalog to write in the envelope
+    :param compression: if not `None`, the id of the codec that compressed the payload
+    """
+    features = 0
+    fields = []
+    if catalog_version is not None:
+        features |= CATALOG_VERSION
+        fields.append(encode_long(catalog_version))
+    if compression is not None:
+        features |= COMPRESSION
+        fields.append(encode_long(compression))
+    if not features:
+        return encode_long(schema_id)
+    return encode_long(-features) + b"".join(fields) + encode_long(schema_id)
+
+
+def encode_envelope(schema_id, payload, catalog_version=None, compression=None):
+    """
+    Wrap the :attr:`payload` in the envelope
+
+    :param schema_id: the id of the payload schema in the catalog
+    :param payload: the encoded payload
+    :param catalog_version: if not `None`, the version of the catalog to write in the envelope
+    :param compression: if not `None`, the id of the codec that compressed the payload
+    :return: the envelope as `bytes`
+    """
+    return envelope_prefix(schema_id, catalog_version, compression) + encode_long(len(payload)) + payload
+
+
+def encode_envelope_v2(schema_id, payload, catalog_version=None, compression=None, checksum=True):
+    """
+    Wrap the :attr:`payload` in a version 2 envelope
+
+    :param schema_id: the id of the payload schema in the catalog
+    :param payload: the encoded payload
+    :param catalog_version: if not `None`, the version of the catalog to write in the envelope
+    :param compression: if not `None`, the id of the codec that compressed the payload
+    :param checksum: whether to write the CRC32 of the payload in the envelope
+    :return: the envelope as `bytes`
+    """
+    return envelope_header_v2(schema_id, payload, catalog_version, compression, checksum) + payload
+
+
+def envelope_header_v2(schema_id, payload, catalog_version=None, compression=None, checksum=True):
+    """
+    Return the version 2 header of the envelope of the :attr:`payload`. The parameters are the same of
+    :func:`encode_envelope_v2`
+    """
+    flags = 0
+    if catalog_version is not None:
+        flags |= CATALOG_VERSION
+    if compression is not None:
+        flags |= COMPRESSION
+    crc = 0
+    if checksum:
+        flags |= CHECKSUM
+        crc = zlib.crc32(payload) & 0xffffffff
+    return HEADER_V2.pack(MAGIC, 2, flags, compression or 0, schema_id, catalog_version or 0, len(payload), crc)
+
+
+def _parse_envelope_v2(message, verify):
+    try:
+        magic, version, flags, compression, schema_id, catalog_version, length, crc = HEADER_V2.unpack_from(message)
+    except struct.error:
+        raise InvalidEnvelope("Truncated envelope header")
+    if version != 2:
+        raise InvalidEnvelope("Unsupported envelope version: %d" % version)
+    if flags & ~_FEATURES_V2:
+        raise InvalidEnvelope("Unsupported envelope features: %d" % flags)
+    start = HEADER_V2.size
+    end = start + length
+    if end > len(message):
+        raise InvalidEnvelope("Truncated envelope")
+    if verify and flags & CHECKSUM and zlib.crc32(memoryview(message)[start:end]) & 0xffffffff != crc:
+        raise InvalidEnvelope("Corrupted envelope: checksum mismatch")
+    return EnvelopeHeader(schema_id, start, end, catalog_version if flags & CATALOG_VERSION else None,
+                          compression if flags & COMPRESSION else None, 2)
+
+
+def parse_envelope(message, verify=True):
+    """
+    Parse the header of the envelope of the :attr:`message`, of either version. The payload is not touched, except
+    to verify the checksum of version 2 envelopes
+
+    :param message: the serialized message
+    :type verify: `bool`
+    :param verify: whether to verify the checksum of the payload, if present. Without verification the cost of
+        parsing a version 2 envelope doesn't depend on the size of the message
+    :rtype: :class:`EnvelopeHeader`
+    :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if the message is not a valid envelope
+    """
+    if message[:2] == MAGIC:
+        return _parse_envelope_v2(message, verify)
+    catalog_version = compression = None
+    try:
+        schema_id, start = decode_long(message)
+        if schema_id < 0:
+            features = -schema_id
+            if features & ~_FEATURES:
+                raise InvalidEnvelope("Unsupported envelope features: %d" % features)
+            if features & CATALOG_VERSION:
+                catalog_version, start = decode_long(message, start)
+            if features & COMPRESSION:
+                compression, start = decode_long(message, start)
+            schema_id, start = decode_long(message, start)
+        length, start = decode_long(message, start)
+    except (IndexError, TypeError):
+        raise InvalidEnvelope("Invalid envelope")
+    end = start + length
+    if length < 0 or end > len(message):
+        raise InvalidEnvelope("Invalid envelope")
+    return EnvelopeHeader(schema_id, start, end, catalog_version, compression, 1)
+
+
+def decode_envelope(message):
+    """
+    Parse the envelope of the :attr:`message`. The payload is returned as a `memoryview` on :attr:`message`, so it is
+    not copied, unless it is compressed
+
+    :param message: the serialized message
+    :return: a tuple with the id of the payload schema and the payload
+    """
+    header = parse_envelope(message)
+    if header.compression is not None:
+        return header.schema_id, decompress(header.compression, message[header.start:header.end])
+    return header.schema_id, memoryview(message)[header.start:header.end]
+
+
+def envelope_payload(message, header):
+    """
+    Return the buffer with the payload of the :attr:`message` and the start and end positions of the payload in it.
+    The payload is decompressed if needed, otherwise the buffer is the message itself
+
+    :param message: the serialized message
+    :param header: the :class:`EnvelopeHeader` of the message
+    """
+    if header.compression is None:
+        return message, header.start, header.end
+    payload = decompress(header.compression, message[header.start:header.end])
+    return payload, 0, len(payload)
+
+
+def encode_frame(messages):
+    """
+    Concatenate the :attr:`messages` in a single frame, each one preceded by its length encoded as an Avro long
+
+    :param messages: the serialized messages
+    :return: the frame as `bytes`
+    """
+    chunks = []
+    append = chunks.append
+    for message in messages:
+        append(encode_long(len(message)))
+        append(message)
+    return b"".join(chunks)
+
+
+def decode_frame(frame):
+    """
+    Split a frame built by :func:`encode_frame` in its messages
+
+    :param frame: the frame
+    :return: the `list` of the messages
+    """
+    messages = []
+    pos = 0
+    size = len(frame)
+    try:
+        while pos < size:
+            length, pos = decode_long(frame, pos)
+            end = pos + length
+            if length < 0 or end > size:
+                raise InvalidEnvelope("Invalid frame")
+            messages.append(frame[pos:end])
+            pos = end
+    except IndexError:
+        raise InvalidEnvelope("Invalid frame")
+    return messages
+
+# vim:tabstop=4:expandtab
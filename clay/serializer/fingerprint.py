@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Avro Parsing Canonical Form and CRC-64-AVRO fingerprint of the catalog schemas, as defined by the Avro specification.
+Two schemas with the same fingerprint encode data in the same way, whatever their documentation, defaults or
+formatting.
+"""
+
+import json
+
+from ..exceptions import SchemaException
+
+PRIMITIVE_TYPES = ("null", "boolean", "int", "long", "float", "double", "bytes", "string")
+NAMED_TYPES = ("record", "enum", "fixed")
+
+_CANONICAL_KEYS = ("name", "type", "fields", "symbols", "items", "values", "size")
+
+_EMPTY = 0xc15d213aa4d7a795
+
+
+def _make_table():
+    table = []
+    for i in range(256):
+        fp = i
+        for _ in range(8):
+            fp = (fp >> 1) ^ (_EMPTY & -(fp & 1))
+        table.append(fp)
+    return table
+
+_TABLE = _make_table()
+
+_FINGERPRINTS = {}
+_MAX_FINGERPRINTS = 4096
+
+_READER_KEYS = {}
+
+
+def fullname(name, namespace):
+    """
+    Return the full name of the named type :attr:`name` defined in the :attr:`namespace`
+    """
+    if "." in name or not namespace:
+        return name
+    return "%s.%s" % (namespace, name)
+
+
+def _canonical(schema, namespace, seen):
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_TYPES:
+            return schema
+        return fullname(schema, namespace)
+    if isinstance(schema, list):
+        return [_canonical(s, namespace, seen) for s in schema]
+
+    schema_type = schema["type"]
+    if schema_type in PRIMITIVE_TYPES:
+        return schema_type
+    if not isinstance(schema_type, str):
+        return _canonical(schema_type, namespace, seen)
+
+    canonical = {"type": schema_type}
+    if schema_type in NAMED_TYPES:
+        name = fullname(schema["name"], schema.get("namespace", namespace))
+        if name in seen:
+            return name
+        seen.add(name)
+        canonical["name"] = name
+        if "." in name:
+            namespace = name.rsplit(".", 1)[0]
+
+    if schema_type == "record":
+        canonical["fields"] = [{"name": f["name"], "type": _canonical(f["type"], namespace, seen)}
+                               for f in schema["fields"]]
+    elif schema_type == "enum":
+        canonical["symbols"] = schema["symbols"]
+    elif schema_type == "fixed":
+        canonical["size"] = schema["size"]
+    elif schema_type == "array":
+        canonical["items"] = _canonical(schema["items"], namespace, seen)
+    elif schema_type == "map":
+        canonical["values"] = _canonical(schema["values"], namespace, seen)
+    else:
+        raise SchemaException("Unknown type: %s" % schema_type)
+    return canonical
+
+
+def _dumps(canonical):
+    if isinstance(canonical, list):
+        return "[%s]" % ",".join(_dumps(c) for c in canonical)
+    if isinstance(canonical, dict):
+        return "{%s}" % ",".join("%s:%s" % (json.dumps(k), _dumps(canonical[k]))
+                                 for k in _CANONICAL_KEYS if k in canonical)
+    return json.dumps(canonical, separators=(",", ":"))
+
+
+def canonical_form(schema):
+    """
+    Return the Parsing Canonical Form of the :attr:`schema`
+
+    :type schema: `dict`
+    :param schema: a catalog schema
+    :rtype: `str`
+    """
+    return _dumps(_canonical(schema, None, set()))
+
+
+def fingerprint(schema):
+    """
+    Return the CRC-64-AVRO fingerprint of the Parsing Canonical Form of the :attr:`schema`.
+    The fingerprints are memoized per schema object, so schemas must not be modified once used
+
+    :type schema: `dict`
+    :param schema: a catalog schema
+    :rtype: `int`
+    """
+    try:
+        return _FINGERPRINTS[id(schema)][1]
+    except KeyError:
+        fp = _EMPTY
+        for b in canonical_form(schema).encode("utf-8"):
+            fp = (fp >> 8) ^ _TABLE[(fp ^ b) & 0xff]
+        if len(_FINGERPRINTS) >= _MAX_FINGERPRINTS:
+            _FINGERPRINTS.clear()
+        # the schema is kept to ensure its id is not reused
+        _FINGERPRINTS[id(schema)] = (schema, fp)
+        return fp
+
+
+def _collect_defaults(schema, namespace, seen, defaults):
+    if isinstance(schema, str):
+        return
+    if isinstance(schema, list):
+        for s in schema:
+            _collect_defaults(s, namespace, seen, defaults)
+        return
+
+    schema_type = schema["type"]
+    if not isinstance(schema_type, str):
+        _collect_defaults(schema_type, namespace, seen, defaults)
+        return
+    if schema_type in NAMED_TYPES:
+        name = fullname(schema["name"], schema.get("namespace", namespace))
+        if name in seen:
+            return
+        seen.add(name)
+        if "." in name:
+            namespace = name.rsplit(".", 1)[0]
+
+    if schema_type == "record":
+        for field in schema["fields"]:
+            if "default" in field:
+                defaults.append((name, field["name"], field["default"]))
+            _collect_defaults(field["type"], namespace, seen, defaults)
+    elif schema_type == "array":
+        _collect_defaults(schema["items"], namespace, seen, defaults)
+    elif schema_type == "map":
+        _collect_defaults(schema["values"], namespace, seen, defaults)
+
+
+def reader_key(schema):
+    """
+    Return a key of the :attr:`schema` as reader's schema of the Avro schema resolution. Unlike the fingerprint, it
+    tells apart schemas that differ only in the default values of their fields, which the reader uses for the fields
+    missing in the writer's schema. The keys are memoized per schema object, like the fingerprints
+
+    :type schema: `dict`
+    :param schema: a catalog schema
+    :return: a tuple with the fingerprint of the schema and the canonical JSON of its defaults
+    """
+    try:
+        return _READER_KEYS[id(schema)][1]
+    except KeyError:
+        defaults = []
+        _collect_defaults(schema, None, set(), defaults)
+        key = (fingerprint(schema), json.dumps(defaults, sort_keys=True, separators=(",", ":")))
+        if len(_READER_KEYS) >= _MAX_FINGERPRINTS:
+            _READER_KEYS.clear()
+        _READER_KEYS[id(schema)] = (schema, key)
+        return key
+
+# vim:tabstop=4:expandtab
@@ -19,15 +19,146 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from ..exceptions import MissingDependency
-try:
-    from hl7apy.parser import get_message_info
-except ImportError:
-    raise MissingDependency("hl7apy")
+"""
+Serialization of HL7 v2 messages.
+
+The structure and the version of an ER7 message are read from its MSH segment by :func:`scan_msh`, which doesn't
+need to parse the rest of the message. HL7 batch files, where the messages are wrapped in FHS/BHS/BTS/FTS segments,
+are split in their messages by :func:`iter_batch` while they are read.
+"""
+
+import itertools
+import multiprocessing
+import re
 
 # Communication Layer Imports
 from . import Serializer
-from ..exceptions import InvalidMessage
+from ..exceptions import InvalidMessage, InvalidEnvelope
+
+_COMPONENT, _REPETITION, _ESCAPE, _SUBCOMPONENT, _TRUNCATION = range(5)
+
+#: The segments that delimit the batches and the files of messages
+BATCH_SEGMENTS = ("FHS", "BHS", "BTS", "FTS")
+
+_SEGMENT_SEPARATORS = re.compile("[\r\n]+")
+
+
+def scan_msh(message):
+    """
+    Read the encoding characters, the message structure and the version of an ER7 message from its MSH segment. Only
+    the first segment is scanned, and only up to the MSH-12 field.
+
+    The result is the same of hl7apy's `get_message_info`: the message structure is MSH-9.3, or MSH-9.1 and MSH-9.2
+    joined by an underscore if it is missing (e.g., `ADT_A01`), and the version is MSH-12.1
+
+    :param message: the ER7 message, as `str` or `bytes`. The values of the result are `str` in both cases
+    :return: a tuple with the `dict` of the encoding characters, the message structure and the version. The last two
+        are `None` if they are missing
+    :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if the message doesn't start with a valid
+        MSH segment
+    """
+    if isinstance(message, (bytes, bytearray)):
+        # only the first segment is decoded. The scanned fields are ASCII, and latin-1 decodes any byte
+        end = message.find(b"\r")
+        message = message[:end if end >= 0 else len(message)].decode("latin-1")
+    if message[:3] != "MSH" or len(message) < 4 or message[3].isspace():
+        raise InvalidEnvelope("Not an HL7 message")
+    field_sep = message[3]
+    end = message.find("\r")
+    if end < 0:
+        end = message.find("\n")
+    # the fields of MSH are shifted by one, since MSH-1 is the field separator itself
+    fields = message[:end if end >= 0 else len(message)].split(field_sep, 12)
+    seps = fields[1] if len(fields) > 1 else ""
+    version = fields[11].strip().split(seps[:1] or None)[0] if len(fields) > 11 and seps else None
+
+    if len(seps) > len(set(seps)):
+        raise InvalidEnvelope("Found duplicate encoding chars")
+    if len(seps) != 4 and not (len(seps) == 5 and (version or "") >= "2.7"):
+        raise InvalidEnvelope("Found %d encoding chars" % len(seps))
+    encoding_chars = {
+        "FIELD": field_sep,
+        "COMPONENT": seps[_COMPONENT],
+        "SUBCOMPONENT": seps[_SUBCOMPONENT],
+        "REPETITION": seps[_REPETITION],
+        "ESCAPE": seps[_ESCAPE],
+        "SEGMENT": "\r",
+        "GROUP": "\r",
+    }
+    if len(seps) == 5:
+        encoding_chars["TRUNCATION"] = seps[_TRUNCATION]
+
+    message_structure = None
+    if len(fields) > 8:
+        message_type = fields[8].strip().split(seps[_COMPONENT])
+        if len(message_type) > 2:
+            message_structure = message_type[2]
+        elif len(message_type) == 2:
+            message_structure = "%s_%s" % tuple(message_type)
+    return encoding_chars, message_structure, version or None
+
+
+def _segments(source, chunk_size):
+    # Yields the segments read from the source. Any sequence of CR and LF ends a segment
+    tail = ""
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        segments = _SEGMENT_SEPARATORS.split(tail + chunk)
+        tail = segments.pop()
+        for segment in segments:
+            if segment:
+                yield segment
+    if tail:
+        yield tail
+
+
+def iter_batch(source, chunk_size=64 * 1024):
+    """
+    Return a generator of the ER7 messages of an HL7 batch read from the file-like object :attr:`source`. The source
+    is read in chunks of :attr:`chunk_size` bytes, and each message is yielded as soon as its last segment is read,
+    so the batch is never loaded in memory as a whole. The segments of the messages are joined by CR, whatever
+    separator the source uses.
+
+    The batch segments (:data:`BATCH_SEGMENTS`) are optional, so a file with a single message or with messages one
+    after the other is read as well. If a BTS segment has the count of the messages in its batch, it is checked.
+
+    :param source: a file-like object with a `read` method, opened in text mode
+    :type chunk_size: `int`
+    :param chunk_size: the size of the reads
+    :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if a segment is outside of a message, or if
+        the count of the messages of a batch is wrong
+    """
+    message = []
+    count = 0
+    for segment in _segments(source, chunk_size):
+        name = segment[:3]
+        if name == "MSH" or name in BATCH_SEGMENTS:
+            if message:
+                yield "\r".join(message)
+                message = []
+                count += 1
+            if name == "MSH":
+                message.append(segment)
+            elif name == "BHS":
+                count = 0
+            elif name == "BTS":
+                fields = segment.split(segment[3:4] or None, 2)
+                if len(fields) > 1 and fields[1].strip() and fields[1].strip() != str(count):
+                    raise InvalidEnvelope("The batch has %d messages instead of %s" % (count, fields[1].strip()))
+        elif message:
+            message.append(segment)
+        else:
+            raise InvalidEnvelope("Segment %s outside of a message" % name)
+    if message:
+        yield "\r".join(message)
+
+
+def _deserialize(args):
+    # Deserializes a message of a batch in a worker process
+    cls, message, catalog, fields = args
+    return cls.deserialize(message, catalog, fields)
 
 
 class AbstractHL7Serializer(Serializer):
@@ -46,22 +177,73 @@ class AbstractHL7Serializer(Serializer):
         if self.__class__ == "AbstractHL7Serializer":
             raise Exception("Cannot instantiate AbstractHL7Serializer directly. It is meant to be \
                             extended with the serializers dictionary")
+        self.serializer = self._serializer_of(message_type)
+
+    @classmethod
+    def _serializer_of(cls, message_type):
+        # the serializers are stateless, so a single instance for each message type is shared by all the messages
+        instances = cls.__dict__.get("_instances")
+        if instances is None:
+            instances = cls._instances = {}
         try:
-            self.serializer = self.SERIALIZERS[message_type]()
+            return instances[message_type]
         except KeyError:
-            raise InvalidMessage(message_type)
+            try:
+                serializer = cls.SERIALIZERS[message_type]
+            except KeyError:
+                raise InvalidMessage(message_type)
+            return instances.setdefault(message_type, serializer())
 
     def serialize(self, datum):
         return self.serializer.serialize(datum)
 
     @classmethod
-    def deserialize(cls, message, catalog):
-        # FIXME: we can avoid usage of hl7apy by copying the same function here
-        enc_chars, msg_type, version = get_message_info(message)
+    def deserialize(cls, message, catalog, fields=None):
+        enc_chars, msg_type, version = scan_msh(message)
         try:
             serializer = cls.SERIALIZERS[msg_type]
         except KeyError:
             raise InvalidMessage(msg_type)
-        return serializer.deserialize(message, catalog)
+        if fields is None:
+            return serializer.deserialize(message, catalog)
+        return serializer.deserialize(message, catalog, fields=fields)
+
+    @classmethod
+    def deserialize_batch(cls, source, catalog, fields=None, processes=1, chunk_size=64 * 1024):
+        """
+        Return a generator of the deserialized messages of an HL7 batch, in the order of the batch. The messages are
+        split by :func:`iter_batch` and each one is deserialized by the serializer of its type in
+        :attr:`SERIALIZERS`
+
+        :param source: a file-like object with a `read` method, opened in text mode
+        :param catalog: The catalog containing the messages schemas
+        :param fields: if specified, only these fields of the messages are decoded
+        :type processes: `int`
+        :param processes: the number of processes that deserialize the messages. If `None`, the number of CPUs is
+            used. With 1 the messages are deserialized in the calling process. Otherwise the messages are sent to the
+            processes in windows of a few messages for each process, so the whole batch is never in memory, and the
+            results of the serializers must be picklable
+        :type chunk_size: `int`
+        :param chunk_size: the size of the reads from the source
+        """
+        messages = iter_batch(source, chunk_size)
+        if processes == 1:
+            return (cls.deserialize(message, catalog, fields) for message in messages)
+        return cls._deserialize_parallel(messages, catalog, fields, processes or multiprocessing.cpu_count())
+
+    @classmethod
+    def _deserialize_parallel(cls, messages, catalog, fields, processes):
+        window = 64 * processes
+        tasks = ((cls, message, catalog, fields) for message in messages)
+        pool = multiprocessing.Pool(processes)
+        try:
+            while True:
+                chunk = list(itertools.islice(tasks, window))
+                if not chunk:
+                    break
+                for result in pool.imap(_deserialize, chunk, 16):
+                    yield result
+        finally:
+            pool.terminate()
 
 # vim:tabstop=4:expandtab
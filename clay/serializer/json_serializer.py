@@ -19,32 +19,245 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from ..exceptions import MissingDependency
-try:
-    import simplejson
-except ImportError:
-    raise MissingDependency("simplejson")
+import copy
+import functools
 
-# Package Imports
-from . import Serializer
+from . import Serializer, Cache
+from .codegen import _normalize, _type, _default_value
+from .envelope import encode_frame, decode_frame
 from .. import schema_from_name
+from ..exceptions import SchemaException
+
+
+def _bytes_default(obj):
+    # As in the Avro JSON encoding, bytes are written as strings of the code points 0-255
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("latin-1")
+    raise TypeError("%r is not JSON serializable" % (obj,))
+
+
+def _encoded(dumps):
+    # Wraps a dumps function that returns `str`, so that the messages are `bytes` whatever the backend
+    return lambda obj: dumps(obj).encode("utf-8")
+
+
+def _orjson():
+    import orjson
+    return functools.partial(orjson.dumps, default=_bytes_default), orjson.loads
+
+
+def _ujson():
+    import ujson
+    return _encoded(functools.partial(ujson.dumps, default=_bytes_default)), ujson.loads
+
+
+def _json():
+    import json
+    return _encoded(functools.partial(json.dumps, default=_bytes_default)), json.loads
+
+
+def _simplejson():
+    import simplejson
+    # without an encoding, simplejson passes the bytes to the default function like the other backends
+    return _encoded(functools.partial(simplejson.dumps, default=_bytes_default, encoding=None)), simplejson.loads
+
+#: The JSON backends, from the fastest
+BACKENDS = (("orjson", _orjson), ("ujson", _ujson), ("json", _json), ("simplejson", _simplejson))
+
+
+def _select_backend():
+    for name, load in BACKENDS:
+        try:
+            return (name,) + load()
+        except ImportError:
+            pass
+
+#: The name of the JSON backend in use
+BACKEND, _dumps, _loads = _select_backend()
+
+
+class JSONCache(Cache):
+    """
+    Cache of the schemas normalized for the compact encoding
+    """
+
+    NODE = 0
+
+    def compile(self, obj_type, schema):
+        return _normalize(schema, None, {})
+
+
+def _branch_name(node):
+    t = _type(node)
+    return node["name"] if t in ("record", "enum", "fixed") else t
+
+
+def _matches(node, value):
+    # Returns whether the value can be a datum of the node, as far as the compact encoding needs to know
+    t = _type(node)
+    if t == "null":
+        return value is None
+    if t == "boolean":
+        return isinstance(value, bool)
+    if t in ("int", "long"):
+        return isinstance(value, int) and not isinstance(value, bool)
+    if t in ("float", "double"):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if t in ("string", "bytes"):
+        return isinstance(value, (str, bytes))
+    if t == "enum":
+        return value in node["symbols"]
+    if t == "fixed":
+        return isinstance(value, (str, bytes)) and len(value) == node["size"]
+    if t == "array":
+        return isinstance(value, (list, tuple))
+    if t == "map":
+        return isinstance(value, dict)
+    if t == "record":
+        return isinstance(value, dict) and all(f["name"] in value or "default" in f for f in node["fields"])
+    return any(_matches(s, value) for s in node["schemas"])
+
+
+def _compact(node, value):
+    # Converts the datum of the node to its compact form: records become lists of the values of their fields, in the
+    # order of the schema, without the trailing fields equal to their default
+    t = _type(node)
+    if t == "record":
+        fields = node["fields"]
+        values = [value.get(f["name"]) for f in fields]
+        n = len(fields)
+        while n and "default" in fields[n - 1] and \
+                values[n - 1] == _default_value(fields[n - 1]["type"], fields[n - 1]["default"]):
+            n -= 1
+        return [_compact(fields[i]["type"], values[i]) for i in range(n)]
+    if t == "array":
+        return [_compact(node["items"], v) for v in value]
+    if t == "map":
+        return dict((k, _compact(node["values"], v)) for k, v in value.items())
+    if t == "union":
+        if value is None:
+            return None
+        branches = [s for s in node["schemas"] if s != "null"]
+        if len(branches) == 1:
+            return _compact(branches[0], value)
+        # as in the Avro JSON encoding, the value of a union with several branches is tagged with its branch
+        for branch in branches:
+            if _matches(branch, value):
+                return {_branch_name(branch): _compact(branch, value)}
+        raise SchemaException(value)
+    return value
+
+
+def _compact_datum(node, datum):
+    # Converts a datum to its compact form, rejecting the values whose structure doesn't match the schema, like a
+    # missing record
+    try:
+        return _compact(node, datum)
+    except (AttributeError, TypeError, ValueError):
+        raise SchemaException(datum)
+
+
+def _expand(node, value):
+    # Converts a compact datum of the node back to its ordinary form
+    t = _type(node)
+    if t == "record":
+        datum = {}
+        for i, field in enumerate(node["fields"]):
+            if i < len(value):
+                datum[field["name"]] = _expand(field["type"], value[i])
+            elif "default" in field:
+                datum[field["name"]] = copy.deepcopy(_default_value(field["type"], field["default"]))
+            else:
+                raise SchemaException("Missing value of field %s" % field["name"])
+        return datum
+    if t == "array":
+        return [_expand(node["items"], v) for v in value]
+    if t == "map":
+        return dict((k, _expand(node["values"], v)) for k, v in value.items())
+    if t == "union":
+        if value is None:
+            return None
+        branches = [s for s in node["schemas"] if s != "null"]
+        if len(branches) == 1:
+            return _expand(branches[0], value)
+        (name, value), = value.items()
+        for branch in branches:
+            if _branch_name(branch) == name:
+                return _expand(branch, value)
+        raise SchemaException("Unknown union branch: %s" % name)
+    if t in ("bytes", "fixed") and isinstance(value, str):
+        return value.encode("latin-1")
+    return value
+
+
+def _payload(data, catalog, fields):
+    payload = data["payload"]
+    schema = catalog[data["id"]]
+    if isinstance(payload, list):
+        payload = _expand(JSONCache().get(JSONCache.NODE, schema), payload)
+    if fields is not None:
+        payload = dict((k, v) for k, v in payload.items() if k in fields)
+    return payload, data["id"], schema
 
 
 class JSONSerializer(Serializer):
+    """
+    Class to serialize and deserialize messages using JSON. The fastest available backend among :data:`BACKENDS` is
+    used.
+
+    In compact mode the records are encoded as lists of the values of their fields, in the order of the schema,
+    omitting the trailing fields equal to their default. The values of the unions with several non-null branches are
+    tagged with the name of their branch, as in the Avro JSON encoding. Compact messages are recognized and
+    decoded transparently
+
+    The `bytes` and `fixed` values are written as strings of the code points 0-255, as in the Avro JSON encoding.
+    Compact messages are decoded with the schema, so these values are read back as `bytes`; otherwise they are read
+    as `str`
+    """
+
     def __init__(self, message_type, schema_catalog):
         super(JSONSerializer, self).__init__(message_type, schema_catalog)
         schema_id, schema = schema_from_name(message_type, schema_catalog)
         self.schema_id = schema_id
+        self.schema = schema
+        self.compact = False
+
+    @classmethod
+    def precompile(cls, schema):
+        JSONCache().get(JSONCache.NODE, schema)
+
+    def configure(self, validation=None, compact=False, **options):
+        """
+        :type compact: `bool`
+        :param compact: whether to use the compact encoding
+        """
+        super(JSONSerializer, self).configure(validation, **options)
+        self.compact = compact
 
     def serialize(self, datum):
+        if self.compact:
+            datum = _compact_datum(JSONCache().get(JSONCache.NODE, self.schema), datum)
         data = {"id": self.schema_id, "payload": datum}
-        return simplejson.dumps(data)
+        return _dumps(data)
+
+    def serialize_many(self, datums, framed=False):
+        dumps = _dumps
+        schema_id = self.schema_id
+        if self.compact:
+            node = JSONCache().get(JSONCache.NODE, self.schema)
+            datums = (_compact_datum(node, datum) for datum in datums)
+        messages = [dumps({"id": schema_id, "payload": datum}) for datum in datums]
+        return encode_frame(messages) if framed else messages
+
+    @staticmethod
+    def deserialize(message, catalog, fields=None):
+        return _payload(_loads(message), catalog, fields)
 
     @staticmethod
-    def deserialize(message, catalog):
-        data = simplejson.loads(message)
-        payload = data["payload"]
-        schema_id = data["id"]
-        schema = catalog[schema_id]
+    def deserialize_many(messages, catalog, fields=None):
+        if isinstance(messages, (bytes, bytearray)):
+            messages = decode_frame(messages)
+        loads = _loads
+        return [_payload(loads(message), catalog, fields) for message in messages]
 
-        return payload, schema_id, schema
\ No newline at end of file
+# vim:tabstop=4:expandtab
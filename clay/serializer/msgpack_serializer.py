@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from ..exceptions import MissingDependency
+try:
+    import msgpack
+except ImportError:
+    raise MissingDependency("msgpack")
+
+# Package Imports
+from . import Serializer
+from .. import schema_from_name
+from ..exceptions import SchemaException, InvalidEnvelope
+
+
+def _payload(data, catalog, fields):
+    if not isinstance(data, (list, tuple)) or len(data) != 2:
+        raise InvalidEnvelope("Invalid envelope")
+    schema_id, payload = data
+    # the catalog has also string keys, like its name
+    if not isinstance(schema_id, int) or isinstance(schema_id, bool) or schema_id not in catalog:
+        raise SchemaException("Schema id '%s' does not exist in '%s' catalog" % (schema_id, catalog.get("name")))
+    if not isinstance(payload, dict):
+        raise SchemaException("Invalid payload of schema %s" % catalog[schema_id].get("name"))
+    if fields is not None:
+        payload = dict((k, v) for k, v in payload.items() if k in fields)
+    return payload, schema_id, catalog[schema_id]
+
+
+class MsgPackSerializer(Serializer):
+    """
+    Class to serialize and deserialize messages using MessagePack. The envelope is a MessagePack array with the id of
+    the payload schema and the payload. The data are not validated against the schema.
+
+    Since MessagePack objects are self-delimiting, the frames of :meth:`serialize_many` are the concatenation of the
+    messages, without their length, and are read back with a streaming unpacker
+    """
+
+    def __init__(self, message_type, schema_catalog):
+        super(MsgPackSerializer, self).__init__(message_type, schema_catalog)
+        schema_id, schema = schema_from_name(message_type, schema_catalog)
+        self.schema_id = schema_id
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def serialize(self, datum):
+        try:
+            return self._packer.pack((self.schema_id, datum))
+        except (TypeError, ValueError, OverflowError):
+            raise SchemaException(datum)
+
+    def serialize_many(self, datums, framed=False):
+        pack = self._packer.pack
+        schema_id = self.schema_id
+        try:
+            messages = [pack((schema_id, datum)) for datum in datums]
+        except (TypeError, ValueError, OverflowError):
+            raise SchemaException("Invalid datum")
+        return b"".join(messages) if framed else messages
+
+    @staticmethod
+    def deserialize(message, catalog, fields=None):
+        try:
+            data = msgpack.unpackb(message, raw=False)
+        except Exception:
+            raise InvalidEnvelope("Invalid MessagePack message")
+        return _payload(data, catalog, fields)
+
+    @classmethod
+    def deserialize_many(cls, messages, catalog, fields=None):
+        if not isinstance(messages, (bytes, bytearray)):
+            return [cls.deserialize(message, catalog, fields) for message in messages]
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(messages)
+        payloads = list(cls._unpack(unpacker, catalog, fields))
+        if unpacker.tell() != len(messages):
+            raise InvalidEnvelope("Truncated MessagePack frame")
+        return payloads
+
+    @classmethod
+    def deserialize_stream(cls, source, catalog, fields=None, read_size=64 * 1024):
+        """
+        Return a generator of the deserialized messages read from a file-like object with a `read` method
+
+        :param source: the file-like object
+        :param catalog: The catalog containing the messages schemas
+        :param fields: if specified, only these fields of the messages are returned
+        :param read_size: the size of the reads from the source
+        """
+        return cls._unpack(msgpack.Unpacker(source, raw=False, read_size=read_size), catalog, fields)
+
+    @staticmethod
+    def _unpack(unpacker, catalog, fields):
+        try:
+            for data in unpacker:
+                yield _payload(data, catalog, fields)
+        except (msgpack.OutOfData, msgpack.ExtraData, ValueError):
+            raise InvalidEnvelope("Invalid MessagePack stream")
+
+# vim:tabstop=4:expandtab
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Deserialization of messages of different formats, identified by their first bytes:
+
+ * `{` is a JSON message (:class:`JSONSerializer <clay.serializer.JSONSerializer>`)
+ * `MSH` is an HL7 message (:class:`AbstractHL7Serializer <clay.serializer.AbstractHL7Serializer>`)
+ * `0x92`, a MessagePack array of two items, is a MessagePack message
+   (:class:`MsgPackSerializer <clay.serializer.MsgPackSerializer>`)
+ * the magic of the version 2 envelope, or anything else, is an Avro message
+   (:class:`AvroSerializer <clay.serializer.AvroSerializer>`)
+
+The first byte of a version 1 Avro envelope is the start of the schema id or of the negated feature flags. `{`, `M`
+and the first byte of the version 2 magic would be unsupported feature flags, so they never start an Avro message.
+`0x92` starts instead the envelopes of the schemas with id 73, 137, 201 and so on (73 + 64 * n), so the messages
+starting with it are checked further: they are Avro messages if they are a complete version 1 envelope and not a
+complete MessagePack message, and are rejected if they are both.
+"""
+
+from . import Serializer, JSONSerializer, AbstractHL7Serializer
+from .envelope import parse_envelope
+from ..exceptions import InvalidEnvelope, MissingDependency
+
+AVRO = "avro"
+JSON = "json"
+MSGPACK = "msgpack"
+HL7 = "hl7"
+
+_MSGPACK_ENVELOPE = b"\x92"
+
+
+def _is_avro_v1(message):
+    # Returns whether the message is exactly a version 1 Avro envelope
+    try:
+        header = parse_envelope(message, verify=False)
+    except InvalidEnvelope:
+        return False
+    return header.version == 1 and header.end == len(message)
+
+
+def _is_msgpack(message):
+    # Returns whether the message is exactly a MessagePack array of a schema id and a payload
+    try:
+        import msgpack
+    except ImportError:
+        return False
+    try:
+        data = msgpack.unpackb(message, raw=False)
+    except Exception:
+        return False
+    return isinstance(data, list) and len(data) == 2 and isinstance(data[0], int)
+
+
+def sniff_format(message):
+    """
+    Return the format of the :attr:`message` from its first bytes: :data:`AVRO`, :data:`JSON`, :data:`MSGPACK` or
+    :data:`HL7`. The message is not validated, except to tell apart the MessagePack messages from the Avro ones
+    starting with the same byte
+
+    :param message: the message, as `bytes` or, for the text formats, as `str`
+    :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if the message is empty, or if it is both a
+        valid Avro and MessagePack message
+    """
+    head = message[:3]
+    if not head:
+        raise InvalidEnvelope("Empty message")
+    if isinstance(head, str):
+        head = head.encode("utf-8")
+    if head[:1] == b"{":
+        return JSON
+    if head == b"MSH":
+        return HL7
+    if head[:1] == _MSGPACK_ENVELOPE:
+        # the envelope is parsed first, since it is cheaper and rarely valid for a MessagePack message
+        if not _is_avro_v1(message):
+            return MSGPACK
+        if _is_msgpack(message):
+            raise InvalidEnvelope("Ambiguous message: both an Avro and a MessagePack message")
+    # the version 2 magic included
+    return AVRO
+
+
+def _readers():
+    readers = {JSON: JSONSerializer, HL7: AbstractHL7Serializer}
+    try:
+        from . import AvroSerializer
+    except (ImportError, MissingDependency):
+        pass
+    else:
+        readers[AVRO] = AvroSerializer
+    try:
+        from . import MsgPackSerializer
+    except (ImportError, MissingDependency):
+        pass
+    else:
+        readers[MSGPACK] = MsgPackSerializer
+    return readers
+
+
+class MultiplexSerializer(Serializer):
+    """
+    Serializer that deserializes messages of any of the formats of :attr:`READERS`, dispatching each one to the
+    serializer of its format as identified by :func:`sniff_format`. The messages are serialized with the
+    :attr:`WRITER` serializer.
+
+    To read HL7 messages, or to change the serializers, extend the class. For example:
+
+    .. code:: python
+
+        class Multiplex(MultiplexSerializer):
+            READERS = dict(MultiplexSerializer.READERS, hl7=MyHL7Serializer)
+
+        factory = MessageFactory(Multiplex, catalog)
+        message = factory.retrieve(avro_json_or_hl7_message)
+
+    The payloads are adopted as the content of the messages when the serializer of their format trusts them (see
+    :meth:`Serializer.trusts_payload <clay.serializer.Serializer.trusts_payload>`), e.g. the Avro ones.
+    """
+
+    #: The serializers of the formats. By default, all the ones whose dependencies are installed
+    READERS = _readers()
+
+    #: The serializer of the messages. By default, :class:`AvroSerializer <clay.serializer.AvroSerializer>` or,
+    #: if it is missing, :class:`JSONSerializer <clay.serializer.JSONSerializer>`
+    WRITER = READERS.get(AVRO, JSONSerializer)
+
+    def __init__(self, message_type, schema_catalog):
+        super(MultiplexSerializer, self).__init__(message_type, schema_catalog)
+        self.serializer = self.WRITER(message_type, schema_catalog)
+
+    @classmethod
+    def prepare(cls, catalog):
+        cls.WRITER.prepare(catalog)
+
+    @classmethod
+    def precompile(cls, schema):
+        for serializer in set(cls.READERS.values()) | {cls.WRITER}:
+            serializer.precompile(schema)
+
+    def configure(self, **options):
+        self.serializer.configure(**options)
+
+    def serialize(self, datum):
+        return self.serializer.serialize(datum)
+
+    def serialize_many(self, datums, framed=False):
+        return self.serializer.serialize_many(datums, framed)
+
+    @classmethod
+    def reader_of(cls, message):
+        """
+        Return the serializer of the format of the :attr:`message`
+
+        :raise: :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>` if the format is not supported
+        """
+        message_format = sniff_format(message)
+        try:
+            return cls.READERS[message_format]
+        except KeyError:
+            raise InvalidEnvelope("Unsupported message format: %s" % message_format)
+
+    @classmethod
+    def trusts_payload(cls, message):
+        # the payloads are trusted as far as the serializer of the format of each message trusts them
+        return cls.reader_of(message).trusts_payload(message)
+
+    @classmethod
+    def deserialize(cls, message, catalog, fields=None):
+        if fields is None:
+            return cls.reader_of(message).deserialize(message, catalog)
+        return cls.reader_of(message).deserialize(message, catalog, fields=fields)
+
+# vim:tabstop=4:expandtab
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+On-disk cache of compiled catalogs, so that short-lived processes don't compile again the catalogs compiled by the
+processes before them.
+
+A compiled catalog holds the generated source and the compiled code of the Avro codecs of its schemas (see
+:mod:`clay.serializer.codegen`). It is stored in a file named after the catalog and a hash of its content, of the
+version of the code generator and of the Python implementation, so that a change of any of them leaves the file
+unused. Loading a compiled catalog makes its codecs available without generating and compiling them, and skips the
+validation of its schemas with the `avro` library, which was done by the process that saved it.
+
+The files are written atomically, so processes that share the directory never read a partial file.
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import platform
+import sys
+import tempfile
+
+from .codegen import CODEGEN_VERSION, CodecCache, add_precompiled
+
+_EXTENSION = ".clayc"
+
+
+def catalog_hash(catalog):
+    """
+    Return the hash that identifies the compiled :attr:`catalog` in the current Python implementation
+    """
+    content = json.dumps(dict((str(k), v) for k, v in catalog.items()), sort_keys=True)
+    key = "%s|%s|%s|%s" % (CODEGEN_VERSION, platform.python_implementation(), sys.version_info[:2], content)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def catalog_path(directory, catalog):
+    """
+    Return the path of the file of the compiled :attr:`catalog` in the :attr:`directory`
+    """
+    return os.path.join(directory, "%s-%s%s" % (catalog["name"], catalog_hash(catalog), _EXTENSION))
+
+
+def load_catalog(directory, catalog):
+    """
+    Load the compiled :attr:`catalog` from the :attr:`directory`, if it was saved there
+
+    :return: `True` if the compiled catalog was loaded, `False` if it is missing or unreadable
+    """
+    try:
+        with open(catalog_path(directory, catalog), "rb") as f:
+            codecs = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return False
+    if not isinstance(codecs, dict):
+        return False
+    add_precompiled(codecs)
+    return True
+
+
+def save_catalog(directory, catalog):
+    """
+    Save in the :attr:`directory` the codecs of the schemas of the :attr:`catalog` that have been compiled by this
+    process. The directory is created if it doesn't exist
+
+    :return: the path of the file of the compiled catalog
+    """
+    codecs = {}
+    for schema_id, schema in catalog.items():
+        if isinstance(schema_id, int):
+            codec = CodecCache().cached(CodecCache.CODEC, schema)
+            if codec is not None:
+                codecs[codec.fingerprint] = (codec.source, codec.code)
+    # it may exist, possibly created by a concurrent process
+    os.makedirs(directory, exist_ok=True)
+    path = catalog_path(directory, catalog)
+    fd, tmp_path = tempfile.mkstemp(suffix=_EXTENSION, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(codecs, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+# vim:tabstop=4:expandtab
@@ -31,72 +31,157 @@ except ImportError:
 
 # Package Imports
 from . import Serializer, Cache
-from .. import schema_from_name
+from .codegen import get_resolver, get_projection
+from .compression import Compression
+from .envelope import encode_long, encode_envelope, encode_envelope_v2, envelope_prefix, parse_envelope, \
+    envelope_payload, encode_frame, decode_frame
+from .. import schema_from_name, resolve_schema, check_catalog_version
 from ..exceptions import SchemaException
 
-ENVELOPE_SCHEMA = {
-    "namespace": "CLAY",
-    "name": "ENVELOPE",
-    "type": "record",
-    "fields": [
-        {"name": "id", "type": "int"},
-        {"name": "payload", "type": "bytes"}
-    ]
-}
-
 
 class PyAvrocCache(Cache):
 
     SER = 0
     DESER = 1
 
-    def get(self, obj_type, schema):
+    def compile(self, obj_type, schema):
         assert obj_type in (self.SER, self.DESER)
-        cache = self._cache[obj_type]
-        ser_name = schema["name"]
-        try:
-            obj = cache[ser_name]
-        except KeyError:
-            if obj_type == self.SER:
-                obj = pyavroc.AvroSerializer(simplejson.dumps(schema))
-            else:
-                obj = pyavroc.AvroDeserializer(simplejson.dumps(schema))
-            self._cache[ser_name] = obj
-        return obj
+        if obj_type == self.SER:
+            return pyavroc.AvroSerializer(simplejson.dumps(schema))
+        return pyavroc.AvroDeserializer(simplejson.dumps(schema))
 
 
 class AvroSerializer(Serializer):
     """
-    Class to serialize and deserialize messages using Avro
+    Class to serialize and deserialize messages using Avro. pyavroc always checks the data while encoding them, so
+    the :attr:`validation` policy has no effect.
+
+    Messages written with a different version of the catalog are decoded by resolving the writer's schema against the
+    reader's one with the generated codecs of :mod:`clay.serializer.codegen`, since pyavroc doesn't support schema
+    resolution. The same codecs decode the projections on a subset of the fields.
+
+    The payloads can be compressed according to a :class:`Compression <clay.serializer.compression.Compression>`
+    policy. Compressed payloads are decompressed transparently.
+
+    The messages are written in version 1 envelopes unless configured otherwise, and are read from envelopes of both
+    versions (see :mod:`clay.serializer.envelope`)
     """
 
+    trusted_payloads = True
+
     def __init__(self, message_type, schema_catalog):
+        super(AvroSerializer, self).__init__(message_type, schema_catalog)
         schema_id, schema = schema_from_name(message_type, schema_catalog)
+        self.message_type = message_type
         self.payload_schema_id = schema_id
+        self.catalog_version = schema_catalog.get("version")
 
         self._payload_ser = PyAvrocCache().get(PyAvrocCache.SER, schema)
-        self._envelope_ser = PyAvrocCache().get(PyAvrocCache.SER, ENVELOPE_SCHEMA)
+        self._writer_catalog_version = None
+        self._compression = None
+        self._envelope_format = 1
+        self._checksum = True
+
+    @classmethod
+    def precompile(cls, schema):
+        PyAvrocCache().get(PyAvrocCache.SER, schema)
+        PyAvrocCache().get(PyAvrocCache.DESER, schema)
+
+    def configure(self, validation=None, versioned=False, compression=None, envelope=1, checksum=True, **options):
+        """
+        :type versioned: `bool`
+        :param versioned: if `True`, the version of the catalog is written in the envelope, so that readers with a
+            different version of the catalog can decode the messages. The version must be a non-negative `int`
+            below 2 ** 32
+
+        :type compression: :class:`Compression <clay.serializer.compression.Compression>` or `str`
+        :param compression: the compression policy of the payloads, or the name of the codec that compresses the
+            payloads above the default threshold. If `None` the payloads are not compressed
+
+        :type envelope: `int`
+        :param envelope: the version of the envelope of the messages: 1 or 2
+
+        :type checksum: `bool`
+        :param checksum: for version 2 envelopes, whether to write the CRC32 of the payload in the envelope
+        """
+        if envelope not in (1, 2):
+            raise ValueError("Unsupported envelope version: %s" % envelope)
+        super(AvroSerializer, self).configure(validation, **options)
+        self._writer_catalog_version = check_catalog_version(self.catalog_version) if versioned else None
+        self._compression = Compression.get(compression)
+        self._envelope_format = envelope
+        self._checksum = checksum
 
     def serialize(self, datum):
         try:
             payload = self._payload_ser.serialize(datum)
         except (IOError, TypeError) as e:
             raise SchemaException(datum)
-        obj = {"id": self.payload_schema_id, "payload": payload}
-        res = self._envelope_ser.serialize(obj)
-        return res
+        codec_id = None
+        if self._compression is not None:
+            codec_id, payload = self._compression.compress(self.message_type, payload)
+        if self._envelope_format == 2:
+            return encode_envelope_v2(self.payload_schema_id, payload, self._writer_catalog_version, codec_id,
+                                      self._checksum)
+        return encode_envelope(self.payload_schema_id, payload, self._writer_catalog_version, codec_id)
+
+    def serialize_many(self, datums, framed=False):
+        if self._compression is not None or self._envelope_format == 2:
+            # the cost of the compression or of the checksum outweighs the per-call setup
+            return super(AvroSerializer, self).serialize_many(datums, framed)
+        serialize = self._payload_ser.serialize
+        prefix = envelope_prefix(self.payload_schema_id, self._writer_catalog_version)
+
+        messages = []
+        for datum in datums:
+            try:
+                payload = serialize(datum)
+            except (IOError, TypeError) as e:
+                raise SchemaException(datum)
+            messages.append(prefix + encode_long(len(payload)) + payload)
+        return encode_frame(messages) if framed else messages
 
     @staticmethod
-    def deserialize(message, catalog):
-        envelope_deser = PyAvrocCache().get(PyAvrocCache.DESER, ENVELOPE_SCHEMA)
-        envelope = envelope_deser.deserialize(message)
-
-        payload_id = envelope["id"]
-        payload_schema = catalog[payload_id]
-
-        payload_deser = PyAvrocCache().get(PyAvrocCache.DESER, payload_schema)
-        payload = payload_deser.deserialize(envelope["payload"])
-
-        return payload, payload_id, payload_schema
+    def _payload_decoder_of(header, catalog, fields):
+        # Returns the id and the schema of the payload and a function that decodes it from the message
+        writer_schema, payload_id, payload_schema = resolve_schema(header.schema_id, catalog, header.catalog_version)
+        if fields is not None or writer_schema is not payload_schema:
+            if fields is not None:
+                codec = get_projection(writer_schema, payload_schema, fields)
+            else:
+                codec = get_resolver(writer_schema, payload_schema)
+
+            def decode(buf, start, end):
+                return codec.decode(buf, start, end)[0]
+        else:
+            payload_deser = PyAvrocCache().get(PyAvrocCache.DESER, payload_schema)
+
+            def decode(buf, start, end):
+                # the payload is passed as a view on the message, so that it is not copied out of it
+                return payload_deser.deserialize(memoryview(buf)[start:end])
+        return payload_id, payload_schema, decode
+
+    @classmethod
+    def deserialize(cls, message, catalog, fields=None):
+        header = parse_envelope(message)
+        payload_id, payload_schema, decode = cls._payload_decoder_of(header, catalog, fields)
+        return decode(*envelope_payload(message, header)), payload_id, payload_schema
+
+    @classmethod
+    def deserialize_many(cls, messages, catalog, fields=None):
+        if isinstance(messages, (bytes, bytearray)):
+            messages = decode_frame(messages)
+        # the decoders are looked up once per schema and catalog version
+        decoders = {}
+        results = []
+        for message in messages:
+            header = parse_envelope(message)
+            key = (header.schema_id, header.catalog_version)
+            try:
+                payload_id, payload_schema, decode = decoders[key]
+            except KeyError:
+                payload_id, payload_schema, decode = decoders[key] = cls._payload_decoder_of(header, catalog, fields)
+            results.append((decode(*envelope_payload(message, header)), payload_id, payload_schema))
+        return results
 
 # vim:tabstop=4:expandtab
\ No newline at end of file
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Fixed-layout serialization of flat schemas with :mod:`struct`.
+
+A schema is supported if it is a record whose fields are all of the primitive types `boolean`, `int`, `long`, `float`,
+`double`, `string` or `bytes`. Each message has the same size: the schema id (a signed 32-bit integer) followed by the
+fields in the order of the schema, as big-endian integers and IEEE floats, with the strings and bytes stored as
+Pascal strings in slots of fixed size. The maximum length of a string or bytes field is given by its `max_length`
+attribute, and defaults to :data:`MAX_LENGTH`.
+"""
+
+import struct
+
+# Package Imports
+from . import Serializer, Cache
+from .. import schema_from_name
+from ..exceptions import SchemaException, InvalidEnvelope
+
+#: The default and largest maximum length in bytes of the strings and bytes fields
+MAX_LENGTH = 255
+
+_FORMATS = {"boolean": "?", "int": "i", "long": "q", "float": "f", "double": "d"}
+
+_ID = struct.Struct("!i")
+
+
+class _Layout(object):
+    """
+    The compiled layout of a flat schema
+    """
+
+    def __init__(self, schema):
+        fmt = [_ID.format.lstrip("!")]
+        self.names = []
+        # (position in the values, max length, whether it is a string) of the strings and bytes fields
+        self.strings = []
+        for i, field in enumerate(schema.get("fields", ())):
+            field_type = field["type"]
+            if isinstance(field_type, dict) and isinstance(field_type.get("type"), str):
+                field_type = field_type["type"]
+            if not isinstance(field_type, str):
+                raise SchemaException("Unsupported type of the field '%s' of '%s' for the struct layout: %r" %
+                                      (field["name"], schema["name"], field_type))
+            if field_type in _FORMATS:
+                fmt.append(_FORMATS[field_type])
+            elif field_type in ("string", "bytes"):
+                max_length = field.get("max_length", MAX_LENGTH)
+                if not 0 < max_length <= MAX_LENGTH:
+                    raise SchemaException("Invalid max_length of the field '%s' of '%s': %r" %
+                                          (field["name"], schema["name"], max_length))
+                fmt.append("%dp" % (max_length + 1))
+                self.strings.append((i + 1, max_length, field_type == "string"))
+            else:
+                raise SchemaException("Unsupported type of the field '%s' of '%s' for the struct layout: %r" %
+                                      (field["name"], schema["name"], field_type))
+            self.names.append(field["name"])
+        if schema.get("type") != "record" or not self.names:
+            raise SchemaException("'%s' is not a flat record" % schema.get("name"))
+        self.struct = struct.Struct("!" + "".join(fmt))
+        self.size = self.struct.size
+
+    def values(self, schema_id, datum):
+        values = [schema_id]
+        values.extend(datum[name] for name in self.names)
+        for i, max_length, is_string in self.strings:
+            value = values[i]
+            if is_string and isinstance(value, str):
+                value = values[i] = value.encode("utf-8")
+            if not isinstance(value, bytes) or len(value) > max_length:
+                raise SchemaException(datum)
+        return values
+
+    def datum(self, values):
+        values = list(values)
+        for i, max_length, is_string in self.strings:
+            if is_string:
+                values[i] = values[i].decode("utf-8")
+        return dict(zip(self.names, values[1:]))
+
+
+class StructCache(Cache):
+    """
+    Cache of the struct layouts of the schemas
+    """
+
+    LAYOUT = 0
+
+    def compile(self, obj_type, schema):
+        return _Layout(schema)
+
+
+def _layout_of(schema_id, catalog):
+    try:
+        schema = catalog[schema_id]
+    except KeyError:
+        raise SchemaException("Schema id '%d' does not exist in '%s' catalog" % (schema_id, catalog.get("name")))
+    return schema, StructCache().get(StructCache.LAYOUT, schema)
+
+
+class StructSerializer(Serializer):
+    """
+    Class to serialize and deserialize messages of flat schemas with a fixed binary layout. The layouts of all the
+    schemas of the catalog are compiled when the :class:`MessageFactory <clay.factory.MessageFactory>` is created, which
+    raises a :class:`SchemaException <clay.exceptions.SchemaException>` if some of them is not supported.
+
+    Each message is packed with a single call into a buffer of the serializer that is reused for all the messages,
+    and unpacked in place from the received one. Since the messages of a schema have a fixed size, the frames of
+    :meth:`serialize_many` are the concatenation of the messages, without their length
+    """
+
+    trusted_payloads = True
+
+    def __init__(self, message_type, schema_catalog):
+        super(StructSerializer, self).__init__(message_type, schema_catalog)
+        schema_id, schema = schema_from_name(message_type, schema_catalog)
+        self.schema_id = schema_id
+        self.layout = StructCache().get(StructCache.LAYOUT, schema)
+        self._buffer = bytearray(self.layout.size)
+
+    @classmethod
+    def prepare(cls, catalog):
+        for schema_id, schema in catalog.items():
+            if isinstance(schema_id, int):
+                cls.precompile(schema)
+
+    @classmethod
+    def precompile(cls, schema):
+        StructCache().get(StructCache.LAYOUT, schema)
+
+    def _pack_into(self, buf, offset, datum):
+        try:
+            self.layout.struct.pack_into(buf, offset, *self.layout.values(self.schema_id, datum))
+        except (KeyError, TypeError, struct.error):
+            raise SchemaException(datum)
+
+    def serialize(self, datum):
+        self._pack_into(self._buffer, 0, datum)
+        return bytes(self._buffer)
+
+    def serialize_many(self, datums, framed=False):
+        datums = list(datums)
+        size = self.layout.size
+        buf = bytearray(size * len(datums))
+        for i, datum in enumerate(datums):
+            self._pack_into(buf, i * size, datum)
+        frame = bytes(buf)
+        if framed:
+            return frame
+        return [frame[i:i + size] for i in range(0, len(frame), size)]
+
+    @staticmethod
+    def _unpack_from(message, offset, catalog, fields):
+        try:
+            schema_id = _ID.unpack_from(message, offset)[0]
+        except struct.error:
+            raise InvalidEnvelope("Truncated message")
+        schema, layout = _layout_of(schema_id, catalog)
+        try:
+            payload = layout.datum(layout.struct.unpack_from(message, offset))
+        except struct.error:
+            raise InvalidEnvelope("Truncated message")
+        except UnicodeDecodeError:
+            raise InvalidEnvelope("Invalid string in the message")
+        if fields is not None:
+            payload = dict((k, v) for k, v in payload.items() if k in fields)
+        return (payload, schema_id, schema), offset + layout.size
+
+    @classmethod
+    def deserialize(cls, message, catalog, fields=None):
+        result, end = cls._unpack_from(message, 0, catalog, fields)
+        if end != len(message):
+            raise InvalidEnvelope("Invalid message size")
+        return result
+
+    @classmethod
+    def deserialize_many(cls, messages, catalog, fields=None):
+        if not isinstance(messages, (bytes, bytearray)):
+            return [cls.deserialize(message, catalog, fields) for message in messages]
+        results = []
+        offset = 0
+        while offset < len(messages):
+            result, offset = cls._unpack_from(messages, offset, catalog, fields)
+            results.append(result)
+        return results
+
+# vim:tabstop=4:expandtab
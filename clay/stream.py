@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Streams of CLay messages over files and sockets.
+
+In a stream each serialized message is preceded by its length encoded as an Avro long, as in the frames of
+:meth:`Serializer.serialize_many <clay.serializer.Serializer.serialize_many>`, so a frame can be written to a stream
+as it is.
+"""
+
+from .exceptions import InvalidEnvelope
+from .serializer.envelope import encode_long
+
+
+class StreamReader(object):
+    """
+    Reads the messages of a stream from a file-like object or a socket. The data are read in chunks of
+    :attr:`chunk_size` bytes into a buffer that is reused for the whole stream, and that grows only to hold
+    messages larger than it, up to :attr:`max_message_size`.
+
+    Iterating over the reader yields the serialized messages. Use :meth:`retrieve` to obtain them as
+    :class:`Message <clay.message.Message>` objects.
+
+    :param source: a file-like object with a `read` method, or a socket
+    :type chunk_size: `int`
+    :param chunk_size: the size of the reads
+    :type max_message_size: `int`
+    :param max_message_size: the maximum size of a message. Larger messages raise
+        :class:`InvalidEnvelope <clay.exceptions.InvalidEnvelope>`, since they are probably a sign of a corrupted
+        stream
+    """
+
+    def __init__(self, source, chunk_size=64 * 1024, max_message_size=64 * 1024 * 1024):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.max_message_size = max_message_size
+        self._buffer = bytearray(chunk_size)
+        self._start = self._end = 0
+        if hasattr(source, "recv_into"):
+            self._read_into = source.recv_into
+        elif hasattr(source, "readinto"):
+            self._read_into = source.readinto
+        else:
+            self._read_into = self._copy_into
+
+    def _copy_into(self, view):
+        data = self.source.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def _fill(self, size):
+        # Reads until the buffer holds at least size bytes after the start. Returns False at the end of the stream
+        if self._start + size > len(self._buffer):
+            # the unread data are moved to the head of the buffer, which is enlarged if they don't fit anyway
+            pending = self._end - self._start
+            if size > len(self._buffer):
+                buf = bytearray(max(size, 2 * len(self._buffer)))
+                buf[:pending] = self._buffer[self._start:self._end]
+                self._buffer = buf
+            else:
+                self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, pending
+        view = memoryview(self._buffer)
+        while self._end - self._start < size:
+            n = self._read_into(view[self._end:])
+            if not n:
+                return False
+            self._end += n
+        return True
+
+    def _read_length(self):
+        # Decodes the length of the next message. Returns None at the end of the stream
+        n = shift = 0
+        pos = self._start
+        while True:
+            if pos == self._end:
+                offset = pos - self._start
+                if not self._fill(offset + 1):
+                    if not offset:
+                        return None
+                    raise InvalidEnvelope("Truncated stream")
+                pos = self._start + offset
+            b = self._buffer[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+            if shift > 63:
+                raise InvalidEnvelope("Invalid message length")
+        self._start = pos
+        return (n >> 1) ^ -(n & 1)
+
+    def __iter__(self):
+        while True:
+            length = self._read_length()
+            if length is None:
+                return
+            if length < 0 or length > self.max_message_size:
+                raise InvalidEnvelope("Invalid message length: %d" % length)
+            if not self._fill(length):
+                raise InvalidEnvelope("Truncated stream")
+            start = self._start
+            self._start += length
+            yield memoryview(self._buffer)[start:start + length].tobytes()
+
+    def retrieve(self, factory, fields=None):
+        """
+        Return a generator of the :class:`Message <clay.message.Message>` objects of the stream
+
+        :type factory: :class:`MessageFactory <clay.factory.MessageFactory>`
+        :param factory: the factory that retrieves the messages
+        :param fields: if specified, only these fields of the messages are decoded
+        """
+        for message in self:
+            yield factory.retrieve(message, fields)
+
+
+class StreamWriter(object):
+    """
+    Writes messages in a stream to a file-like object or a socket
+
+    :param sink: a file-like object with a `write` method, or a socket
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._write = sink.sendall if hasattr(sink, "sendall") else sink.write
+
+    def write(self, message):
+        """
+        Write a serialized message
+        """
+        self._write(encode_long(len(message)) + message)
+
+    def write_frame(self, frame):
+        """
+        Write the messages of a frame returned by
+        :meth:`Serializer.serialize_many <clay.serializer.Serializer.serialize_many>`
+        """
+        self._write(frame)
+
+# vim:tabstop=4:expandtab
@@ -10,9 +10,9 @@ mf = MessageFactory(AvroSerializer, SINGLE_EXAMPLE_CATALOG)
 
 def my_handler(body, message_type):
     try:
-        print mf.retrieve(body).fields
+        print(mf.retrieve(body).fields)
     except Exception as ex:
-        print ex
+        print(ex)
 
 brk = AMQPReceiver()
 brk.exchange = 'EXAMPLES'
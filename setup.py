@@ -21,8 +21,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
-from distutils.core import setup
-from distutils.errors import DistutilsSetupError
+from setuptools import setup
+from setuptools.errors import SetupError
 
 import clay
 
@@ -38,8 +38,8 @@ def _get_version():
     try:
         with open("VERSION") as f:
             return f.read().strip()
-    except IOError:
-        raise DistutilsSetupError("failed to read version info")
+    except OSError:
+        raise SetupError("failed to read version info")
 
 
 setup(
@@ -57,9 +57,13 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Programming Language :: Python",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: Implementation :: CPython",
+        "Programming Language :: Python :: Implementation :: PyPy",
         "Intended Audience :: Developers",
         "Topic :: Scientific/Engineering"
     ],
     packages=["clay", "clay.messenger", "clay.serializer"],
+    python_requires=">=3.6",
     test_suite="tests",
 )
@@ -43,7 +43,7 @@ class TestAMQP(TestCase):
         self.avro_message = self.avro_factory.create('TEST')
         self.avro_message.id = 1111111
         self.avro_message.name = "aaa"
-        self.avro_encoded = '\x00\x10\x8e\xd1\x87\x01\x06aaa'
+        self.avro_encoded = b'\x00\x10\x8e\xd1\x87\x01\x06aaa'
 
         self.complex_avro_message = self.avro_factory.create('TEST_COMPLEX')
         self.complex_avro_message.id = 1111111
@@ -55,8 +55,8 @@ class TestAMQP(TestCase):
         self.complex_avro_message.record_field.field_1 = "ddd"
         self.complex_avro_message.record_field.field_2 = "eee"
 
-        self.complex_avro_encoded = '\x02@\x8e\xd1\x87\x01\x06aaa\x00\x02\x06bbb' \
-                                    '\x00\x00\x02\x06ccc\x00\x00\x06ddd\x00\x06eee'
+        self.complex_avro_encoded = b'\x02@\x8e\xd1\x87\x01\x06aaa\x00\x02\x06bbb' \
+                                    b'\x00\x00\x02\x06ccc\x00\x00\x06ddd\x00\x06eee'
 
     def tearDown(self):
         self._reset()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+from avro.datafile import DataFileReader
+from avro.io import DatumReader
+
+from clay.archive import ArchiveWriter, ArchiveReader
+from clay.exceptions import SchemaException
+from clay.factory import MessageFactory
+from clay.serializer.avro_serializer import AvroSerializer
+
+from tests import TEST_CATALOG
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.contents = [{"id": i, "name": "name %d" % i} for i in range(2000)]
+        self.complex_content = {
+            "valid": True, "id": 1, "long_id": 2, "float_id": 0.5, "double_id": 0.25, "name": "aaa",
+            "record_field": None, "array_simple_field": ["ccc"], "array_complex_field": None, "matrix_field": []
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, **kwargs):
+        factory = MessageFactory(AvroSerializer, TEST_CATALOG)
+        with ArchiveWriter(self.path, TEST_CATALOG, block_size=512, **kwargs) as writer:
+            for content in self.contents:
+                writer.write(factory.create("TEST", content))
+            writer.write_datum("TEST_COMPLEX", self.complex_content)
+
+    def test_read(self):
+        for codec in ("null", "deflate"):
+            self._write(codec=codec)
+            reader = ArchiveReader(self.path)
+            self.assertEqual(reader.message_types, ["TEST", "TEST_COMPLEX"])
+            self.assertEqual(reader.catalog("TEST"), TEST_CATALOG)
+            self.assertEqual(list(reader.read("TEST")), self.contents)
+            self.assertEqual(list(reader.read("TEST", split_size=100)), self.contents)
+            self.assertEqual(list(reader.read("TEST_COMPLEX")), [self.complex_content])
+
+    def test_parallel_read(self):
+        self._write()
+        reader = ArchiveReader(self.path)
+        self.assertEqual(list(reader.read("TEST", processes=2, split_size=1000)), self.contents)
+
+    def test_avro_compatibility(self):
+        self._write()
+        with open(ArchiveReader(self.path).filename("TEST"), "rb") as f:
+            self.assertEqual(list(DataFileReader(f, DatumReader())), self.contents)
+
+    def test_truncated_file(self):
+        self._write()
+        reader = ArchiveReader(self.path)
+        filename = reader.filename("TEST")
+        with open(filename, "rb") as f:
+            data = f.read()
+        # the files cut anywhere contain the messages of the complete blocks, or are rejected
+        for size in list(range(0, len(data), 211)) + [len(data) - 1]:
+            with open(filename, "wb") as f:
+                f.write(data[:size])
+            try:
+                contents = list(reader.read("TEST"))
+            except SchemaException:
+                continue
+            self.assertEqual(contents, self.contents[:len(contents)])
+        # a block head cut in the middle of a varint
+        with open(filename, "wb") as f:
+            f.write(data + b"\x80")
+        self.assertRaises(SchemaException, list, reader.read("TEST"))
+
+    def test_invalid_datum(self):
+        with ArchiveWriter(self.path, TEST_CATALOG) as writer:
+            self.assertRaises(SchemaException, writer.write_datum, "TEST", {"id": "1", "name": "a"})
+        self.assertRaises(ValueError, ArchiveWriter, self.path, TEST_CATALOG, codec="snappy")
+
+# vim:tabstop=4:expandtab
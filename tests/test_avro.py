@@ -19,11 +19,15 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import threading
+from copy import deepcopy
 from unittest import TestCase
 
 from clay.exceptions import SchemaException
 from clay.factory import MessageFactory
-from clay.serializer.avro_serializer import AvroSerializer
+from clay.serializer import ValidationPolicy
+from clay.serializer.avro_serializer import AvroSerializer, AvroCache
+from clay.serializer.codegen import get_codec
 from clay.serializer.pyavroc_serializer import AvroSerializer as PyAvrocSerializer
 
 from tests import TEST_CATALOG
@@ -35,7 +39,7 @@ class TestAvroSerializer(TestCase):
         self.pyavroc_factory = MessageFactory(PyAvrocSerializer, TEST_CATALOG)
         self.factories = (self.avro_factory, self.pyavroc_factory)
 
-        self.simple_msg_content = {"id": 1111111, "name": u"aaa"}
+        self.simple_msg_content = {"id": 1111111, "name": "aaa"}
         self.complex_msg_content = {
             "valid": True,
             "id": 1111111,
@@ -44,8 +48,8 @@ class TestAvroSerializer(TestCase):
             "double_id": 1e-60,
             "name": "aaa",
             "record_field": {
-                "field_2": u"eee",
-                "field_1": u"ddd"
+                "field_2": "eee",
+                "field_1": "ddd"
             },
             "array_simple_field": ["ccc"],
             "array_complex_field": [
@@ -59,16 +63,16 @@ class TestAvroSerializer(TestCase):
 
         self.avro_simple.set_content(self.simple_msg_content)
         self.pyavroc_simple.set_content(self.simple_msg_content)
-        self.simple_encoded = "\x00\x10\x8e\xd1\x87\x01\x06aaa"
+        self.simple_encoded = b"\x00\x10\x8e\xd1\x87\x01\x06aaa"
 
         self.avro_complex = self.avro_factory.create("TEST_COMPLEX")
         self.pyavroc_complex = self.pyavroc_factory.create("TEST_COMPLEX")
 
         self.avro_complex.set_content(self.complex_msg_content)
         self.pyavroc_complex.set_content(self.complex_msg_content)
-        self.complex_encoded = '\x02\x98\x01\x01\x8e\xd1\x87\x01\x80\x80\xa0\xf6\xf4\xac\xdb\xe0\x1b-\xb2\x9d?&\xa6' \
-                               '\xac\xaa\x04\xb6y3\x06aaa\x00\x02\x06bbb\x00\x04\x04\x06aaa\x06bbb\x00\x04\x06ccc' \
-                               '\x06ddd\x00\x00\x00\x02\x06ccc\x00\x00\x06ddd\x00\x06eee'
+        self.complex_encoded = b'\x02\x98\x01\x01\x8e\xd1\x87\x01\x80\x80\xa0\xf6\xf4\xac\xdb\xe0\x1b-\xb2\x9d?&\xa6' \
+                               b'\xac\xaa\x04\xb6y3\x06aaa\x00\x02\x06bbb\x00\x04\x04\x06aaa\x06bbb\x00\x04\x06ccc' \
+                               b'\x06ddd\x00\x00\x00\x02\x06ccc\x00\x00\x06ddd\x00\x06eee'
 
     def test_retrieve(self):
         for factory in self.factories:
@@ -103,11 +107,212 @@ class TestAvroSerializer(TestCase):
             m.id = "111111"
             self.assertRaises(SchemaException, m.serialize)
 
+    def test_payload_length(self):
+        payload = self.simple_encoded[2:]
+        # the envelope declares a payload shorter or longer than its data
+        for message in (b"\x00\x0e" + payload, b"\x00\x12" + payload + b"\x00"):
+            for factory in self.factories:
+                self.assertRaises(SchemaException, factory.retrieve, message)
+                self.assertRaises(SchemaException, factory.retrieve, message, fields=["id"])
+            for serializer in (AvroSerializer, PyAvrocSerializer):
+                self.assertRaises(SchemaException, serializer.deserialize_many, [message], TEST_CATALOG)
+
+    def test_unknown_schema_id(self):
+        # the envelope of the schema 99, that is not in the catalog
+        message = b"\xc6\x01" + self.simple_encoded[1:]
+        for factory in self.factories:
+            self.assertRaises(SchemaException, factory.retrieve, message)
+
     def test_utf8_encoding(self):
-        target = "\x00\x10\x02\x0ctest\xc3\xa0"
+        target = b"\x00\x10\x02\x0ctest\xc3\xa0"
         for factory in self.factories:
-            for s in u"testà", "testà":
+            for s in "testà", "testà".encode("utf-8"):
                 m = factory.create("TEST")
                 m.id = 1
                 m.name = s
                 self.assertEqual(m.serialize(), target)
+
+    def test_serializer_reuse(self):
+        for factory in self.factories:
+            m = factory.create("TEST")
+            m.id = 1111111
+            m.name = "a" * 200
+            long_encoded = m.serialize()
+            m.name = "aaa"
+            self.assertEqual(m.serialize(), self.simple_encoded)
+            m.name = "a" * 200
+            self.assertEqual(m.serialize(), long_encoded)
+            self.assertEqual(factory.retrieve(long_encoded).name, "a" * 200)
+
+    def test_validation_policy(self):
+        policy = ValidationPolicy(ValidationPolicy.SAMPLED, 3)
+        self.assertEqual([policy.should_validate() for _ in range(6)], [True, False, False, True, False, False])
+        self.assertTrue(ValidationPolicy.get("full").should_validate())
+        self.assertFalse(ValidationPolicy.get("trusted").should_validate())
+        self.assertRaises(ValueError, ValidationPolicy, "unknown")
+
+    def test_trusted_validation(self):
+        factory = MessageFactory(AvroSerializer, TEST_CATALOG, validation="trusted")
+        self.assertIsNot(factory, self.avro_factory)
+        m = factory.create("TEST", self.simple_msg_content)
+        self.assertEqual(m.serialize(), self.simple_encoded)
+        # out of range values are not detected without validation
+        m.id = 2 ** 31
+        m.serialize()
+        self.avro_simple.id = 2 ** 31
+        self.assertRaises(SchemaException, self.avro_simple.serialize)
+        # errors of the encoder are still reported
+        m.id = "111111"
+        self.assertRaises(SchemaException, m.serialize)
+
+    def test_sampled_validation(self):
+        factory = MessageFactory(AvroSerializer, TEST_CATALOG, validation=ValidationPolicy("sampled", 2))
+        m = factory.create("TEST", self.simple_msg_content)
+        m.id = 2 ** 31
+        self.assertRaises(SchemaException, m.serialize)
+        m.serialize()
+        self.assertRaises(SchemaException, m.serialize)
+
+    def test_catalog_versions(self):
+        # in the new version the TEST schema has a new field and a different id
+        new_schema = deepcopy(TEST_CATALOG[0])
+        new_schema["fields"].append({"name": "description", "type": "string", "default": "none"})
+        new_catalog = {"version": 2, "name": TEST_CATALOG["name"], 0: TEST_CATALOG[1], 5: new_schema}
+
+        for serializer in (AvroSerializer, PyAvrocSerializer):
+            old_factory = MessageFactory(serializer, TEST_CATALOG, versioned=True)
+            new_factory = MessageFactory(serializer, new_catalog, versioned=True)
+            old_factory.add_catalog_version(new_catalog)
+
+            old_encoded = old_factory.create("TEST", self.simple_msg_content).serialize()
+            self.assertNotEqual(old_encoded, self.simple_encoded)
+            m = new_factory.retrieve(old_encoded)
+            self.assertEqual(m.content, dict(self.simple_msg_content, description="none"))
+
+            content = dict(self.simple_msg_content, description="new")
+            m = old_factory.retrieve(new_factory.create("TEST", content).serialize())
+            self.assertEqual(m.message_type, "TEST")
+            self.assertEqual(m.content, self.simple_msg_content)
+
+            # messages without version are read with the catalog of the reader
+            self.assertEqual(old_factory.retrieve(self.simple_encoded).content, self.simple_msg_content)
+            self.assertRaises(ValueError, old_factory.add_catalog_version, {"name": "OTHER", "version": 3})
+
+    def test_invalid_catalog_version(self):
+        for version in ("1.2", -1, 2 ** 32, True):
+            catalog = dict(TEST_CATALOG, version=version)
+            for serializer in (AvroSerializer, PyAvrocSerializer):
+                self.assertRaises(SchemaException, serializer("TEST", catalog).configure, versioned=True)
+                serializer("TEST", catalog).configure()
+        # catalogs without version write messages without version
+        catalog = dict(TEST_CATALOG, version=None)
+        serializer = AvroSerializer("TEST", catalog)
+        serializer.configure(versioned=True)
+        self.assertEqual(serializer.serialize(self.simple_msg_content), self.simple_encoded)
+
+    def test_retrieve_fields(self):
+        for factory in self.factories:
+            m = factory.retrieve(self.complex_encoded, fields=["name", "record_field"])
+            self.assertEqual(m.name, "aaa")
+            self.assertEqual(m.record_field.field_1, "ddd")
+            self.assertIsNone(m.id)
+            self.assertIsNone(m.matrix_field.content)
+
+    def test_serialize_many(self):
+        for factory in self.factories:
+            serializer = factory.serializer("TEST", TEST_CATALOG)
+            contents = [self.simple_msg_content, {"id": 2, "name": "b" * 200}]
+            messages = serializer.serialize_many(contents)
+            self.assertEqual(messages, [serializer.serialize(c) for c in contents])
+            self.assertEqual(messages[0], self.simple_encoded)
+            frame = serializer.serialize_many(contents, framed=True)
+
+            for encoded in (frame, messages + [self.complex_encoded]):
+                results = factory.serializer.deserialize_many(encoded, TEST_CATALOG)
+                self.assertEqual([r[0] for r in results[:2]], contents)
+                self.assertEqual([r[1] for r in results[:2]], [0, 0])
+            self.assertEqual(results[2][0]["matrix_field"], self.complex_msg_content["matrix_field"])
+
+            self.assertRaises(SchemaException, serializer.serialize_many, [{"id": "1", "name": "a"}])
+
+    def test_envelope_v2(self):
+        for serializer in (AvroSerializer, PyAvrocSerializer):
+            factory = MessageFactory(serializer, TEST_CATALOG, envelope=2)
+            encoded = factory.create("TEST", self.simple_msg_content).serialize()
+            self.assertEqual(encoded[22:], self.simple_encoded[2:])
+            self.assertEqual(factory.retrieve(encoded).content, self.simple_msg_content)
+            # both versions are read
+            self.assertEqual(factory.retrieve(self.simple_encoded).content, self.simple_msg_content)
+
+    def test_warmup(self):
+        catalog = dict((k, v) for k, v in TEST_CATALOG.items() if k != 2)
+        catalog["name"] = "WARMUP_CATALOG"
+        AvroCache().clear()
+        factory = MessageFactory(AvroSerializer, catalog, compilation="eager")
+        self.assertEqual(sorted(factory.compile_report), ["TEST", "TEST_COMPLEX", "TEST_COMPLEX_WITH_NULL"])
+        misses = AvroCache().stats()["misses"]
+        self.assertEqual(misses, 3)
+        # the first messages don't compile anything
+        message = factory.create("TEST_COMPLEX", self.complex_msg_content)
+        self.assertEqual(factory.retrieve(message.serialize()).name, message.name)
+        self.assertEqual(AvroCache().stats()["misses"], misses)
+        self.assertEqual(sorted(factory.warmup()), sorted(factory.compile_report))
+
+        self.assertIsNone(MessageFactory(AvroSerializer, TEST_CATALOG).compile_report)
+        self.assertRaises(SchemaException, MessageFactory(AvroSerializer, TEST_CATALOG).warmup)
+        self.assertRaises(ValueError, MessageFactory, AvroSerializer, TEST_CATALOG, compilation="never")
+
+    def test_codec_cache_bound(self):
+        # the codecs are kept only in the bounded cache, so the evicted ones are released
+        AvroCache().clear()
+        AvroCache.maxsize = 1
+        try:
+            codec = AvroSerializer("TEST", TEST_CATALOG)._payload_codec
+            AvroSerializer("TEST_COMPLEX", TEST_CATALOG)
+            self.assertEqual(AvroCache().stats()["size"], 1)
+            self.assertIsNot(get_codec(TEST_CATALOG[0]), codec)
+        finally:
+            del AvroCache.maxsize
+            AvroCache().clear()
+
+    def test_concurrent_factories(self):
+        catalog = deepcopy(TEST_CATALOG)
+        catalog["name"] = "CONCURRENT_CATALOG"
+        factories = []
+
+        def create():
+            factories.append(MessageFactory(AvroSerializer, catalog))
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(factories), 8)
+        self.assertTrue(all(factory is factories[0] for factory in factories))
+        self.assertEqual(factories[0].create("TEST").message_type, "TEST")
+
+    def test_concurrent_catalogs(self):
+        # a factory being built doesn't hold up the factories of other catalogs
+        building, release = threading.Event(), threading.Event()
+
+        class SlowSerializer(AvroSerializer):
+            @classmethod
+            def prepare(cls, catalog):
+                building.set()
+                release.wait(10)
+
+        slow_catalog = deepcopy(TEST_CATALOG)
+        slow_catalog["name"] = "SLOW_CATALOG"
+        fast_catalog = deepcopy(TEST_CATALOG)
+        fast_catalog["name"] = "FAST_CATALOG"
+        slow = threading.Thread(target=MessageFactory, args=(SlowSerializer, slow_catalog))
+        slow.start()
+        try:
+            self.assertTrue(building.wait(10))
+            fast = threading.Thread(target=MessageFactory, args=(AvroSerializer, fast_catalog))
+            fast.start()
+            fast.join(5)
+            self.assertFalse(fast.is_alive())
+        finally:
+            release.set()
+            slow.join()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import subprocess
+import sys
+from unittest import TestCase
+
+import clay.serializer
+from clay.exceptions import MissingDependency
+
+
+class TestBackends(TestCase):
+    def test_lazy_import(self):
+        script = "import sys, clay.serializer, clay.messenger; " \
+                 "sys.stdout.write(' '.join(sorted(m for m in ('avro', 'pika', 'msgpack') if m in sys.modules)))"
+        self.assertEqual(subprocess.check_output([sys.executable, "-c", script]), b"")
+
+    def test_select_backend(self):
+        from clay.serializer.avro_serializer import AvroSerializer
+        self.assertEqual(clay.serializer.backends("AvroSerializer"), ["pyavroc", "avro"])
+        self.assertRaises(ValueError, clay.serializer.select_backend, "AvroSerializer", "unknown")
+        default = clay.serializer._lazy_backends["AvroSerializer"]
+        try:
+            clay.serializer.select_backend("AvroSerializer", "avro")
+            self.assertIs(clay.serializer.AvroSerializer, AvroSerializer)
+        finally:
+            # the other tests use the default backend
+            clay.serializer._lazy_backends["AvroSerializer"] = default
+            clay.serializer.__dict__.pop("AvroSerializer", None)
+        self.assertRaises(AttributeError, getattr, clay.serializer, "UnknownSerializer")
+
+    def test_missing_dependency(self):
+        def import_kafka():
+            from clay.messenger import KafkaMessenger
+        try:
+            import kafka
+        except ImportError:
+            self.assertRaises(MissingDependency, import_kafka)
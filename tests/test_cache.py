@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import copy
+import threading
+import time
+from unittest import TestCase
+
+from clay.serializer import Cache
+
+from tests import TEST_SCHEMA
+
+
+class _NameCache(Cache):
+    OBJ = 0
+
+    def compile(self, obj_type, schema):
+        return {"name": schema["name"]}
+
+
+class _BoundedCache(_NameCache):
+    maxsize = 2
+
+
+class _SlowCache(_NameCache):
+    def compile(self, obj_type, schema):
+        time.sleep(0.01)
+        return super(_SlowCache, self).compile(obj_type, schema)
+
+
+class TestCache(TestCase):
+    def setUp(self):
+        _NameCache().clear()
+        _BoundedCache().clear()
+        _SlowCache().clear()
+
+    def _schema(self, name, field_type="int"):
+        schema = copy.deepcopy(TEST_SCHEMA)
+        schema["name"] = name
+        schema["fields"][0]["type"] = field_type
+        return schema
+
+    def test_singleton(self):
+        self.assertIs(_NameCache(), _NameCache())
+        self.assertIsNot(_NameCache(), _BoundedCache())
+
+    def test_fingerprint_key(self):
+        cache = _NameCache()
+        obj = cache.get(_NameCache.OBJ, self._schema("A"))
+        self.assertIs(cache.get(_NameCache.OBJ, self._schema("A")), obj)
+        # same name but a different structure
+        self.assertIsNot(cache.get(_NameCache.OBJ, self._schema("A", "long")), obj)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_lru(self):
+        cache = _BoundedCache()
+        a, b, c = self._schema("A"), self._schema("B"), self._schema("C")
+        obj_a = cache.get(_NameCache.OBJ, a)
+        cache.get(_NameCache.OBJ, b)
+        cache.get(_NameCache.OBJ, a)
+        cache.get(_NameCache.OBJ, c)  # evicts b
+        self.assertIs(cache.get(_NameCache.OBJ, a), obj_a)
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["maxsize"], stats["evictions"]), (2, 2, 1))
+        cache.get(_NameCache.OBJ, b)
+        self.assertEqual(cache.stats()["misses"], 4)
+
+    def test_concurrent_get(self):
+        cache = _SlowCache()
+        schema = self._schema("A")
+        objs = []
+
+        def get():
+            objs.append(cache.get(_NameCache.OBJ, schema))
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(objs), 8)
+        self.assertTrue(all(obj is objs[0] for obj in objs))
+        self.assertEqual(cache.stats()["misses"], 1)
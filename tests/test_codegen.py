@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import copy
+from io import BytesIO
+from unittest import TestCase
+
+import avro.schema
+from avro.io import DatumWriter, DatumReader, BinaryEncoder, BinaryDecoder
+
+from clay.exceptions import SchemaException
+from clay.serializer.codegen import AvroCodec, get_codec, get_projection, get_resolver, project
+
+from tests import TEST_COMPLEX_SCHEMA
+
+RECURSIVE_SCHEMA = {
+    "namespace": "TESTS",
+    "name": "NODE",
+    "type": "record",
+    "fields": [
+        {"name": "kind", "type": {"type": "enum", "name": "KIND", "symbols": ["A", "B", "C"]}},
+        {"name": "tag", "type": {"type": "fixed", "name": "TAG", "size": 3}},
+        {"name": "attributes", "type": {"type": "map", "values": ["int", "long", "double", "null"]}},
+        {"name": "value", "type": ["null", "string", "bytes", "KIND"]},
+        {"name": "nothing", "type": "null"},
+        {"name": "next", "type": ["null", "NODE"]},
+        {"name": "items", "type": {"type": "array", "items": [
+            "null",
+            {"type": "record", "name": "ITEM_1", "fields": [{"name": "x", "type": "int"}]},
+            {"type": "record", "name": "ITEM_2", "fields": [{"name": "y", "type": "string"}]}
+        ]}}
+    ]
+}
+
+
+class TestCodegen(TestCase):
+    def setUp(self):
+        self.data = [
+            (RECURSIVE_SCHEMA, {
+                "kind": "B", "tag": b"abc", "attributes": {"a": 1, "b": 2 ** 40, "c": 1.5, "d": None},
+                "value": "h\xe9", "nothing": None, "items": [None, {"x": 5}, {"y": "q"}],
+                "next": {"kind": "C", "tag": b"xyz", "attributes": {}, "value": "A", "nothing": None, "items": [],
+                         "next": None}
+            }),
+            (TEST_COMPLEX_SCHEMA, {
+                "valid": True, "id": 1111111, "long_id": 10 ** 18, "float_id": 1.232, "double_id": 1e-60,
+                "name": "aaa", "record_field": {"field_2": None, "field_1": "ddd"}, "array_simple_field": None,
+                "array_complex_field": [{"field_1": "bbb"}], "matrix_field": [["aaa", "bbb"], [], ["ddd"]]
+            })
+        ]
+
+    def _reference_encode(self, schema, datum):
+        buf = BytesIO()
+        DatumWriter(avro.schema.make_avsc_object(schema)).write(datum, BinaryEncoder(buf))
+        return buf.getvalue()
+
+    def _reference_decode(self, schema, encoded):
+        return DatumReader(avro.schema.make_avsc_object(schema)).read(BinaryDecoder(BytesIO(encoded)))
+
+    def test_encode(self):
+        for schema, datum in self.data:
+            codec = AvroCodec(schema)
+            self.assertTrue(codec.validate(datum))
+            out = []
+            codec.encode(datum, out.append)
+            self.assertEqual(b"".join(out), self._reference_encode(schema, datum))
+
+    def test_decode(self):
+        for schema, datum in self.data:
+            encoded = self._reference_encode(schema, datum)
+            codec = AvroCodec(schema)
+            self.assertEqual(codec.decode(encoded), (self._reference_decode(schema, encoded), len(encoded)))
+            self.assertEqual(codec.decode(b"xx" + encoded, 2)[0], self._reference_decode(schema, encoded))
+            self.assertRaises(SchemaException, codec.decode, encoded[:-1])
+            # buffers are read in place, and the decoded strings and bytes don't refer to them
+            for buf in (memoryview(b"xx" + encoded)[2:], bytearray(encoded)):
+                datum = codec.decode(buf)[0]
+                self.assertEqual(datum, self._reference_decode(schema, encoded))
+                if "tag" in datum:
+                    self.assertIs(type(datum["tag"]), bytes)
+            self.assertRaises(SchemaException, codec.decode, memoryview(encoded)[:-1])
+
+    def test_negative_length(self):
+        # the negative length of the string would move back to the block count of the array, forever
+        schema = {"type": "record", "name": "NEGATIVE", "fields": [
+            {"name": "a", "type": {"type": "array", "items": "string"}}]}
+        self.assertRaises(SchemaException, AvroCodec(schema).decode, b"\x02\x03")
+        projection = {"type": "record", "name": "NEGATIVE", "fields": []}
+        for data in (b"\x02\x03", b"\x01\x03"):
+            self.assertRaises(SchemaException, AvroCodec(schema, projection).decode, data)
+
+    def test_validate(self):
+        for schema, datum in self.data:
+            self.assertTrue(AvroCodec(schema).validate(datum))
+        schema, datum = self.data[1]
+        codec = AvroCodec(schema)
+        datum["id"] = 2 ** 31
+        self.assertFalse(codec.validate(datum))
+        datum["id"] = "1"
+        self.assertFalse(codec.validate(datum))
+
+    def test_codec_cache(self):
+        codec = get_codec(TEST_COMPLEX_SCHEMA)
+        self.assertIs(get_codec(TEST_COMPLEX_SCHEMA), codec)
+        # same schema with a different documentation has the same fingerprint
+        schema = copy.deepcopy(TEST_COMPLEX_SCHEMA)
+        schema["doc"] = "documented"
+        self.assertIs(get_codec(schema), codec)
+        schema = copy.deepcopy(schema)
+        schema["fields"][1]["type"] = "long"
+        self.assertIsNot(get_codec(schema), codec)
+
+    def test_projection(self):
+        schema, datum = self.data[0]
+        encoded = self._reference_encode(schema, datum)
+        # the KIND enum used by "value" is defined by the field "kind", that is not projected
+        projection = project(schema, ["value", "next"])
+        self.assertIs(project(schema, ["next", "value"]), projection)
+        avro.schema.make_avsc_object(projection)
+        codec = get_projection(schema, schema, ["value", "next"])
+        self.assertEqual(codec.decode(encoded), ({"value": "h\xe9", "next": {"value": "A", "next": None}},
+                                                 len(encoded)))
+        self.assertRaises(SchemaException, project, schema, ["value", "unknown"])
+
+    def test_resolver_defaults(self):
+        writer = {"namespace": "TESTS", "name": "DEFAULTS", "type": "record", "fields": [{"name": "id", "type": "int"}]}
+        readers = []
+        for default in ("one", "two"):
+            reader = copy.deepcopy(writer)
+            reader["fields"].append({"name": "name", "type": "string", "default": default})
+            readers.append(reader)
+        encoded = self._reference_encode(writer, {"id": 1})
+        # the readers differ only in the default, that is not part of the fingerprint
+        for reader in readers:
+            self.assertEqual(get_resolver(writer, reader).decode(encoded)[0],
+                             {"id": 1, "name": reader["fields"][1]["default"]})
+        self.assertIs(get_resolver(writer, copy.deepcopy(writer)), get_codec(writer))
+        self.assertIsNot(get_resolver(readers[0], readers[1]), get_codec(readers[1]))
+
+    def test_bytes_defaults(self):
+        writer = {"namespace": "TESTS", "name": "DEFAULTS", "type": "record", "fields": [{"name": "id", "type": "int"}]}
+        reader = copy.deepcopy(writer)
+        reader["fields"].extend([
+            {"name": "raw", "type": "bytes", "default": "\u00ff\u0001"},
+            {"name": "tag", "type": {"type": "fixed", "name": "TAG", "size": 2}, "default": "ab"},
+            {"name": "raws", "type": {"type": "array", "items": "bytes"}, "default": ["\u00e8"]}
+        ])
+        datum = get_resolver(writer, reader).decode(self._reference_encode(writer, {"id": 1}))[0]
+        self.assertEqual(datum, {"id": 1, "raw": b"\xff\x01", "tag": b"ab", "raws": [b"\xe8"]})
+        # the resolved datum is valid for the reader's schema
+        self.assertTrue(get_codec(reader).validate(datum))
+
+    def test_projection_defaults(self):
+        writer = {"namespace": "TESTS", "name": "DEFAULTS", "type": "record", "fields": [{"name": "id", "type": "int"}]}
+        encoded = self._reference_encode(writer, {"id": 1})
+        for default in ("one", "two"):
+            reader = copy.deepcopy(writer)
+            reader["fields"].append({"name": "name", "type": "string", "default": default})
+            self.assertEqual(project(reader, ["name"])["fields"][0]["default"], default)
+            self.assertEqual(get_projection(writer, reader, ["name"]).decode(encoded)[0], {"name": default})
+
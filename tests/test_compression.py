@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from unittest import TestCase, mock
+
+from clay.exceptions import SchemaException, InvalidEnvelope
+from clay.factory import MessageFactory
+from clay.serializer.avro_serializer import AvroSerializer
+from clay.serializer import compression
+from clay.serializer.compression import Compression, CODECS, decompress
+from clay.serializer.envelope import encode_envelope, decode_envelope, parse_envelope
+
+from tests import TEST_CATALOG
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.payload = b"abcdefgh" * 100
+
+    def test_codecs(self):
+        for codec in CODECS.values():
+            self.assertEqual(decompress(codec.id, codec.compress(self.payload, None)), self.payload)
+        self.assertRaises(SchemaException, decompress, 99, self.payload)
+        self.assertRaises(SchemaException, decompress, CODECS["zlib"].id, self.payload)
+        self.assertRaises(ValueError, Compression, "unknown")
+
+    def test_max_size(self):
+        bomb = b"\x00" * (1 << 20)
+        for codec in CODECS.values():
+            data = codec.compress(bomb, None)
+            self.assertEqual(decompress(codec.id, data, len(bomb)), bomb)
+            self.assertRaises(InvalidEnvelope, decompress, codec.id, data, len(bomb) - 1)
+            self.assertRaises(InvalidEnvelope, decompress, codec.id, data[:len(data) // 2])
+        codec = CODECS["zlib"]
+        message = encode_envelope(1, codec.compress(bomb, None), compression=codec.id)
+        with mock.patch.object(compression, "MAX_DECOMPRESSED_SIZE", 1000):
+            self.assertRaises(InvalidEnvelope, decode_envelope, message)
+
+    def test_threshold(self):
+        compression = Compression("bz2", threshold=100)
+        self.assertEqual(compression.compress("TEST", b"a" * 99), (None, b"a" * 99))
+        codec_id, data = compression.compress("TEST", self.payload)
+        self.assertEqual(codec_id, CODECS["bz2"].id)
+        self.assertEqual(decompress(codec_id, data), self.payload)
+        # payloads that don't shrink are not compressed
+        self.assertEqual(compression.compress("TEST", bytes(range(256)))[0], None)
+
+    def test_adaptive(self):
+        compression = Compression(["zlib", "bz2"], threshold=0, adaptive=True, samples=2)
+        compression.compress("TEST", self.payload)
+        self.assertIsNone(compression.codec_of("TEST"))
+        compression.compress("TEST", self.payload)
+        best = min(("zlib", "bz2"), key=lambda name: len(CODECS[name].compress(self.payload, None)))
+        self.assertEqual(compression.codec_of("TEST"), best)
+        self.assertEqual(compression.compress("TEST", self.payload)[0], CODECS[best].id)
+
+    def test_envelope(self):
+        codec = CODECS["zlib"]
+        message = encode_envelope(1, codec.compress(self.payload, None), compression=codec.id)
+        self.assertEqual(parse_envelope(message).compression, codec.id)
+        self.assertEqual(decode_envelope(message), (1, self.payload))
+
+    def test_serializer(self):
+        factory = MessageFactory(AvroSerializer, TEST_CATALOG, compression=Compression(threshold=100))
+        content = {"id": 1, "name": "name " * 100}
+        encoded = factory.create("TEST", content).serialize()
+        self.assertLess(len(encoded), 100)
+        self.assertEqual(factory.retrieve(encoded).content, content)
+        self.assertEqual(AvroSerializer.deserialize_many([encoded], TEST_CATALOG)[0][0], content)
+        # small payloads are not compressed
+        encoded = factory.create("TEST", {"id": 1, "name": "a"}).serialize()
+        self.assertEqual(encoded, b"\x00\x06\x02\x02a")
+
+# vim:tabstop=4:expandtab
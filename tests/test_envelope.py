@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from unittest import TestCase
+
+from clay.exceptions import SchemaException, InvalidEnvelope
+from clay.serializer.envelope import encode_long, decode_long, encode_envelope, decode_envelope, parse_envelope, \
+    encode_frame, decode_frame, encode_envelope_v2
+
+
+class TestEnvelope(TestCase):
+    def test_long(self):
+        for n, encoded in ((0, b"\x00"), (-1, b"\x01"), (1, b"\x02"), (64, b"\x80\x01"),
+                           (1111111, b"\x8e\xd1\x87\x01")):
+            self.assertEqual(encode_long(n), encoded)
+            self.assertEqual(decode_long(encoded), (n, len(encoded)))
+        for n in (10**18, -10**18, 2**63 - 1, -2**63):
+            self.assertEqual(decode_long(encode_long(n))[0], n)
+
+    def test_envelope(self):
+        encoded = encode_envelope(1, b"\x06aaa")
+        self.assertEqual(encoded, b"\x02\x08\x06aaa")
+        schema_id, payload = decode_envelope(encoded)
+        self.assertEqual(schema_id, 1)
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(payload.tobytes(), b"\x06aaa")
+
+    def test_parse_envelope(self):
+        self.assertEqual(parse_envelope(b"\x02\x08\x06aaa"), (1, 2, 6, None, None, 1))
+        message = encode_envelope(1, b"aaa", catalog_version=3)
+        self.assertEqual(message, b"\x01\x06\x02\x06aaa")
+        self.assertEqual(parse_envelope(message), (1, 4, 7, 3, None, 1))
+        self.assertRaises(SchemaException, parse_envelope, b"\x07\x06\x02\x06aaa")
+
+    def test_truncated_envelope(self):
+        for message in (b"", b"\x02", b"\x02\x80", b"\x02\x08\x06a"):
+            self.assertRaises(SchemaException, decode_envelope, message)
+
+    def test_frame(self):
+        messages = [b"\x02\x06aaa", b"", b"b" * 300]
+        frame = encode_frame(messages)
+        self.assertEqual(frame[:7], b"\x0a\x02\x06aaa\x00")
+        self.assertEqual(decode_frame(frame), messages)
+        self.assertRaises(SchemaException, decode_frame, frame[:-1])
+
+    def test_envelope_v2(self):
+        message = encode_envelope_v2(1, b"\x06aaa", catalog_version=3)
+        self.assertEqual(len(message), 22 + 4)
+        self.assertEqual(message[:2], b"CL")
+        self.assertEqual(parse_envelope(message), (1, 22, 26, 3, None, 2))
+        self.assertEqual(decode_envelope(message)[1].tobytes(), b"\x06aaa")
+        self.assertEqual(parse_envelope(encode_envelope_v2(1, b"", checksum=False)), (1, 22, 22, None, None, 2))
+
+        # corrupted, truncated and foreign messages
+        self.assertRaises(InvalidEnvelope, parse_envelope, message[:-1] + b"b")
+        self.assertIsNotNone(parse_envelope(message[:-1] + b"b", verify=False))
+        self.assertRaises(InvalidEnvelope, parse_envelope, message[:-1])
+        self.assertRaises(InvalidEnvelope, parse_envelope, message[:10])
+        self.assertRaises(InvalidEnvelope, parse_envelope, b"CL\x03" + message[3:])
+        self.assertRaises(InvalidEnvelope, parse_envelope, b"CLAY MESSAGE WITHOUT ENVELOPE")
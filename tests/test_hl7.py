@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from io import StringIO
+from unittest import TestCase
+
+from clay.exceptions import InvalidEnvelope, InvalidMessage
+from clay.serializer import Serializer, AbstractHL7Serializer
+from clay.serializer.hl7_serializer import scan_msh, iter_batch
+
+ADT_A01 = "MSH|^~\\&|SENDER|FACILITY|RECEIVER|FACILITY|20150101120000||ADT^A01^ADT_A01|MSG0001|P|2.5\r" \
+          "PID|1||123456||DOE^JOHN\r"
+
+
+class _ADTSerializer(Serializer):
+    instances = 0
+
+    def __init__(self):
+        super(_ADTSerializer, self).__init__("ADT_A01", None)
+        _ADTSerializer.instances += 1
+
+    def serialize(self, datum):
+        return datum
+
+    @staticmethod
+    def deserialize(message, catalog, fields=None):
+        return message, "ADT_A01", fields
+
+
+class _HL7Serializer(AbstractHL7Serializer):
+    SERIALIZERS = {"ADT_A01": _ADTSerializer}
+
+
+class TestHL7(TestCase):
+    def test_scan_msh(self):
+        enc_chars, structure, version = scan_msh(ADT_A01)
+        self.assertEqual(enc_chars, {"FIELD": "|", "COMPONENT": "^", "REPETITION": "~", "ESCAPE": "\\",
+                                     "SUBCOMPONENT": "&", "SEGMENT": "\r", "GROUP": "\r"})
+        self.assertEqual((structure, version), ("ADT_A01", "2.5"))
+
+        # the structure is built from the type and the event, and the encoding characters can be any
+        self.assertEqual(scan_msh("MSH#*~\\&#A#B#C#D#20150101##ORU*R01#1#P#2.3.1*x\nPID")[1:], ("ORU_R01", "2.3.1"))
+        self.assertEqual(scan_msh("MSH|^~\\&#|A|B|C|D|||ADT^A01|1|P|2.7")[0]["TRUNCATION"], "#")
+        self.assertEqual(scan_msh("MSH|^~\\&|A|B")[1:], (None, None))
+
+        for message in ("PID|1", "MSH |^~\\&", "MSH|^~\\|A", "MSH|^~\\^|A", "MSH|^~\\&#|A|B|C|D|||ADT^A01|1|P|2.5"):
+            self.assertRaises(InvalidEnvelope, scan_msh, message)
+
+    def test_serializer(self):
+        self.assertIs(_HL7Serializer("ADT_A01", None).serializer, _HL7Serializer("ADT_A01", None).serializer)
+        self.assertEqual(_ADTSerializer.instances, 1)
+        self.assertRaises(InvalidMessage, _HL7Serializer, "ORU_R01", None)
+
+        self.assertEqual(_HL7Serializer.deserialize(ADT_A01, None), (ADT_A01, "ADT_A01", None))
+        self.assertEqual(_HL7Serializer.deserialize(ADT_A01, None, fields=["PID"]), (ADT_A01, "ADT_A01", ["PID"]))
+        self.assertRaises(InvalidMessage, _HL7Serializer.deserialize, ADT_A01.replace("ADT_A01", "ADT_A04"), None)
+
+    def test_batch(self):
+        messages = [ADT_A01.replace("MSG0001", "MSG%04d" % i).rstrip("\r") for i in range(50)]
+        batch = "FHS|^~\\&|SENDER\rBHS|^~\\&|SENDER\r%s\rBTS|50\rFTS|1\r" % "\r".join(messages)
+        for chunk_size in (7, 64 * 1024):
+            self.assertEqual(list(iter_batch(StringIO(batch), chunk_size)), messages)
+        # the segments can be separated by CRLF and the batch segments are optional
+        self.assertEqual(list(iter_batch(StringIO("\r\n".join(messages[:3]) + "\r\n"), 5)), messages[:3])
+
+        self.assertRaises(InvalidEnvelope, list, iter_batch(StringIO(batch.replace("BTS|50", "BTS|49"))))
+        self.assertRaises(InvalidEnvelope, list, iter_batch(StringIO("PID|1\r" + ADT_A01)))
+
+        results = _HL7Serializer.deserialize_batch(StringIO(batch), None, fields=["PID"])
+        self.assertEqual(list(results), [(m, "ADT_A01", ["PID"]) for m in messages])
+        results = _HL7Serializer.deserialize_batch(StringIO(batch), None, processes=2)
+        self.assertEqual(list(results), [(m, "ADT_A01", None) for m in messages])
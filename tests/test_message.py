@@ -361,3 +361,79 @@ class TestMessage(TestCase):
         self.assertNotEqual(m1.array_complex_field, m2.array_complex_field)
         self.assertNotEqual(m1.array_simple_field, m2.array_simple_field)
         self.assertNotEqual(m1.record_field, m2.record_field)
+
+    def test_adopt_content(self):
+        content = {
+            "valid": True,
+            "id": 1111111,
+            "long_id": 10 ** 18,
+            "float_id": 1.32,
+            "double_id": 1e-60,
+            "name": "aaa",
+            "array_complex_field": [{"field_1": "bbb"}, {"field_1": "ccc"}],
+            "array_simple_field": ["ccc"],
+            "matrix_field": [["test1", "test2"], ["test3"]],
+            "record_field": {"field_1": "ddd", "field_2": "eee"}
+        }
+        m = self.factory.create("TEST_COMPLEX")
+        self.assertRaises(InvalidContent, m.adopt_content, [])
+        m.adopt_content(content)
+        self.assertEqual(m.content, content)
+
+        # the nested records and arrays are wrapped on access, in the adopted storage
+        self.assertIsInstance(content["record_field"], dict)
+        self.assertEqual(m.record_field.field_1, "ddd")
+        self.assertIsInstance(content["record_field"], _Record)
+        self.assertEqual([item.field_1 for item in m.array_complex_field], ["bbb", "ccc"])
+        self.assertEqual(m.array_complex_field[1:][0].field_1, "ccc")
+        self.assertEqual(m.matrix_field[1], ["test3"])
+
+        m.record_field.field_2 = "fff"
+        m.array_complex_field.add({"field_1": "ddd"})
+        m.name = "bbb"
+        self.assertEqual(m.content["record_field"], {"field_1": "ddd", "field_2": "fff"})
+        self.assertEqual(m.content["array_complex_field"], [{"field_1": "bbb"}, {"field_1": "ccc"}, {"field_1": "ddd"}])
+        self.assertEqual(m.name, "bbb")
+        with self.assertRaises(ValueError):
+            m.record_field = {"field_1": "aaa"}
+
+        # the missing fields get their default value
+        m = self.factory.create("TEST_COMPLEX")
+        m.adopt_content({"id": 1})
+        self.assertEqual(m.content["valid"], "true")
+        self.assertIsNone(m.content["record_field"])
+        m.record_field.field_1 = "aaa"
+        self.assertEqual(m.content["record_field"], {"field_1": "aaa", "field_2": None})
+
+    def test_retrieve_adopts_content(self):
+        m = self.factory.create("TEST_COMPLEX", {"id": 1, "name": "aaa", "long_id": 1, "float_id": 1.0,
+                                                 "double_id": 1.0, "valid": True, "matrix_field": [],
+                                                 "record_field": {"field_1": "ddd", "field_2": None}})
+        retrieved = self.factory.retrieve(m.serialize())
+        self.assertEqual(retrieved, m)
+        self.assertIsInstance(retrieved._struct._content["record_field"], dict)
+
+    def test_sparse_message(self):
+        catalog = {
+            "name": "SPARSE_CATALOG",
+            0: {"namespace": "TESTS", "name": "SPARSE", "type": "record", "fields": [
+                {"name": "id", "type": "int", "default": 0},
+                {"name": "tags", "type": {"type": "array", "items": "string"}, "default": []},
+                {"name": "rec", "type": ["null", {"type": "record", "name": "SPARSE_REC", "fields": [
+                    {"name": "value", "type": "int", "default": 1}
+                ]}]}
+            ]}
+        }
+        factory = MessageFactory(AvroSerializer, catalog)
+        m = factory.create("SPARSE")
+        # nothing is stored until the fields are accessed or assigned
+        self.assertEqual(m._struct._content, {})
+        self.assertEqual(m.content, {"id": 0, "tags": [], "rec": None})
+        self.assertEqual(factory.retrieve(m.serialize()).content, m.content)
+
+        m.tags.add("a")
+        self.assertEqual(sorted(m._struct._content), ["tags"])
+        self.assertEqual(factory.create("SPARSE").content["tags"], [])
+        m.rec.value = 2
+        self.assertEqual(m.content, {"id": 0, "tags": ["a"], "rec": {"value": 2}})
+        self.assertEqual(factory.retrieve(m.serialize()).content, m.content)
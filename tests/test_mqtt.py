@@ -40,7 +40,7 @@ class TestMQTT(TestCase):
         self.avro_message = self.avro_factory.create('TEST')
         self.avro_message.id = 1111111
         self.avro_message.name = "aaa"
-        self.avro_encoded = '\x00\x10\x8e\xd1\x87\x01\x06aaa'
+        self.avro_encoded = b'\x00\x10\x8e\xd1\x87\x01\x06aaa'
 
         self.complex_avro_message = self.avro_factory.create('TEST_COMPLEX')
         self.complex_avro_message.id = 1111111
@@ -50,7 +50,7 @@ class TestMQTT(TestCase):
         self.complex_avro_message.array_simple_field.add()
         self.complex_avro_message.array_simple_field[0] = "ccc"
 
-        self.complex_avro_encoded = '\x02(\x8e\xd1\x87\x01\x06aaa\x02\x06bbb\x00\x02\x06ccc\x00'
+        self.complex_avro_encoded = b'\x02(\x8e\xd1\x87\x01\x06aaa\x02\x06bbb\x00\x02\x06ccc\x00'
 
     def tearDown(self):
         self._reset()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from io import BytesIO
+from unittest import TestCase
+
+import msgpack
+
+from clay.exceptions import InvalidEnvelope, SchemaException
+from clay.factory import MessageFactory
+from clay.serializer import MsgPackSerializer
+
+from tests import TEST_CATALOG
+
+
+class TestMsgPack(TestCase):
+    def setUp(self):
+        self.factory = MessageFactory(MsgPackSerializer, TEST_CATALOG)
+        self.complex_content = {
+            "valid": True,
+            "id": 1111111,
+            "long_id": 10**18,
+            "float_id": 1.232,
+            "double_id": 1e-60,
+            "name": "aaa",
+            "record_field": {"field_1": "ddd", "field_2": "eee"},
+            "array_simple_field": ["ccc"],
+            "array_complex_field": [{"field_1": "bbb"}],
+            "matrix_field": [["aaa", "bbb"], ["ccc", "ddd"]]
+        }
+
+    def test_serializer(self):
+        message = self.factory.create("TEST", {"id": 1111111, "name": "aaa"})
+        value = message.serialize()
+        self.assertEqual(msgpack.unpackb(value, raw=False), [0, {"id": 1111111, "name": "aaa"}])
+
+    def test_retrieve(self):
+        value = self.factory.create("TEST_COMPLEX", self.complex_content).serialize()
+        m = self.factory.retrieve(value)
+        self.assertEqual(m.message_type, "TEST_COMPLEX")
+        self.assertEqual(m.content, self.complex_content)
+        self.assertEqual(m.record_field.field_2, "eee")
+
+        m = self.factory.retrieve(value, fields=["name"])
+        self.assertEqual(m.name, "aaa")
+        self.assertIsNone(m.id)
+
+        self.assertRaises(InvalidEnvelope, self.factory.retrieve, value[:-1])
+
+    def test_invalid_envelope(self):
+        for data in ("ab", [0], [0, {}, 1], {"id": 0}):
+            self.assertRaises(InvalidEnvelope, MsgPackSerializer.deserialize, msgpack.packb(data), TEST_CATALOG)
+        for data in ([99, {}], ["name", {}], [[0], {}], [True, {}], [0, None], [0, [1, "a"]]):
+            self.assertRaises(SchemaException, MsgPackSerializer.deserialize, msgpack.packb(data), TEST_CATALOG)
+        frame = msgpack.packb([0, {"id": 1, "name": "a"}]) + msgpack.packb([99, {}])
+        self.assertRaises(SchemaException, MsgPackSerializer.deserialize_many, frame, TEST_CATALOG)
+
+    def test_serialize_many(self):
+        serializer = MsgPackSerializer("TEST", TEST_CATALOG)
+        contents = [{"id": i, "name": "name %d" % i} for i in range(100)]
+        messages = serializer.serialize_many(contents)
+        frame = serializer.serialize_many(contents, framed=True)
+        self.assertEqual(frame, b"".join(messages))
+
+        for data in (messages, frame):
+            results = MsgPackSerializer.deserialize_many(data, TEST_CATALOG)
+            self.assertEqual([r[0] for r in results], contents)
+            self.assertEqual(set(r[1] for r in results), {0})
+        results = MsgPackSerializer.deserialize_many(frame, TEST_CATALOG, fields=["id"])
+        self.assertEqual(results[5][0], {"id": 5})
+        self.assertRaises(InvalidEnvelope, MsgPackSerializer.deserialize_many, frame[:-1], TEST_CATALOG)
+
+    def test_deserialize_stream(self):
+        serializer = MsgPackSerializer("TEST", TEST_CATALOG)
+        contents = [{"id": i, "name": "x" * i} for i in range(200)]
+        source = BytesIO(serializer.serialize_many(contents, framed=True))
+        results = MsgPackSerializer.deserialize_stream(source, TEST_CATALOG, read_size=64)
+        self.assertEqual([r[0] for r in results], contents)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import copy
+from unittest import TestCase, mock
+
+from clay.exceptions import InvalidEnvelope
+from clay.factory import MessageFactory
+from clay.message import Message
+from clay.serializer import AvroSerializer, JSONSerializer, MsgPackSerializer, MultiplexSerializer
+from clay.serializer.multiplex_serializer import sniff_format, AVRO, JSON, MSGPACK, HL7
+
+from tests import TEST_CATALOG, TEST_SCHEMA
+from tests.test_hl7 import ADT_A01, _HL7Serializer
+
+
+class _Multiplex(MultiplexSerializer):
+    READERS = dict(MultiplexSerializer.READERS, hl7=_HL7Serializer)
+
+
+class TestMultiplex(TestCase):
+    def setUp(self):
+        self.content = {"id": 1111111, "name": "aaa"}
+        self.factory = MessageFactory(_Multiplex, TEST_CATALOG)
+
+    def test_sniff_format(self):
+        messages = {
+            AVRO: [MessageFactory(AvroSerializer, TEST_CATALOG, **options).create("TEST", self.content).serialize()
+                   for options in ({}, {"versioned": True}, {"envelope": 2})],
+            JSON: [MessageFactory(JSONSerializer, TEST_CATALOG).create("TEST", self.content).serialize()],
+            MSGPACK: [MessageFactory(MsgPackSerializer, TEST_CATALOG).create("TEST", self.content).serialize()],
+            HL7: [ADT_A01]
+        }
+        for message_format, values in messages.items():
+            for value in values:
+                self.assertEqual(sniff_format(value), message_format)
+                if message_format != HL7:
+                    self.assertEqual(self.factory.retrieve(value).content, self.content)
+        self.assertEqual(_Multiplex.deserialize(ADT_A01, TEST_CATALOG), (ADT_A01, "ADT_A01", None))
+        self.assertRaises(InvalidEnvelope, sniff_format, b"")
+
+    def test_msgpack_prefix(self):
+        # the version 1 envelopes of the schema 73 start with the byte of the MessagePack arrays of two items
+        catalog = {"name": "MULTIPLEX_CATALOG", 73: copy.deepcopy(TEST_SCHEMA)}
+        factory = MessageFactory(_Multiplex, catalog)
+        for name in ("aaa", "n" * 59):
+            content = {"id": 1111111, "name": name}
+            value = MessageFactory(AvroSerializer, catalog).create("TEST", content).serialize()
+            self.assertEqual(value[:1], b"\x92")
+            self.assertEqual(sniff_format(value), AVRO)
+            self.assertEqual(factory.retrieve(value).content, content)
+            value = MessageFactory(MsgPackSerializer, catalog).create("TEST", content).serialize()
+            self.assertEqual(sniff_format(value), MSGPACK)
+            self.assertEqual(factory.retrieve(value).content, content)
+
+    def test_trusted_payloads(self):
+        # the payloads are adopted as the content of the messages when their format trusts them
+        avro = MessageFactory(AvroSerializer, TEST_CATALOG).create("TEST", self.content).serialize()
+        json = MessageFactory(JSONSerializer, TEST_CATALOG).create("TEST", self.content).serialize()
+        self.assertTrue(_Multiplex.trusts_payload(avro))
+        self.assertFalse(_Multiplex.trusts_payload(json))
+        for value, trusted in ((avro, True), (json, False)):
+            with mock.patch.object(Message, "adopt_content", autospec=True, side_effect=Message.adopt_content) as adopt:
+                self.assertEqual(self.factory.retrieve(value).content, self.content)
+            self.assertEqual(adopt.called, trusted)
+
+    def test_serializer(self):
+        self.assertIsInstance(_Multiplex("TEST", TEST_CATALOG).serializer, AvroSerializer)
+        value = self.factory.create("TEST", self.content).serialize()
+        self.assertEqual(value, MessageFactory(AvroSerializer, TEST_CATALOG).create("TEST", self.content).serialize())
+        self.assertEqual(self.factory.retrieve(value, fields=["id"]).content, {"id": 1111111, "name": None})
+
+        class AvroOnly(MultiplexSerializer):
+            READERS = {AVRO: AvroSerializer}
+        self.assertRaises(InvalidEnvelope, AvroOnly.deserialize, ADT_A01, TEST_CATALOG)
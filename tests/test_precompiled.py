@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import copy
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from unittest import mock
+
+from clay.factory import MessageFactory
+from clay.serializer import codegen
+from clay.serializer.avro_serializer import AvroSerializer, AvroCache
+from clay.serializer.codegen import AvroCodec, CodecCache, get_codec, is_precompiled
+from clay.serializer.precompiled import catalog_path, load_catalog, save_catalog
+
+from tests import TEST_SCHEMA, TEST_COMPLEX_SCHEMA
+
+
+class TestPrecompiled(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalog = {"name": "PRECOMPILED_CATALOG", 0: TEST_SCHEMA, 1: TEST_COMPLEX_SCHEMA}
+        codegen._PRECOMPILED.clear()
+        CodecCache().clear()
+        AvroCache().clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        codegen._PRECOMPILED.clear()
+
+    def test_save_load(self):
+        codec = get_codec(TEST_COMPLEX_SCHEMA)
+        path = save_catalog(self.directory, self.catalog)
+        self.assertEqual(path, catalog_path(self.directory, self.catalog))
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+
+        self.assertFalse(is_precompiled(TEST_COMPLEX_SCHEMA))
+        self.assertTrue(load_catalog(self.directory, self.catalog))
+        self.assertTrue(is_precompiled(TEST_COMPLEX_SCHEMA))
+        # only the codecs compiled before saving are in the compiled catalog
+        self.assertFalse(is_precompiled(TEST_SCHEMA))
+        with mock.patch.object(codegen, "_Compiler", side_effect=AssertionError):
+            loaded = AvroCodec(TEST_COMPLEX_SCHEMA)
+        self.assertEqual(loaded.source, codec.source)
+        content = {"valid": True, "id": 1, "long_id": 2, "float_id": 0.5, "double_id": 0.25, "name": "a",
+                   "array_complex_field": None, "matrix_field": [], "array_simple_field": None, "record_field": None}
+        chunks = []
+        loaded.encode(content, chunks.append)
+        self.assertEqual(codec.decode(b"".join(chunks))[0], content)
+
+        # a different catalog has a different file
+        catalog = copy.deepcopy(self.catalog)
+        catalog[0]["fields"].append({"name": "other", "type": "int"})
+        self.assertNotEqual(catalog_path(self.directory, catalog), path)
+        self.assertFalse(load_catalog(self.directory, catalog))
+        with open(path, "wb") as f:
+            f.write(b"garbage")
+        self.assertFalse(load_catalog(self.directory, self.catalog))
+
+    def test_factory(self):
+        directory = os.path.join(self.directory, "cache")
+        factory = MessageFactory(AvroSerializer, self.catalog, cache_dir=directory)
+        self.assertEqual(sorted(factory.compile_report), ["TEST", "TEST_COMPLEX"])
+        self.assertTrue(os.path.exists(catalog_path(directory, self.catalog)))
+        CodecCache().clear()
+        self.assertTrue(load_catalog(directory, self.catalog))
+        self.assertTrue(is_precompiled(TEST_SCHEMA) and is_precompiled(TEST_COMPLEX_SCHEMA))
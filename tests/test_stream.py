@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import socket
+import threading
+from unittest import TestCase
+
+from clay.exceptions import InvalidEnvelope
+from clay.factory import MessageFactory
+from clay.serializer.avro_serializer import AvroSerializer
+from clay.stream import StreamReader, StreamWriter
+
+from tests import TEST_CATALOG
+
+
+class _ReadOnlySource(object):
+    # a file-like object without readinto
+    def __init__(self, data):
+        self.read = io.BytesIO(data).read
+
+
+class TestStream(TestCase):
+    def setUp(self):
+        self.factory = MessageFactory(AvroSerializer, TEST_CATALOG)
+        self.contents = [{"id": i, "name": "n" * (i * 7)} for i in range(100)]
+        self.messages = [self.factory.create("TEST", c).serialize() for c in self.contents]
+        out = io.BytesIO()
+        writer = StreamWriter(out)
+        for message in self.messages:
+            writer.write(message)
+        self.stream = out.getvalue()
+
+    def test_read(self):
+        # the chunks are smaller than most of the messages, so the buffer is refilled and enlarged
+        for source in (_ReadOnlySource(self.stream), io.BytesIO(self.stream)):
+            self.assertEqual(list(StreamReader(source, chunk_size=16)), self.messages)
+        retrieved = StreamReader(io.BytesIO(self.stream)).retrieve(self.factory)
+        self.assertEqual([m.content for m in retrieved], self.contents)
+
+    def test_frame(self):
+        frame = AvroSerializer("TEST", TEST_CATALOG).serialize_many(self.contents, framed=True)
+        out = io.BytesIO()
+        StreamWriter(out).write_frame(frame)
+        self.assertEqual(out.getvalue(), self.stream)
+
+    def test_invalid_stream(self):
+        self.assertEqual(list(StreamReader(io.BytesIO(b""))), [])
+        self.assertRaises(InvalidEnvelope, list, StreamReader(io.BytesIO(self.stream[:-1])))
+        self.assertRaises(InvalidEnvelope, list, StreamReader(io.BytesIO(b"\x80")))
+        self.assertRaises(InvalidEnvelope, list, StreamReader(io.BytesIO(self.stream), max_message_size=100))
+
+    def test_socket(self):
+        server, client = socket.socketpair()
+
+        def send():
+            writer = StreamWriter(server)
+            for message in self.messages:
+                writer.write(message)
+            server.close()
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        try:
+            self.assertEqual(list(StreamReader(client, chunk_size=64)), self.messages)
+        finally:
+            thread.join()
+            client.close()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012-2015, CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from unittest import TestCase
+
+from clay.exceptions import SchemaException, InvalidEnvelope
+from clay.factory import MessageFactory
+from clay.serializer import StructSerializer
+
+from tests import TEST_CATALOG
+
+METERING_CATALOG = {
+    "name": "METERING_CATALOG",
+    0: {"namespace": "METERING", "name": "READING", "type": "record", "fields": [
+        {"name": "meter", "type": "string", "max_length": 16},
+        {"name": "timestamp", "type": "long"},
+        {"name": "value", "type": "double"},
+        {"name": "quality", "type": "float"},
+        {"name": "phase", "type": "int"},
+        {"name": "valid", "type": "boolean"},
+        {"name": "raw", "type": "bytes", "max_length": 4}
+    ]},
+    1: {"namespace": "METERING", "name": "ALARM", "type": "record", "fields": [
+        {"name": "meter", "type": "string"},
+        {"name": "code", "type": "int"}
+    ]}
+}
+
+
+class TestStruct(TestCase):
+    def setUp(self):
+        self.factory = MessageFactory(StructSerializer, METERING_CATALOG)
+        self.content = {"meter": "M\xe8-01", "timestamp": 10 ** 12, "value": 1.5, "quality": 0.25, "phase": -3,
+                        "valid": True, "raw": b"\x00\x01"}
+
+    def test_serializer(self):
+        value = self.factory.create("READING", self.content).serialize()
+        self.assertEqual(len(value), 4 + 17 + 8 + 8 + 4 + 4 + 1 + 5)
+        self.assertEqual(value[:4], b"\x00\x00\x00\x00")
+        m = self.factory.retrieve(value)
+        self.assertEqual(m.message_type, "READING")
+        self.assertEqual(m.content, self.content)
+
+        value = self.factory.create("ALARM", {"meter": "M-02", "code": 7}).serialize()
+        self.assertEqual(len(value), 4 + 256 + 4)
+        self.assertEqual(self.factory.retrieve(value, fields=["code"]).content, {"meter": None, "code": 7})
+
+        self.assertRaises(InvalidEnvelope, self.factory.retrieve, value[:-1])
+
+    def test_invalid_datum(self):
+        serializer = StructSerializer("READING", METERING_CATALOG)
+        for key, value in (("meter", "M" * 17), ("raw", "\x00"), ("phase", "1"), ("timestamp", None)):
+            content = dict(self.content, **{key: value})
+            self.assertRaises(SchemaException, serializer.serialize, content)
+
+    def test_unsupported_schema(self):
+        self.assertRaises(SchemaException, MessageFactory, StructSerializer, TEST_CATALOG)
+        catalog = {"name": "STRUCT_INVALID", 0: {"namespace": "TESTS", "name": "LONG_STRING", "type": "record",
+                                                 "fields": [{"name": "s", "type": "string", "max_length": 256}]}}
+        self.assertRaises(SchemaException, MessageFactory, StructSerializer, catalog)
+
+    def test_serialize_many(self):
+        serializer = StructSerializer("ALARM", METERING_CATALOG)
+        contents = [{"meter": "M-%d" % i, "code": i} for i in range(10)]
+        messages = serializer.serialize_many(contents)
+        frame = serializer.serialize_many(contents, framed=True)
+        self.assertEqual(frame, b"".join(messages))
+        self.assertEqual(messages[3], serializer.serialize(contents[3]))
+        for data in (messages, frame):
+            self.assertEqual([r[0] for r in StructSerializer.deserialize_many(data, METERING_CATALOG)], contents)
+        self.assertRaises(InvalidEnvelope, StructSerializer.deserialize_many, frame[:-1], METERING_CATALOG)